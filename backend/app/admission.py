@@ -0,0 +1,193 @@
+"""
+admission.py
+────────────
+Admission control and fair queuing for workflows and the resources they
+share (LLM generations, browser workers, code sandboxes, shells).
+
+`FairSemaphore` is a semaphore with one FIFO per session, served round
+robin, so one client that submits many steps (or opens many tabs) cannot
+starve the others. Waiters can be told their queue position as it
+changes, and a semaphore with `max_queue` rejects new waiters with
+`QueueFull` instead of letting the backlog grow without bound.
+
+    async with WORKFLOW_GATE.slot(session, on_position=notify):   # may raise QueueFull
+        ...
+    async with LLM_GATE.slot():       # session taken from `current_session`
+        ...
+
+Gates
+-----
+  WORKFLOW_GATE   MAX_CONCURRENT_WORKFLOWS running, WORKFLOW_QUEUE_LIMIT waiting
+  LLM_GATE        LLM_CONCURRENCY Ollama generations in flight
+  tools           dag_scheduler.ToolLimiter – one FairSemaphore per tool
+                  (browser, code_interpreter = sandbox, shell_terminal)
+
+The session of the running workflow is kept in the `current_session`
+context variable, which asyncio copies into every task the workflow
+starts, so steps and LLM calls queue under the right session without
+passing it around.
+"""
+
+from __future__ import annotations
+import asyncio
+import contextvars
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+from .metrics import callback, counter, histogram
+
+MAX_CONCURRENT_WORKFLOWS = int(os.getenv("MAX_CONCURRENT_WORKFLOWS", "4"))
+WORKFLOW_QUEUE_LIMIT     = int(os.getenv("WORKFLOW_QUEUE_LIMIT", "16"))
+LLM_CONCURRENCY          = int(os.getenv("LLM_CONCURRENCY", "2"))
+
+current_session: contextvars.ContextVar[str] = contextvars.ContextVar("current_session", default="anonymous")
+
+OnPosition = Callable[[int, int], Awaitable[None]]   # (position, queue length) → None
+
+ADMISSION_WAIT     = histogram("admission_wait_seconds", "Time spent queued for a slot.", ("resource",))
+ADMISSION_REJECTED = counter("admission_rejected_total", "Requests rejected because the queue was full.", ("resource",))
+
+SEMAPHORES: list["FairSemaphore"] = []      # every instance, for stats and metrics
+
+
+class QueueFull(Exception):
+    def __init__(self, name: str, queued: int):
+        super().__init__(f"{name} queue is full ({queued} waiting)")
+        self.name = name
+        self.queued = queued
+
+
+class _Waiter:
+    __slots__ = ("session", "future", "on_position", "position")
+
+    def __init__(self, session: str, future: asyncio.Future, on_position: Optional[OnPosition]):
+        self.session = session
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+
+
+class FairSemaphore:
+    def __init__(self, name: str, slots: int, max_queue: int | None = None):
+        self.name = name
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.active = 0
+        self._queues: "OrderedDict[str, deque[_Waiter]]" = OrderedDict()   # served front to back
+        self._callbacks: set[asyncio.Task] = set()
+        SEMAPHORES.append(self)
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def order(self) -> list[_Waiter]:
+        """Waiters in the order they will be served (round robin over sessions)."""
+        out, queues = [], [list(q) for q in self._queues.values()]
+        for i in range(max((len(q) for q in queues), default=0)):
+            out.extend(q[i] for q in queues if i < len(q))
+        return out
+
+    @asynccontextmanager
+    async def slot(self, session: str | None = None, on_position: Optional[OnPosition] = None):
+        await self.acquire(session, on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, session: str | None = None, on_position: Optional[OnPosition] = None):
+        if self.active < self.slots and not self._queues:
+            self.active += 1
+            return
+        if self.max_queue is not None and self.queued >= self.max_queue:
+            ADMISSION_REJECTED.inc(resource=self.name)
+            raise QueueFull(self.name, self.queued)
+
+        session = session or current_session.get()
+        waiter = _Waiter(session, asyncio.get_running_loop().create_future(), on_position)
+        self._queues.setdefault(session, deque()).append(waiter)
+        self._notify()
+        started = time.monotonic()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()              # granted just as we were cancelled – pass it on
+            else:
+                self._remove(waiter)
+            raise
+        ADMISSION_WAIT.observe(time.monotonic() - started, resource=self.name)
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def resize(self, slots: int):
+        """Changes the number of slots; waiters are admitted at once if it grew."""
+        self.slots = max(1, slots)
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "sessions_waiting": len(self._queues),
+        }
+
+    def _wake(self):
+        while self.active < self.slots and self._queues:
+            session, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session)      # next session's turn
+            else:
+                del self._queues[session]
+            if waiter.future.done():                   # cancelled while queued
+                continue
+            waiter.future.set_result(None)
+            self.active += 1
+        self._notify()
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.session)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.session]
+        self._notify()
+
+    def _notify(self):
+        """Tells every waiter whose position changed where it now stands."""
+        order = self.order()
+        for position, waiter in enumerate(order, 1):
+            if waiter.on_position is None or waiter.position == position:
+                continue
+            waiter.position = position
+            task = asyncio.create_task(self._call(waiter.on_position, position, len(order)))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    async def _call(self, fn: OnPosition, position: int, total: int):
+        try:
+            await fn(position, total)
+        except Exception as e:
+            print(f"[admission] position update failed: {e}")
+
+
+WORKFLOW_GATE = FairSemaphore("workflow", MAX_CONCURRENT_WORKFLOWS, max_queue=WORKFLOW_QUEUE_LIMIT)
+LLM_GATE      = FairSemaphore("llm", LLM_CONCURRENCY)
+
+
+def admission_stats() -> dict:
+    return {s.name: s.stats() for s in SEMAPHORES}
+
+callback("admission_active", "Slots in use.", ("resource",),
+         lambda: {(s.name,): s.active for s in SEMAPHORES})
+callback("admission_queued", "Requests waiting for a slot.", ("resource",),
+         lambda: {(s.name,): s.queued for s in SEMAPHORES})
@@ -8,56 +8,89 @@ import json
 import re
 import time # Import time for potential delays if needed
 
-# Attempt to import json_repair, warn if not available
-try:
-    from json_repair import repair_json
-    JSON_REPAIR_AVAILABLE = True
-except ImportError:
-    JSON_REPAIR_AVAILABLE = False
-    print("Warning: 'json-repair' library not found. Run 'pip install json-repair' for better JSON parsing robustness.")
-    def repair_json(s): # Define a dummy function if library is missing
-        return s # Just return the original string
-
 from .prompt_template import SYSTEM_PROMPT
 from .llm_handler import (
-    simple_prompt,          # ← replacement for send_prompt
-    chat,                   # ← replacement for send_prompt_with_functions
+    asimple_prompt,         # ← async replacement for send_prompt / send_prompt_with_functions
+    astream_prompt,         # ← token streaming for planner / correction calls
+    RESIDENCY,              # ← preloads the model upcoming steps need
     PLANNING_TOOLING_MODEL,
     DEEPCODER_MODEL
 )
 
+from .dag_scheduler import PlanGraph, ToolLimiter, TOOL_CONCURRENCY
+from .error_classifier import legacy_error_scan, local_fix
+from .events import send_event
+from .journal import JournalState, WorkflowJournal, new_workflow_id
+from .plan_parser import (
+    JSON_REPAIR_AVAILABLE,
+    PlanStreamParser,
+    parse_correction,
+    parse_plan_text,
+)
+from .session import SessionContext
+from .step_results import REVIEW_OUTPUT_TOKENS, StepResultStore, compress
+from .tool_cache import ToolResultCache
+from .metrics import callback, counter, histogram, span
 from .tools.shell_terminal         import execute_shell_command         as execute_shell_command_impl
 from .tools.code_interpreter       import execute_python_code          as execute_python_code_impl
+from .tools.dependencies           import pip_install
 from .tools.browseruse_integration import browse_website               as browse_website_impl
+from .tools.tool_result import ToolResult
+
+if not JSON_REPAIR_AVAILABLE:
+    print("Warning: 'json-repair' library not found. Run 'pip install json-repair' for better JSON parsing robustness.")
 
 # -------------------------------------------------------------------
 # Configuration
 # -------------------------------------------------------------------
 TASK_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "tasks"))
 os.makedirs(TASK_DIR, exist_ok=True)
-MAX_RETRIES = 2
-# Overall workflow step limit
-MAX_WORKFLOW_STEPS = 10  # <<< SET YOUR DESIRED OVERALL STEP LIMIT HERE
+# Retry and overall step limits are per session: SessionContext.max_retries /
+# max_steps (defaults from env MAX_STEP_RETRIES / MAX_WORKFLOW_STEPS)
 # Suggestion for the browser agent's internal step limit (adjust as needed)
 BROWSER_STEP_LIMIT_SUGGESTION = 15
+# How often streamed LLM tokens are flushed to the UI (seconds)
+STREAM_FLUSH_SECONDS = 0.25
+# Caps concurrent steps per tool (e.g. one browser, several code runs)
+TOOL_LIMITER = ToolLimiter(TOOL_CONCURRENCY)
+# How many not-yet-started steps to look at when preloading models
+MODEL_LOOKAHEAD = 2
+# Opt-in (TOOL_CACHE=1) cache of deterministic tool results, shared across sessions
+TOOL_CACHE = ToolResultCache(os.path.join(TASK_DIR, ".cache"))
+
+# Metrics (stage latencies are recorded by the spans below)
+TOOL_ATTEMPTS    = counter("agent_tool_attempts_total", "Tool calls by outcome.", ("tool", "outcome"))
+TOOL_ERRORS      = counter("agent_tool_errors_total", "Failed tool calls by error kind.", ("tool", "kind"))
+LLM_CALLS_AVOIDED = counter("agent_llm_calls_avoided_total",
+                            "Correction round-trips not needed: fixed by a local rule, or a success "
+                            "the old substring check would have reviewed.", ("reason",))
+WORKFLOWS        = counter("agent_workflows_total", "Finished workflows by outcome.", ("outcome",))
+REPLANS          = counter("agent_replans_total", "Plan revisions by trigger and outcome.", ("trigger", "outcome"))
+WORKFLOW_SECONDS = histogram("agent_workflow_seconds", "End-to-end workflow duration.", ("outcome",),
+                             buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600))
+callback("tool_cache_events_total", "Tool result cache lookups.", ("tool", "event"),
+         lambda: {(tool, event): n for tool, counts in TOOL_CACHE.counters.items()
+                  for event, n in counts.items()}, kind="counter")
 # -------------------------------------------------------------------
 
 # -------------------------------------------------------------------
 # Helper: Send Task List Update
 # -------------------------------------------------------------------
 async def send_task_update(websocket, tasks_with_status):
-    """Formats tasks with status and sends via WebSocket."""
+    """
+    Sends the task list as a `tasks` event. An EventChannel forwards only
+    the steps that changed since the client's last update (keyed by step
+    id); other sockets get the full list as before.
+    """
     # tasks_with_status should be a list of dicts:
     # [{'description': '...', 'status': 'pending|running|done|error'}, ...]
     try:
         # Ensure keys expected by frontend are present
         tasks_for_ui = [
-            {"description": t.get("description", "Unnamed Task"), "status": t.get("status", "pending")}
-            for t in tasks_with_status
+            {"id": i, "description": t.get("description", "Unnamed Task"), "status": t.get("status", "pending")}
+            for i, t in enumerate(tasks_with_status)
         ]
-        payload = json.dumps(tasks_for_ui)
-        await websocket.send_text(f"Agent Task Update:{payload}")
-        # print(f"DEBUG: Sent task update: {payload}") # Optional debug
+        await send_event(websocket, {"type": "tasks", "tasks": tasks_for_ui})
     except Exception as e:
         print(f"Error sending task update: {e}")
         try:
@@ -66,66 +99,66 @@ async def send_task_update(websocket, tasks_with_status):
         except:
              pass # Ignore error if websocket is already closed
 
+# -------------------------------------------------------------------
+# Helper: Stream a planning-model completion to the UI
+# -------------------------------------------------------------------
+async def stream_planner_output(prompt: str, websocket, on_text=None, *,
+                                model: str = PLANNING_TOOLING_MODEL,
+                                use_cache: bool = True, similar: str | None = None) -> str:
+    """
+    Streams the planning model's output, forwarding partial text to the UI
+    as `Agent Stream:` frames (batched every STREAM_FLUSH_SECONDS).
+    `on_text` is called with every token. Returns the full completion;
+    raises RuntimeError if the stream fails. `use_cache=False` bypasses the
+    LLM response cache; `similar` (the user query) enables its semantic tier.
+    """
+    loop = asyncio.get_running_loop()
+    parts, unsent = [], []
+    last_flush = loop.time()
+    async for token in astream_prompt(model, prompt, system=SYSTEM_PROMPT,
+                                      cache=use_cache, similar=similar):
+        parts.append(token)
+        unsent.append(token)
+        if on_text:
+            on_text(token)
+        if loop.time() - last_flush >= STREAM_FLUSH_SECONDS:
+            await websocket.send_text("Agent Stream:" + "".join(unsent))
+            unsent.clear()
+            last_flush = loop.time()
+    if unsent:
+        await websocket.send_text("Agent Stream:" + "".join(unsent))
+    return "".join(parts)
+
+# -------------------------------------------------------------------
+# Helper: Which Ollama model a plan step will load
+# -------------------------------------------------------------------
+def model_for_step(task: dict, ctx: SessionContext) -> str | None:
+    """
+    The model a step will need in this session: the browser model for
+    browser steps; for shell_terminal / code_interpreter (which run without
+    one) the planner model that corrects them if they fail (review_and_resolve).
+    """
+    tool = task.get("tool")
+    if tool == "browser":
+        return ctx.browser_model
+    if tool in ("shell_terminal", "code_interpreter"):
+        return ctx.planner_model
+    return None
+
 # -------------------------------------------------------------------
 # Step 0: Parse the JSON plan produced by the LLM
 # -------------------------------------------------------------------
 def parse_plan(plan_json: str):
     """
     Parse the LLM's plan JSON into a list of task dicts.
-    Attempts to repair JSON before parsing.
+    Uses the incremental parser: fences/chatter are skipped, each task
+    object is decoded once and only a malformed fragment is repaired.
     Raises if invalid JSON or unexpected format.
     Returns a list of dictionaries, e.g., [{'tool': 'shell', 'command': ['ls']}]
     """
     original_plan_json = plan_json # Keep original for error messages
     try:
-        # Clean potential markdown code fences first
-        plan_json_cleaned = re.sub(r'^```json\s*|\s*```$', '', plan_json, flags=re.MULTILINE | re.DOTALL).strip()
-        if not plan_json_cleaned:
-             raise ValueError("Received empty plan after cleaning.")
-
-        repaired_json_string = ""
-        parsed_plan = None
-        try:
-            # Attempt to repair the JSON string first (if library available)
-            repaired_json_string = repair_json(plan_json_cleaned)
-            parsed_plan = json.loads(repaired_json_string)
-        except Exception as repair_or_load_error:
-            print(f"Warning: Failed to parse potentially repaired JSON ({repair_or_load_error}). Falling back to original.")
-            # Fallback: try parsing the cleaned original string directly
-            try:
-                 parsed_plan = json.loads(plan_json_cleaned)
-            except json.JSONDecodeError as final_decode_error:
-                 # Raise the more informative error if both fail
-                 error_detail = f"Invalid JSON plan received (JSONDecodeError: {final_decode_error})"
-                 if repaired_json_string and repaired_json_string != plan_json_cleaned:
-                      error_detail += f"\nRepair attempt output (may be invalid):\n{repaired_json_string[:500]}..." # Show snippet of repair attempt
-                 raise ValueError(error_detail) from final_decode_error
-
-        if parsed_plan is None: # Should not happen if exceptions are caught, but safeguard
-             raise ValueError("Failed to parse JSON plan after cleaning and repair attempts.")
-
-        # ===>>> Rest of the validation logic remains the same <<<===
-        if not isinstance(parsed_plan, list):
-             if isinstance(parsed_plan, dict) and all(k in parsed_plan for k in ['tool', 'description']):
-                 print("Warning: LLM returned a single task dict, wrapping in a list.")
-                 parsed_plan = [parsed_plan]
-             else:
-                 raise ValueError("Plan is not a list of tasks.")
-
-        validated_tasks = []
-        for idx, task in enumerate(parsed_plan):
-             if not isinstance(task, dict):
-                 raise ValueError(f"Item at index {idx} in plan is not a dictionary: {task}")
-             if 'tool' not in task:
-                 raise ValueError(f"Task at index {idx} is missing 'tool' key: {task}")
-             # Ensure description exists, provide a default if missing
-             if 'description' not in task or not task.get('description'):
-                 print(f"Warning: Task at index {idx} missing description. Generating default.")
-                 task['description'] = f"Execute {task.get('tool', 'unknown tool')} step {idx+1}"
-             validated_tasks.append(task)
-
-        return validated_tasks
-
+        return parse_plan_text(plan_json)
     except ValueError as e: # Catch errors from validation or repair failure message
          # Ensure the original raw plan is included in the error message
          raise ValueError(f"Invalid plan structure or failed repair: {e}\nOriginal Plan JSON:\n{original_plan_json}") from e
@@ -133,257 +166,592 @@ def parse_plan(plan_json: str):
 # -------------------------------------------------------------------
 # Step 1b: Review & auto‑repair a failing tool invocation
 # -------------------------------------------------------------------
-async def review_and_resolve(task: dict, result: str, attempt: int, websocket):
+async def review_and_resolve(task: dict, result: ToolResult, attempt: int, websocket, ctx: SessionContext,
+                             context: str = ""):
     """
-    If `result` contains error indicators and we haven't exhausted retries,
-    ask the LLM to return one corrected JSON tool call.
+    If `result` is a failure and we haven't exhausted retries, ask the LLM
+    to return one corrected JSON tool call. `context` holds earlier steps'
+    (compressed) outputs; the failing output is compressed too so the
+    prompt stays short. Never served from the LLM cache: a bad correction
+    would come back for every later run that hits the same error.
     Returns the corrected task dict or None.
     """
-    # More robust error check - look for common error indicators
-    is_error = any(err_indicator in result.lower() for err_indicator in
-                   ["error:", "failed", "exception", "traceback", "exit code: 1", "command not found", "module not found"])
-
-    if is_error and attempt < MAX_RETRIES:
+    if not result.ok and attempt < ctx.max_retries:
         task_desc = task.get("description", f"Execute {task.get('tool', 'unknown tool')}")
 
         prompt = (
-            f"The following agent step failed (Attempt {attempt + 1}/{MAX_RETRIES}):\n"
+            f"The following agent step failed (Attempt {attempt + 1}/{ctx.max_retries}):\n"
             f"**Task:** {task_desc}\n"
             f"**Tool Call JSON:**\n```json\n{json.dumps(task, indent=2)}\n```\n\n"
-            f"**Output/Error:**\n```\n{result}\n```\n\n"
+            f"**Output/Error** ({result.error_kind}):\n```\n{compress(result.text, REVIEW_OUTPUT_TOKENS, keep='tail')}\n```\n\n"
+            + (f"**Results of earlier steps:**\n```\n{context}\n```\n\n" if context else "") +
             "Analyze the error and the original tool call. Provide **only** the corrected JSON tool call needed to fix the error and achieve the original task goal. Maintain the original 'description' field if present. Your output must be **only** valid JSON, without any markdown fences."
         )
         await websocket.send_text(f"Agent: Reviewing failure (attempt {attempt + 1}) and trying to resolve...")
-        corrected_json_str = send_prompt_with_functions(
-            model_name=PLANNING_TOOLING_MODEL, # Use planning model for correction
-            prompt=prompt,
-            system_message=SYSTEM_PROMPT # Provide context
-        )
+        try:
+            # Planning model streams its correction so the user sees progress
+            corrected_json_str = await stream_planner_output(prompt, websocket, model=ctx.planner_model,
+                                                             use_cache=False)
+        except RuntimeError as e:
+            print(f"Correction stream failed: {e}")
+            corrected_json_str = None
 
         if not corrected_json_str:
             await websocket.send_text("Agent Error: LLM failed to provide a correction.")
             return None
 
         try:
-            # Clean potential markdown code fences and parse
-            corrected_json_str = re.sub(r'^```json\s*|\s*```$', '', corrected_json_str, flags=re.MULTILINE | re.DOTALL).strip()
-            if not corrected_json_str:
-                 raise ValueError("LLM returned empty correction string.")
-
-            # Try to repair potential minor issues in correction
-            repaired_correction = repair_json(corrected_json_str)
-            corrected_task = json.loads(repaired_correction)
-
-            # Basic validation of the correction
-            if not isinstance(corrected_task, dict) or 'tool' not in corrected_task:
-                raise ValueError("Correction is not a valid task dictionary (missing 'tool' key).")
-            # Ensure description exists in correction, copying from original if needed
-            if 'description' not in corrected_task or not corrected_task.get('description'):
-                 corrected_task['description'] = task.get('description', f"Execute {corrected_task.get('tool', 'unknown tool')} (corrected)")
-
+            # Same incremental parser as the plan; description falls back to the original
+            corrected_task = parse_correction(corrected_json_str, task.get('description'))
             await websocket.send_text("Agent: Received potential correction from LLM.")
             return corrected_task
-        except (json.JSONDecodeError, ValueError) as e:
+        except ValueError as e:
             await websocket.send_text(f"Agent Error: Failed to parse LLM correction: {e}\nRaw correction:\n{corrected_json_str}")
             return None # Failed to parse correction
     return None # No error or max retries reached
 
+# -------------------------------------------------------------------
+# Step 1c: Revise the steps that have not started yet
+# -------------------------------------------------------------------
+def same_call(a: dict, b: dict) -> bool:
+    """True when two steps make the same tool call (description / id / depends_on aside)."""
+    ignore = {"description", "id", "depends_on"}
+    return {k: v for k, v in a.items() if k not in ignore} == {k: v for k, v in b.items() if k not in ignore}
+
+async def revise_plan(user_query: str, tasks_with_status: list, remaining: list, failed_idx: int | None,
+                      step_results: StepResultStore, websocket, ctx: SessionContext):
+    """
+    Asks the planning model whether the steps in `remaining` (indices, not
+    started yet) still fit what the finished steps produced – after a step
+    failed for good, or after every step (ctx.replan). One short,
+    non-streamed, uncached call over the compressed results. Returns the
+    steps to run instead (possibly []), or None to keep the plan as it is.
+    """
+    finished = list(step_results.results)
+    prompt = (
+        f"Original request: '{user_query}'\n\n"
+        "A plan for this request is being executed. Finished steps and their (shortened) results:\n"
+        f"```\n{step_results.context_for(len(tasks_with_status), finished) or '(none)'}\n```\n\n"
+    )
+    if failed_idx is not None:
+        failed = tasks_with_status[failed_idx]
+        prompt += (
+            f"**Failed step:** {failed['description']}\n"
+            f"```\n{compress(failed['result'] or '', REVIEW_OUTPUT_TOKENS, keep='tail')}\n```\n\n"
+        )
+    prompt += (
+        "Steps not started yet:\n"
+        f"```json\n{json.dumps([tasks_with_status[i]['original_task'] for i in remaining], indent=1)}\n```\n\n"
+        "If these steps will still achieve the request, answer exactly KEEP. Otherwise output **only** the JSON list "
+        "of steps to run instead, in the plan format (`tool`, `description`, tool parameters, optional `id` and "
+        "`depends_on`). Do not repeat finished steps; `depends_on` may name them. Output [] if nothing more is needed."
+    )
+    try:
+        answer = await asimple_prompt(ctx.planner_model, prompt, system=SYSTEM_PROMPT, cache=False)
+    except Exception as e:
+        print(f"[replan] revision call failed: {e}")
+        answer = None
+    if not answer or answer.strip().strip('"').upper().startswith("KEEP"):
+        return None
+    try:
+        return parse_plan_text(answer)
+    except ValueError as e:
+        await websocket.send_text(f"Agent Error: Could not parse the revised plan: {e}")
+        return None
+
+# -------------------------------------------------------------------
+# Step 1a: Stream the plan, handing over tasks as they complete
+# -------------------------------------------------------------------
+async def stream_plan(planning_prompt: str, websocket, plan_queue: asyncio.Queue,
+                      ctx: SessionContext, user_query: str | None = None):
+    """
+    Producer side of the workflow. Streams the planner's answer and puts
+    each validated task dict on `plan_queue` as soon as its JSON object
+    closes. Ends with `None`, or with the ValueError that broke planning.
+    """
+    parser = PlanStreamParser()
+
+    def on_text(token: str):
+        for task in parser.feed(token):
+            plan_queue.put_nowait(task)
+
+    try:
+        try:
+            with span("planning"):
+                plan_json = await stream_planner_output(planning_prompt, websocket, on_text,
+                                                        model=ctx.planner_model,
+                                                        use_cache=ctx.use_cache, similar=user_query)
+        except RuntimeError as e:
+            raise ValueError(f"LLM failed to generate a plan. ({e})") from e
+
+        if not plan_json:
+            raise ValueError("LLM failed to generate a plan.")
+
+        # Salvage a truncated tail (repair runs on that fragment only)
+        for task in parser.close():
+            plan_queue.put_nowait(task)
+        if parser.emitted == 0 and (parser.failed or not parser.saw_json):
+            parse_plan(plan_json) # Raises the descriptive planning error
+        if parser.failed:
+            print(f"Warning: Ignoring {len(parser.failed)} malformed plan fragment(s).")
+            await websocket.send_text("Agent: Warning – ignored an incomplete or malformed part of the plan.")
+        plan_queue.put_nowait(None)
+    except Exception as e:
+        plan_queue.put_nowait(e) # Re-raised by the consumer
+
+# -------------------------------------------------------------------
+# Step 2: Execute one tool call
+# -------------------------------------------------------------------
+async def invoke_tool(task: dict, idx: int, websocket, ctx: SessionContext, context: str = "") -> ToolResult:
+    """
+    Runs one tool call from the plan and returns its ToolResult, served
+    from TOOL_CACHE when an identical deterministic call was seen.
+    """
+    rule, cached = TOOL_CACHE.lookup(task)
+    if cached is not None:
+        TOOL_ATTEMPTS.inc(tool=task.get("tool"), outcome="cached")
+        await websocket.send_text(f"Agent: Step {idx+1} result served from tool cache.")
+        return ToolResult.from_text(cached)
+    with span("tool", task.get("tool")):
+        result = ToolResult.coerce(await _dispatch_tool(task, idx, websocket, ctx, context))
+    TOOL_CACHE.record(rule, result.text)
+    return result
+
+async def _dispatch_tool(task: dict, idx: int, websocket, ctx: SessionContext, context: str = "") -> ToolResult:
+    """
+    Dispatches one tool call to its implementation, with the session's
+    model choices; the browser also gets earlier steps' results.
+    """
+    tool = task.get("tool")
+    if tool == "shell_terminal":
+        cmd_list = task.get("command", [])
+        full_cmd = " ".join(cmd_list)
+        tool_input_desc = f"`{' '.join(cmd_list)}`"
+        await websocket.send_text(f"Agent: Executing shell command: {tool_input_desc}")
+        return await execute_shell_command_impl(full_cmd, websocket)
+
+    if tool == "code_interpreter":
+        code = task.get("code", "")
+        tool_input_desc = f"Python code snippet (approx {len(code)} chars)"
+        await websocket.send_text(f"Agent: Executing {tool_input_desc}")
+        return await execute_python_code_impl(code, websocket)
+
+    if tool == "browser":
+        inp = task.get("input") or task.get("browser_input", "")
+        # Prepend the step limit suggestion
+        browser_instructions = (
+            f"Please complete the following task efficiently, aiming for roughly {BROWSER_STEP_LIMIT_SUGGESTION} internal actions or fewer. "
+            f"If you anticipate exceeding this limit significantly, stop and return the results gathered so far.\n\n"
+            f"Original Task Instruction: {inp}"
+        )
+        tool_input_desc = f"Browser instruction: '{inp[:100]}...'"
+        await websocket.send_text(f"Agent: Executing {tool_input_desc} (Limit Suggestion: {BROWSER_STEP_LIMIT_SUGGESTION})")
+        return await browse_website_impl(browser_instructions, websocket, browser_model=ctx.browser_model,
+                                          context_hint=context or None)
+
+    await websocket.send_text(f"Agent Error: Step {idx+1} specifies unknown tool '{tool}'.")
+    return ToolResult.error("unknown_tool", f"Error: Unknown tool '{tool}' specified in plan.")
+
+async def run_step(idx: int, tasks_with_status: list, websocket, plan_complete: bool,
+                   ctx: SessionContext, context: str = "", journal: WorkflowJournal | None = None):
+    """
+    Runs plan step `idx` with its self-repair loop and records the outcome
+    in tasks_with_status[idx] ('done' or 'error'). Each attempt holds the
+    tool's concurrency slot (queued fairly across sessions); the step shows
+    as 'running' once it gets one. `context` (earlier steps' outputs, from
+    the StepResultStore) goes to the browser tool and to review_and_resolve.
+    Failures with a known mechanical fix (error_classifier) are repaired
+    without asking the LLM. Attempts, corrections and the result go to the
+    workflow's `journal`.
+    """
+    journal = journal or WorkflowJournal("", enabled=False)
+    task_info = tasks_with_status[idx]
+    current_task_dict = task_info['original_task'].copy() # Use a copy for the retry loop
+    step_result = None # ToolResult of the last attempt for this step
+    applied_rules = set() # Local fixes already tried for this step
+    final_task_executed_this_step = current_task_dict # Track the last version executed
+
+    async def on_position(position: int, queued: int):
+        if task_info['status'] != 'running':
+            await websocket.send_text(
+                f"Agent: Step {idx + 1} is waiting for a free {tool} slot (position {position} of {queued})."
+            )
+
+    # Retry loop for self‑repair
+    for attempt in range(ctx.max_retries + 1):
+        tool = current_task_dict.get("tool")
+
+        try:
+            async with TOOL_LIMITER.slot(tool, on_position):
+                if task_info['status'] != 'running':
+                    # --- Update UI: Mark as Running ---
+                    task_info['status'] = 'running'
+                    await send_task_update(websocket, tasks_with_status)
+                    planned_total = f"{len(tasks_with_status)}" if plan_complete else f"{len(tasks_with_status)}+"
+                    await websocket.send_text(f"**Agent: Starting Step {idx + 1}/**{planned_total}: {task_info['description']}")
+                journal.record("attempt", idx=idx, attempt=attempt + 1, task=current_task_dict)
+                current_attempt_result = await invoke_tool(current_task_dict, idx, websocket, ctx, context)
+
+            # The tool decided whether this attempt failed (exit code, timeout, …)
+            step_result = current_attempt_result # Store result of this attempt
+            TOOL_ATTEMPTS.inc(tool=tool, outcome="ok" if step_result.ok else "error")
+
+            if step_result.ok:
+                if legacy_error_scan(step_result.text):
+                    LLM_CALLS_AVOIDED.inc(reason="not_an_error")
+                final_task_executed_this_step = current_task_dict # Update last successfully executed version
+                break # Exit retry loop on success
+
+            # Error occurred, try to correct if retries remain
+            TOOL_ERRORS.inc(tool=tool, kind=step_result.error_kind)
+            await websocket.send_text(f"Agent: Step {idx + 1} encountered an error (Attempt {attempt + 1}, {step_result.error_kind}).")
+            fix = local_fix(current_task_dict, step_result) if attempt < ctx.max_retries else None
+            if fix and fix.rule not in applied_rules:
+                applied_rules.add(fix.rule)
+                await websocket.send_text(f"Agent: {fix.note}.")
+                if fix.install and not await pip_install(fix.install, websocket):
+                    # Re-running would fail the same way: let the reviewer see the error
+                    await websocket.send_text(f"Agent: Could not install '{fix.install}'.")
+                    fix = None
+            else:
+                fix = None
+            if fix:
+                # Known mechanical fix – no LLM round-trip
+                LLM_CALLS_AVOIDED.inc(reason=fix.rule)
+                corrected_task_dict = fix.task
+                correction_source = fix.rule
+            else:
+                with span("review", tool):
+                    corrected_task_dict = await review_and_resolve(current_task_dict, step_result, attempt, websocket, ctx, context)
+                correction_source = "llm"
+
+            if corrected_task_dict:
+                await websocket.send_text(f"Agent: Applying correction for step {idx + 1}.")
+                journal.record("correction", idx=idx, source=correction_source, task=corrected_task_dict)
+                # Update description if it changed in the correction
+                if 'description' in corrected_task_dict and corrected_task_dict['description'] != task_info['description']:
+                     task_info['description'] = corrected_task_dict['description']
+                     await send_task_update(websocket, tasks_with_status) # Update UI with new description
+
+                current_task_dict = corrected_task_dict # Use the corrected task for the next attempt
+                final_task_executed_this_step = current_task_dict # Track that the corrected version is now the one being run
+
+            else:
+                # No correction provided or possible, break retry loop
+                 if attempt < ctx.max_retries:
+                      await websocket.send_text(f"Agent: Could not resolve error for step {idx + 1} after review.")
+                 else: # Max retries reached
+                     await websocket.send_text(f"Agent: Max retries reached for step {idx + 1}. Failing step.")
+                 break # Exit retry loop if no fix or max retries
+
+        except Exception as tool_exec_err:
+            tb = traceback.format_exc()
+            TOOL_ATTEMPTS.inc(tool=tool, outcome="exception")
+            step_result = ToolResult.error("exception", f"Error: Unhandled exception during tool execution: {tool_exec_err}\n{tb}")
+            await websocket.send_text(f"Agent Error: Critical error executing tool '{tool}' in step {idx+1}: {tool_exec_err}")
+            break # Exit retry loop on critical tool error
+
+    # --- Update UI: Mark as Done or Error based on the final result of the step ---
+    final_status = 'done' if step_result.ok else 'error'
+
+    task_info['status'] = final_status
+    task_info['final_executed_task'] = final_task_executed_this_step # Store what was last run/attempted
+    task_info['result'] = step_result.text # Store final result/error for this step
+    task_info['error_kind'] = step_result.error_kind
+    journal.record("result", idx=idx, status=final_status, task=final_task_executed_this_step,
+                   result=step_result.text, error_kind=step_result.error_kind, description=task_info['description'])
+
+    await send_task_update(websocket, tasks_with_status)
+
+    # Report the final result of this step (or the final error after retries)
+    await websocket.send_text(f"**Agent: Step {idx + 1} Result ({final_status.upper()})**:\n```\n{step_result}\n```")
+
+def _journal_settings(ctx: SessionContext) -> dict:
+    """The session's choices as request fields, so a resumed run uses the same models."""
+    return {"planner_model": ctx.planner_model, "browser_model": ctx.browser_model,
+            "bypass_cache": not ctx.use_cache, "replan": ctx.replan}
+
 # -------------------------------------------------------------------
 # Step 1→3: Main Agent Workflow (With Task Updates & Step Limit)
 # -------------------------------------------------------------------
-async def handle_agent_workflow(user_query: str, selected_model: str, websocket):
+async def handle_agent_workflow(user_query: str, ctx: SessionContext, websocket,
+                                resume: JournalState | None = None, workflow_id: str | None = None):
     """
-    1) PLAN   → ask the LLM for a JSON array of steps (tasks)
-    2) SEND   → send initial task list to UI
-    3) EXECUTE each task, updating UI status (pending->running->done/error)
+    1) PLAN   → stream a JSON array of steps (tasks) from the LLM
+    2) SEND   → send the task list to UI as tasks arrive
+    3) EXECUTE each task as soon as its dependencies are done, updating UI status (pending->running->done/error)
+       - Independent steps (`depends_on`) run concurrently, within per-tool limits
        - Includes self-repair loop on errors
-       - Enforces MAX_WORKFLOW_STEPS limit
+       - Enforces the session's step limit (ctx.max_steps)
+       - Revises the steps not started yet after a failed step or after
+         every step (ctx.replan); finished steps and their results are kept
        - Passes browser step limit suggestion
     4) FINALIZE → signal completion/failure/limit-reached to the user
+    Models, limits and the cache-bypass flag come from `ctx`, the session's
+    own context – nothing here reads or writes process-global settings.
+
+    Everything is journaled (journal.py). With `resume` – the replayed
+    journal of an earlier run that did not complete – finished steps keep
+    their results and the rest runs again; a plan whose planning was cut
+    short is planned again, reusing finished steps that match. `websocket`
+    may be anything with send_text (jobs.EventBuffer for detached runs,
+    which choose their `workflow_id` up front).
     """
     tasks_with_status = [] # Holds [{'description': '...', 'status': '...', 'original_task': {...}, 'result': '...', 'final_executed_task': {...}}]
     final_agent_message = "Agent: Workflow finished." # Default success message
     workflow_stopped_by_limit = False # Flag to track stopping reason
+    planner = None # Streaming planner task (producer of tasks)
+    next_planned = None # Pending plan_queue.get() while the planner is still streaming
+    running = {} # Step tasks in flight, by step index
+    step_results = StepResultStore(ctx) # Compressed outputs of finished steps, for later steps
+    workflow_started = time.monotonic()
+    cancelled = False # Set when the workflow task itself is cancelled
+    workflow_id = resume.workflow_id if resume else workflow_id or new_workflow_id()
+    journal = WorkflowJournal(workflow_id)
+    restore = resume is not None and resume.planned # Continue the journaled plan as it stands
+    reusable = resume.done_steps() if resume and not restore else [] # Results a new plan may reuse
+    if resume:
+        journal.record("resume", replan=not restore)
+    else:
+        journal.record("start", query=user_query, settings=_journal_settings(ctx))
 
     try:
+        await send_event(websocket, {"type": "workflow", "id": workflow_id, "state": "resumed" if resume else "started",
+                                     "text": f"Agent: Workflow {workflow_id} " + ("resumed from its journal." if resume else "started.")})
         # 1) PLAN
-        await websocket.send_text("Agent: Planning steps based on your request...")
+        if not restore:
+            await websocket.send_text("Agent: Planning steps based on your request...")
         # Construct prompt for planning - include JSON code escaping instruction
         planning_prompt = (
             f"User request: '{user_query}'\n\n"
             "Based on the user request and the available tools (shell_terminal, code_interpreter, browser), generate a plan as a JSON list of dictionaries. Each dictionary must represent one step and include:\n"
             "1. `tool`: The name of the tool to use (string).\n"
             "2. `description`: A short, user-friendly description of what this step aims to achieve (string).\n"
-            "3. Tool-specific parameters (e.g., `command`: list of strings for shell, `code`: string for python, `input`: string for browser).\n\n"
+            "3. Tool-specific parameters (e.g., `command`: list of strings for shell, `code`: string for python, `input`: string for browser).\n"
+            "4. Optional `id` (string) and `depends_on`: list of ids of earlier steps whose results this step needs. Use `[]` for a step that is independent of all others so it can run in parallel; omit `depends_on` to run after the previous step.\n\n"
             "**CRITICAL:** If providing Python code for the `code_interpreter` tool, the value for the `code` key MUST be a single valid JSON string. This means all special characters within the Python code, especially newlines, backslashes, and double quotes, MUST be properly escaped (e.g., newlines as '\\n', backslashes as '\\\\', double quotes as '\\\"'). Do NOT use Python triple quotes (`\"\"\"`) within the JSON output.\n\n"
             # Optional: You can still suggest a limit to the LLM here, but the loop limit is the guarantee
-            # f"**IMPORTANT:** The plan should ideally contain around {MAX_WORKFLOW_STEPS} steps or fewer if possible.\n\n"
+            # f"**IMPORTANT:** The plan should ideally contain around {ctx.max_steps} steps or fewer if possible.\n\n"
             "Output **only** the valid JSON list, without markdown fences."
         )
-        plan_json = send_prompt_with_functions(
-            model_name=PLANNING_TOOLING_MODEL, # Use the designated planning model
-            prompt=planning_prompt,
-            system_message=SYSTEM_PROMPT # Provide capabilities/context
-        )
-
-        if not plan_json:
-             raise ValueError("LLM failed to generate a plan.")
-
-        raw_tasks = parse_plan(plan_json) # Returns list of dicts, raises ValueError on failure
-
-        # Initialize tasks with 'pending' status for UI
-        tasks_with_status = [
-            {'description': task.get('description'), # Use description from plan
-             'status': 'pending',
-             'original_task': task,
-             'result': None, # Placeholder for result
-             'final_executed_task': None} # Placeholder for last executed version
-            for task in raw_tasks # raw_tasks already validated by parse_plan
-        ]
-
-        # 2) SEND Initial Task List to UI
-        await send_task_update(websocket, tasks_with_status)
-        if not tasks_with_status:
-             await websocket.send_text("Agent: Plan generated, but no actionable steps found.")
-             final_agent_message = "Agent: No actionable steps planned." # Update final message
-             return # End if no tasks
-        else:
-             await websocket.send_text(f"Agent: Plan generated with {len(tasks_with_status)} steps.")
-        await asyncio.sleep(0.1) # Small delay for UI update
-
-        # 3) EXECUTE
-        last_successful_result = "No output from previous steps."
-        executed_step_count = 0 # Counter for executed steps
-
-        for idx, task_info in enumerate(tasks_with_status):
-
-            # ===>>> Check Step Limit BEFORE starting the step <<<===
-            if executed_step_count >= MAX_WORKFLOW_STEPS:
-                await websocket.send_text(f"**Agent Warning: Maximum step limit ({MAX_WORKFLOW_STEPS}) reached. Stopping workflow.**")
-                final_agent_message = f"Agent: Workflow stopped after reaching the maximum limit of {MAX_WORKFLOW_STEPS} executed steps."
-                workflow_stopped_by_limit = True
-                # Mark remaining tasks as pending (or skipped) for clarity
-                for i in range(idx, len(tasks_with_status)):
-                     tasks_with_status[i]['status'] = 'pending' # Or could use 'skipped' if UI handles it
-                await send_task_update(websocket, tasks_with_status) # Final task update
-                break # Exit the execution loop
-
-            # --- Update UI: Mark as Running ---
-            tasks_with_status[idx]['status'] = 'running'
+        # Planner streams in the background; tasks arrive on plan_queue
+        plan_queue: asyncio.Queue = asyncio.Queue()
+        if not restore:
+            planner = asyncio.create_task(stream_plan(planning_prompt, websocket, plan_queue, ctx, user_query))
+        planning_done = False
+
+        # 3) EXECUTE – dispatch every step whose dependencies are done
+        graph = PlanGraph()
+        running = {} # step index -> asyncio.Task
+        started = set()
+        executed_step_count = 0 # Counter for executed (started) steps
+        failed_idx = None # First step that ended in error
+        replaced = set() # Steps dropped by a plan revision (incl. a failed step it worked around)
+        replans = 0
+        revise_pending = False # every_step: a step finished since the last revision
+
+        def absorb(item, base: int = 0, log: bool = True) -> bool:
+            """Handles one plan_queue item; returns True when a task was added."""
+            nonlocal planning_done
+            if item is None:
+                planning_done = True
+                graph.close()
+                journal.record("planned", steps=len(tasks_with_status))
+                return False
+            if isinstance(item, Exception):
+                raise item
+            idx = graph.add(item, base)
+            if log:
+                journal.record("step", idx=idx, base=base, task=item)
+            # Initialize task with 'pending' status for UI
+            tasks_with_status.append(
+                {'description': item.get('description'), # Use description from plan
+                 'status': 'pending',
+                 'original_task': item,
+                 'result': None, # Placeholder for result
+                 'final_executed_task': None} # Placeholder for last executed version
+            )
+            # Resumed with a new plan: a step repeating a journaled call keeps its result
+            done = next((t for t in reusable if same_call(item, t['original_task'])
+                         or same_call(item, t['final_executed_task'] or {})), None)
+            if done:
+                reusable.remove(done)
+                reuse(idx, done)
+            return True
+
+        def reuse(idx: int, done: dict):
+            """Marks step `idx` done with the result of an earlier, identical step."""
+            task = tasks_with_status[idx]['original_task']
+            tasks_with_status[idx].update(status='done', result=done['result'], final_executed_task=task)
+            started.add(idx)
+            step_results.record(idx, task, done['result'] or "", 'done')
+            journal.record("result", idx=idx, status='done', task=task, result=done['result'],
+                           error_kind=None, description=tasks_with_status[idx]['description'])
+
+        async def replan(trigger: str) -> bool:
+            """Revises the not-started steps; returns True if the plan changed."""
+            nonlocal failed_idx, replans
+            replans += 1
+            remaining = [i for i in range(len(tasks_with_status)) if i not in started and i not in replaced]
+            await websocket.send_text("Agent: Step failed – revising the remaining plan..." if trigger == "failure"
+                                      else "Agent: Checking the remaining plan against the results so far...")
+            with span("replan", trigger):
+                revised = await revise_plan(user_query, tasks_with_status, remaining, failed_idx,
+                                            step_results, websocket, ctx)
+            if revised is None:
+                REPLANS.inc(trigger=trigger, outcome="kept")
+                return False
+            dropped = remaining + ([failed_idx] if failed_idx is not None else [])
+            journal.record("replan", trigger=trigger, retired=dropped)
+            graph.retire(dropped)
+            replaced.update(dropped)
+            for i in remaining:
+                tasks_with_status[i]['status'] = 'replaced'
+            base = len(tasks_with_status)
+            reused = 0
+            for task in revised:
+                absorb(task, base)
+                # A step that repeats a finished call keeps that call's result
+                done = next((t for t in tasks_with_status[:base]
+                             if t['status'] == 'done' and same_call(task, t['final_executed_task'] or t['original_task'])), None)
+                if done and tasks_with_status[-1]['status'] != 'done':
+                    reuse(len(tasks_with_status) - 1, done)
+                    reused += 1
+            graph.close()
+            journal.record("planned", steps=len(tasks_with_status))
+            failed_idx = None
+            REPLANS.inc(trigger=trigger, outcome="revised")
             await send_task_update(websocket, tasks_with_status)
-            await websocket.send_text(f"**Agent: Starting Step {idx + 1}/**{len(tasks_with_status)}: {task_info['description']}")
-            await asyncio.sleep(0.1) # Small delay
-
-            current_task_dict = task_info['original_task'].copy() # Use a copy for the retry loop
-            step_result = "" # Result of the last attempt for this step
-            final_task_executed_this_step = current_task_dict # Track the last version executed
-
-            # Retry loop for self‑repair
-            for attempt in range(MAX_RETRIES + 1):
-                tool = current_task_dict.get("tool")
-                tool_input_desc = "" # For logging
-                current_attempt_result = "" # Result for *this specific* attempt
-
-                try:
-                    if tool == "shell_terminal":
-                        cmd_list = current_task_dict.get("command", [])
-                        full_cmd = " ".join(cmd_list)
-                        tool_input_desc = f"`{' '.join(cmd_list)}`"
-                        await websocket.send_text(f"Agent: Executing shell command: {tool_input_desc}")
-                        current_attempt_result = await execute_shell_command_impl(full_cmd, websocket)
-
-                    elif tool == "code_interpreter":
-                        code = current_task_dict.get("code", "")
-                        tool_input_desc = f"Python code snippet (approx {len(code)} chars)"
-                        await websocket.send_text(f"Agent: Executing {tool_input_desc}")
-                        current_attempt_result = await execute_python_code_impl(code, websocket)
-
-                    elif tool == "browser":
-                        inp = current_task_dict.get("input") or current_task_dict.get("browser_input", "")
-                        # Prepend the step limit suggestion
-                        browser_instructions = (
-                            f"Please complete the following task efficiently, aiming for roughly {BROWSER_STEP_LIMIT_SUGGESTION} internal actions or fewer. "
-                            f"If you anticipate exceeding this limit significantly, stop and return the results gathered so far.\n\n"
-                            f"Original Task Instruction: {inp}"
-                        )
-                        tool_input_desc = f"Browser instruction: '{inp[:100]}...'"
-                        await websocket.send_text(f"Agent: Executing {tool_input_desc} (Limit Suggestion: {BROWSER_STEP_LIMIT_SUGGESTION})")
-                        current_attempt_result = await browse_website_impl(browser_instructions, websocket)
-
-                    else:
-                        current_attempt_result = f"Error: Unknown tool '{tool}' specified in plan."
-                        await websocket.send_text(f"Agent Error: Step {idx+1} specifies unknown tool '{tool}'.")
-
-                    # Check for errors in this attempt's result
-                    is_error = any(err_indicator in current_attempt_result.lower() for err_indicator in
-                                   ["error:", "failed", "exception", "traceback", "exit code: 1", "command not found", "module not found"])
-
-                    step_result = current_attempt_result # Store result of this attempt
-
-                    if not is_error:
-                        final_task_executed_this_step = current_task_dict # Update last successfully executed version
-                        break # Exit retry loop on success
-
-                    # Error occurred, try to correct if retries remain
-                    await websocket.send_text(f"Agent: Step {idx + 1} encountered an error (Attempt {attempt + 1}).")
-                    corrected_task_dict = await review_and_resolve(current_task_dict, step_result, attempt, websocket)
-
-                    if corrected_task_dict:
-                        await websocket.send_text(f"Agent: Applying correction for step {idx + 1}.")
-                        # Update description if it changed in the correction
-                        if 'description' in corrected_task_dict and corrected_task_dict['description'] != tasks_with_status[idx]['description']:
-                             tasks_with_status[idx]['description'] = corrected_task_dict['description']
-                             await send_task_update(websocket, tasks_with_status) # Update UI with new description
-
-                        current_task_dict = corrected_task_dict # Use the corrected task for the next attempt
-                        final_task_executed_this_step = current_task_dict # Track that the corrected version is now the one being run
-
-                    else:
-                        # No correction provided or possible, break retry loop
-                         if attempt < MAX_RETRIES:
-                              await websocket.send_text(f"Agent: Could not resolve error for step {idx + 1} after review.")
-                         else: # Max retries reached
-                             await websocket.send_text(f"Agent: Max retries reached for step {idx + 1}. Failing step.")
-                         break # Exit retry loop if no fix or max retries
-
-                except Exception as tool_exec_err:
-                    tb = traceback.format_exc()
-                    step_result = f"Error: Unhandled exception during tool execution: {tool_exec_err}\n{tb}"
-                    await websocket.send_text(f"Agent Error: Critical error executing tool '{tool}' in step {idx+1}: {tool_exec_err}")
-                    break # Exit retry loop on critical tool error
-
-            # ===>>> Increment counter AFTER step attempt is fully processed <<<===
-            executed_step_count += 1
-
-            # --- Update UI: Mark as Done or Error based on the final result of the step ---
-            final_status_is_error = any(err_indicator in step_result.lower() for err_indicator in
-                                        ["error:", "failed", "exception", "traceback", "exit code: 1"])
-            final_status = 'error' if final_status_is_error else 'done'
-
-            tasks_with_status[idx]['status'] = final_status
-            tasks_with_status[idx]['final_executed_task'] = final_task_executed_this_step # Store what was last run/attempted
-            tasks_with_status[idx]['result'] = step_result # Store final result/error for this step
-
+            await websocket.send_text(
+                f"Agent: Plan revised – {len(remaining)} pending step(s) replaced by {len(revised)}"
+                + (f" ({reused} already done)." if reused else ".")
+            )
+            return True
+
+        if restore:
+            # The journaled plan, revisions included; only finished steps are kept
+            for i, saved in enumerate(resume.tasks):
+                graph.retire(r for r in resume.retired if r < saved['base']) # as when the revision came in
+                absorb(saved['original_task'], saved['base'], log=False)
+                info = tasks_with_status[i]
+                info['description'] = saved['description']
+                if i in resume.retired:
+                    replaced.add(i)
+                    info['status'] = 'error' if saved['status'] == 'error' else 'replaced'
+                elif saved['status'] == 'done':
+                    info.update(status='done', result=saved['result'], final_executed_task=saved['final_executed_task'])
+                    started.add(i)
+                    step_results.record(i, saved['final_executed_task'] or saved['original_task'],
+                                        saved['result'] or "", 'done')
+            graph.retire(resume.retired)
+            graph.close()
+            planning_done = True
             await send_task_update(websocket, tasks_with_status)
-
-            # Report the final result of this step (or the final error after retries)
-            await websocket.send_text(f"**Agent: Step {idx + 1} Result ({final_status.upper()})**:\n```\n{step_result}\n```")
-
-            if final_status == 'error':
-                final_agent_message = f"Agent Error: Workflow failed at step {idx + 1} ({tasks_with_status[idx]['description']})."
-                await websocket.send_text(f"**{final_agent_message}**") # Send failure message immediately
-                # Stop workflow execution
-                return
-
-            # Store successful result for potential context in later steps (optional)
-            if final_status == 'done':
-                last_successful_result = step_result
-
-            await asyncio.sleep(0.2) # Slightly longer pause after step completion
+            await websocket.send_text(f"Agent: Resuming – {len(started)} of "
+                                      f"{len(tasks_with_status) - len(replaced)} steps already done.")
+
+        while True:
+            # 2) SEND – absorb every task planned so far
+            received_new_tasks = False
+            was_planning = not planning_done
+            if next_planned is not None and next_planned.done():
+                received_new_tasks |= absorb(next_planned.result())
+                next_planned = None
+            while not planning_done and next_planned is None and not plan_queue.empty():
+                received_new_tasks |= absorb(plan_queue.get_nowait())
+
+            if received_new_tasks or (planning_done and not tasks_with_status):
+                await send_task_update(websocket, tasks_with_status)
+            if planning_done and not tasks_with_status:
+                await websocket.send_text("Agent: Plan generated, but no actionable steps found.")
+                final_agent_message = "Agent: No actionable steps planned." # Update final message
+                return # End if no tasks
+            if was_planning and planning_done:
+                await websocket.send_text(f"Agent: Plan generated with {len(tasks_with_status)} steps.")
+
+            # Revise the rest of the plan once nothing is in flight
+            if not running and planning_done and ctx.replan != "off" and replans < ctx.max_replans \
+                    and not workflow_stopped_by_limit:
+                if failed_idx is not None:
+                    await replan("failure")
+                elif revise_pending and ctx.replan == "every_step":
+                    if any(i not in started and i not in replaced for i in range(len(tasks_with_status))):
+                        await replan("step")
+                revise_pending = False
+
+            # Start every ready step (unless a step failed or the limit was hit)
+            if failed_idx is None and not workflow_stopped_by_limit:
+                statuses = [t['status'] for t in tasks_with_status]
+                for idx in graph.ready(statuses, started):
+                    # ===>>> Check Step Limit BEFORE starting the step <<<===
+                    if executed_step_count >= ctx.max_steps:
+                        await websocket.send_text(f"**Agent Warning: Maximum step limit ({ctx.max_steps}) reached. Stopping workflow.**")
+                        final_agent_message = f"Agent: Workflow stopped after reaching the maximum limit of {ctx.max_steps} executed steps."
+                        workflow_stopped_by_limit = True
+                        break
+                    started.add(idx)
+                    executed_step_count += 1
+                    running[idx] = asyncio.create_task(
+                        run_step(idx, tasks_with_status, websocket, planning_done, ctx,
+                                 step_results.context_for(idx, graph.depends_on(idx)), journal)
+                    )
+                # Load the model(s) of the next waiting steps while these run
+                upcoming = [t['original_task'] for i, t in enumerate(tasks_with_status) if i not in started]
+                RESIDENCY.prepare([model_for_step(t, ctx) for t in upcoming[:MODEL_LOOKAHEAD]])
+
+            stopping = failed_idx is not None or workflow_stopped_by_limit
+            if stopping and not planning_done:
+                planner.cancel() # No further steps will be run
+                if next_planned is not None:
+                    next_planned.cancel()
+                    next_planned = None
+                planning_done = True
+
+            if not running and planning_done:
+                break # Nothing in flight and nothing more can start
+
+            # Wait for a step to finish or the planner to hand over the next task
+            waiters = set(running.values())
+            if not planning_done:
+                if next_planned is None:
+                    next_planned = asyncio.create_task(plan_queue.get())
+                waiters.add(next_planned)
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+
+            for idx, step_task in list(running.items()):
+                if step_task.done():
+                    del running[idx]
+                    step_task.result() # Re-raise unexpected errors
+                    info = tasks_with_status[idx]
+                    # Keep the output (compressed) as context for the steps that follow
+                    step_results.record(idx, info['final_executed_task'] or info['original_task'],
+                                        info['result'] or "", info['status'])
+                    if info['status'] == 'error' and failed_idx is None:
+                        failed_idx = idx
+                        if ctx.replan != "off":
+                            RESIDENCY.prepare([ctx.planner_model]) # revise_plan runs on it once the others finish
+                    revise_pending = True
+
+        if failed_idx is not None:
+            final_agent_message = f"Agent Error: Workflow failed at step {failed_idx + 1} ({tasks_with_status[failed_idx]['description']})."
+            await websocket.send_text(f"**{final_agent_message}**") # Send failure message
+            # Stop workflow execution
+            return
+
+        blocked = [i + 1 for i, t in enumerate(tasks_with_status) if i not in started and i not in replaced]
+        if blocked and not workflow_stopped_by_limit:
+            # Only circular dependencies can leave steps unstarted here
+            await websocket.send_text(f"Agent Error: Steps {blocked} could not start (circular dependencies).")
+            final_agent_message = "Agent Error: Workflow stopped with unresolvable step dependencies."
+            await websocket.send_text(f"**{final_agent_message}**")
+            return
+        if workflow_stopped_by_limit:
+            await send_task_update(websocket, tasks_with_status) # Final task update (remaining steps stay pending)
 
         # 4) FINALIZE
         # Determine final message if loop finished (either naturally or by limit)
-        if not any(t['status'] == 'error' for t in tasks_with_status): # Check if no errors occurred
+        if not any(t['status'] == 'error' for i, t in enumerate(tasks_with_status)
+                   if i not in replaced): # Check if no errors occurred (failures a revision worked around aside)
              if workflow_stopped_by_limit:
                  # Message already set correctly inside the loop limit check
                  pass
@@ -419,8 +787,44 @@ async def handle_agent_workflow(user_query: str, selected_model: str, websocket)
         if updated:
             await send_task_update(websocket, tasks_with_status)
         final_agent_message = "Agent Error: Workflow failed unexpectedly."
+    except asyncio.CancelledError: # Cancel message, newer query or disconnect (see main.ws_endpoint)
+        cancelled = True
+        final_agent_message = f"Agent: Workflow cancelled ({ctx.cancel_reason or 'cancelled'})."
+        for task_info in tasks_with_status:
+            if task_info['status'] in ['running', 'pending']:
+                task_info['status'] = 'cancelled'
+        try:
+            await send_task_update(websocket, tasks_with_status)
+            await websocket.send_text(f"**{final_agent_message}**")
+        except Exception:
+            pass # Client already gone
+        raise
 
     finally:
+        if planner and not planner.done():
+            planner.cancel() # Stop generating steps nobody will run
+        if next_planned is not None:
+            next_planned.cancel()
+        for step_task in running.values():
+            step_task.cancel() # Abort steps still in flight (failure / cancel / disconnect)
+        # Wait for them to unwind: Ollama requests closed, tool process groups
+        # killed and concurrency slots released before the workflow counts as over
+        leftovers = [t for t in [planner, *running.values()] if t is not None]
+        if leftovers:
+            await asyncio.gather(*leftovers, return_exceptions=True)
+        await step_results.aclose()
+        outcome = ("cancelled" if ctx.is_cancelled or cancelled
+                   else "error" if final_agent_message.startswith("Agent Error")
+                   else "limit" if workflow_stopped_by_limit else "ok")
+        WORKFLOWS.inc(outcome=outcome)
+        WORKFLOW_SECONDS.observe(time.monotonic() - workflow_started, outcome=outcome)
+        journal.record("end", outcome=outcome, message=final_agent_message)
+        await journal.aclose()
+        try:
+            await send_event(websocket, {"type": "workflow", "id": workflow_id, "state": "finished", "outcome": outcome,
+                                         "text": f"Agent: Workflow {workflow_id} finished ({outcome})."})
+        except Exception:
+            pass # Client already gone
         print(f"Agent workflow function finished. Final status message attempt: {final_agent_message}")
         # Optional: Add a small delay before the websocket might close if needed
         # await asyncio.sleep(0.5)
@@ -437,7 +841,7 @@ async def create_task_list(user_input: str, model_to_use: str, websocket) -> str
     system_message = """You are a planning agent...""" # Truncated
     prompt = f"Based on the user request: '{user_input}', create the task list..."
     # ... (rest of original legacy code) ...
-    task_list_md = send_prompt(model_name=model_to_use, prompt=prompt, system_message=system_message)
+    task_list_md = await asimple_prompt(model_to_use, prompt, system=system_message)
     if not task_list_md: raise ValueError("LLM communication failed for task list.")
     lines = task_list_md.strip().splitlines(); items = []; pattern = re.compile(r"^\s*\d+\.\s*\[\s*\]\s*.*"); started = False
     for line in lines:
@@ -458,7 +862,7 @@ async def execute_tasks(task_file_path: str, model_to_use_for_review: str, webso
 async def review_and_repair(task_file_path: str, task_index: int, task_description: str, task_output: str, model_to_use: str, websocket):
     """ (Original Description) """
     system_message = "You are a meticulous reviewing agent…"; prompt = (f"Original Task: {task_description}\nOutput:\n---\n{task_output[:1000]}...\n---\nReview Result (Satisfactory or Issue/Suggestion):")
-    review = send_prompt(model_to_use, prompt, system_message); review_text = review.strip() if review else "Review failed."
+    review = await asimple_prompt(model_to_use, prompt, system=system_message); review_text = review.strip() if review else "Review failed."
     await websocket.send_text(f"Agent: Review result: {review_text} (legacy)"); return review_text
 
 async def final_review(task_file_path: str, original_query: str, model_to_use: str, websocket) -> str:
@@ -468,5 +872,5 @@ async def final_review(task_file_path: str, original_query: str, model_to_use: s
         with open(task_file_path, "r", encoding="utf-8") as f: content = f.read()
     except Exception as e: await websocket.send_text(f"Agent Error: Failed to read legacy task file: {e}"); return "Error reading task file."
     system_message = "You are a final review and summarization agent…"; prompt = (f"Original User Query: {original_query}\n\nTask File Content:\n---\n{content}\n---\nGenerate the final response based on completed tasks ([x]).")
-    final = send_prompt(model_to_use, prompt, system_message); final_text = final.strip() if final else "Summary generation failed."
+    final = await asimple_prompt(model_to_use, prompt, system=system_message); final_text = final.strip() if final else "Summary generation failed."
     await websocket.send_text("Agent: Final summary generated (legacy)."); return final_text
\ No newline at end of file
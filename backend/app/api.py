@@ -1,25 +1,246 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import json, os
+import asyncio, json, os
 
-from .llm_handler import simple_prompt, PLANNING_TOOLING_MODEL, list_local_models
+from .llm_handler import (
+    asimple_prompt, PLANNING_TOOLING_MODEL, llm_cache_clear, llm_cache_stats,
+    model_status, MODEL_CATALOG, RESIDENCY,
+)
+from .admission import WORKFLOW_GATE, admission_stats
+from .batch import BATCHES, batch_paths, read_items, recorded_outcomes, start_batch, stop_batch
+from .jobs import JOBS, sse_stream
+from .journal import list_journals, load_journal, new_workflow_id
+from .session import SessionContext
+from .metrics import render as render_metrics
+from .tools.sandbox_pool import SANDBOX_ENABLED
+from .agent import TOOL_CACHE
 
 router = APIRouter()
 
-# ─── list local ollama models (pure JSON, no CLI) ────────────────
+# ─── readiness: 200 once the planning model is available ─────────
+@router.get("/health")
+def health():
+    models  = model_status()
+    planner = models.get(PLANNING_TOOLING_MODEL, {}).get("state", "pending")
+    status  = {"ready": "ready", "error": "degraded"}.get(planner, "starting")
+    return JSONResponse(
+        {
+            "status":         status,
+            "planner_model":  PLANNING_TOOLING_MODEL,
+            "models":         models,
+            "sandbox_pool":   SANDBOX_ENABLED,
+        },
+        status_code=200 if status == "ready" else 503,
+    )
+
+# ─── list local ollama models (cached catalog, ETag) ─────────────
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match or not etag:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
 @router.get("/models")
-def list_models():
-    return {"models": list_local_models()}
+async def list_models(if_none_match: str | None = Header(None)):
+    models, etag = await MODEL_CATALOG.get()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {"Cache-Control": "no-store"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"models": [m["name"] for m in models], "details": models,
+                         "error": MODEL_CATALOG.error}, headers=headers)
+
+# ─── which models are loaded in Ollama, and how long loads took ──
+@router.get("/models/residency")
+async def models_residency():
+    return await RESIDENCY.stats()
+
+# ─── slots in use / queued per resource (workflow, llm, tools) ───
+@router.get("/admission")
+def admission():
+    return admission_stats()
 
 # ─── minimal chat (HTTP) ─────────────────────────────────────────
 class ChatInput(BaseModel):
     query: str
     model: str | None = None
+    bypass_cache: bool = False
 
 @router.post("/chat")
 async def chat(inp: ChatInput):
     model = inp.model or PLANNING_TOOLING_MODEL
-    ans   = simple_prompt(model, inp.query)
+    ans   = await asimple_prompt(model, inp.query, cache=not inp.bypass_cache)
     if ans is None:
         raise HTTPException(500, "LLM failure")
     return {"response": ans}
+
+# ─── tool result cache counters ──────────────────────────────────
+@router.get("/cache/tools")
+def tool_cache_stats():
+    return TOOL_CACHE.stats()
+
+@router.delete("/cache/tools")
+def tool_cache_clear():
+    TOOL_CACHE.store.clear()
+    return {"cleared": True}
+
+# ─── LLM response cache counters ─────────────────────────────────
+@router.get("/cache/llm")
+def llm_cache_info():
+    return llm_cache_stats()
+
+@router.delete("/cache/llm")
+def llm_cache_reset():
+    llm_cache_clear()
+    return {"cleared": True}
+
+# ─── detached workflows (jobs.py) ───────────────────────────────
+class WorkflowInput(BaseModel):
+    query: str
+    planner_model: str | None = None
+    browser_model: str | None = None
+    bypass_cache: bool = False
+    replan: str | None = None
+
+def _client(request: Request) -> str:
+    return request.client.host if request.client else "anonymous"
+
+def _job_links(job) -> dict:
+    return {**job.summary(), "status_url": f"/api/workflows/{job.id}",
+            "events_url": f"/api/workflows/{job.id}/events"}
+
+@router.post("/workflows", status_code=202)
+async def submit_workflow(inp: WorkflowInput, request: Request):
+    if not inp.query.strip():
+        raise HTTPException(422, "empty query")
+    ctx = SessionContext.from_request(inp.model_dump(exclude_none=True), client=_client(request))
+    return _job_links(JOBS.submit(inp.query, ctx))
+
+@router.get("/workflows")
+def workflows():
+    return {"workflows": [j.summary() for j in reversed(JOBS.jobs.values())]}
+
+@router.get("/workflows/{job_id}")
+def workflow(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "no such workflow (see /api/journals for finished ones)")
+    return {**job.summary(), "tasks": job.events.tasks}
+
+@router.get("/workflows/{job_id}/events")
+async def workflow_events(job_id: str, offset: int = 0, last_event_id: str | None = Header(None)):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "no such workflow")
+    if last_event_id and last_event_id.isdigit():   # EventSource reconnect
+        offset = int(last_event_id) + 1
+    return StreamingResponse(sse_stream(job, max(0, offset)), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/workflows/{job_id}/resume", status_code=202)
+async def resume_workflow(job_id: str, request: Request):
+    state = await asyncio.to_thread(load_journal, job_id)
+    if state is None:
+        raise HTTPException(404, "no journal for this workflow")
+    if not state.resumable:
+        raise HTTPException(409, "workflow is running" if state.outcome != "ok" else "workflow already completed")
+    ctx = SessionContext.from_request(state.settings, client=_client(request))
+    return _job_links(JOBS.submit(state.query, ctx, resume=state))
+
+@router.delete("/workflows/{job_id}")
+async def cancel_workflow(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "no such workflow")
+    await JOBS.cancel(job)
+    return job.summary()
+
+# ─── batches: many queries from one JSONL body (batch.py) ───────
+def _batch_files(batch_id: str) -> tuple[str, str]:
+    paths = batch_paths(batch_id)
+    if paths is None or not os.path.exists(paths[0]):
+        raise HTTPException(404, "no such batch")
+    return paths
+
+def _write_batch_input(path: str, body: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(body)
+
+@router.post("/batches", status_code=202)
+async def submit_batch(request: Request, concurrency: int | None = None):
+    body = (await request.body()).decode("utf-8", errors="replace")
+    if not any(line.strip() and not line.lstrip().startswith("#") for line in body.splitlines()):
+        raise HTTPException(422, "empty batch: send one JSON query per line")
+    batch_id = new_workflow_id()
+    input_path, _ = batch_paths(batch_id)
+    await asyncio.to_thread(_write_batch_input, input_path, body)
+    # a shared server: never more in flight than the workflow gate admits
+    slots = min(concurrency or WORKFLOW_GATE.slots, WORKFLOW_GATE.slots)
+    runner = start_batch(batch_id, slots, _client(request))
+    return {"id": batch_id, "status_url": f"/api/batches/{batch_id}",
+            "results_url": f"/api/batches/{batch_id}/results", "concurrency": runner.concurrency}
+
+@router.get("/batches")
+def batches():
+    return {"batches": [r.progress() for r in BATCHES.values()]}
+
+@router.get("/batches/{batch_id}")
+async def batch(batch_id: str):
+    if batch_id in BATCHES:
+        return BATCHES[batch_id].progress()
+    input_path, output_path = _batch_files(batch_id)          # from an earlier server run
+    items = await asyncio.to_thread(read_items, input_path)
+    recorded = await asyncio.to_thread(recorded_outcomes, output_path)
+    outcomes: dict[str, int] = {}
+    for item in items:
+        if item.key in recorded:
+            outcomes[recorded[item.key]] = outcomes.get(recorded[item.key], 0) + 1
+    return {"id": batch_id, "state": "stopped", "total": len(items), "done": sum(outcomes.values()),
+            "outcomes": outcomes}
+
+@router.get("/batches/{batch_id}/results")
+def batch_results(batch_id: str):
+    _, output_path = _batch_files(batch_id)
+    if not os.path.exists(output_path):
+        return PlainTextResponse("", media_type="application/x-ndjson")
+    return FileResponse(output_path, media_type="application/x-ndjson")
+
+@router.post("/batches/{batch_id}/resume", status_code=202)
+async def resume_batch(batch_id: str, request: Request, concurrency: int | None = None):
+    _batch_files(batch_id)
+    running = BATCHES.get(batch_id)
+    if running is not None and running.task is not None and not running.task.done():
+        raise HTTPException(409, "batch is running")
+    slots = min(concurrency or WORKFLOW_GATE.slots, WORKFLOW_GATE.slots)
+    return start_batch(batch_id, slots, _client(request)).progress()
+
+@router.delete("/batches/{batch_id}")
+async def cancel_batch(batch_id: str):
+    runner = BATCHES.get(batch_id)
+    if runner is None:
+        raise HTTPException(404, "no running batch with this id")
+    await stop_batch(runner)
+    return runner.progress()
+
+# ─── workflow journals (resume over /ws with {"type": "resume"}) ─
+@router.get("/journals")
+async def journals():
+    return {"journals": await asyncio.to_thread(list_journals)}
+
+@router.get("/journals/{workflow_id}")
+async def journal(workflow_id: str):
+    state = await asyncio.to_thread(load_journal, workflow_id)
+    if state is None:
+        raise HTTPException(404, "no journal for this workflow")
+    tasks = [
+        {"id": i, "description": t["description"], "status": t["status"],
+         "error_kind": t["error_kind"], "result": t["result"]}
+        for i, t in enumerate(state.tasks)
+    ]
+    return {**state.summary(), "tasks": tasks}
+
+# ─── Prometheus metrics (stage latencies, LLM tokens/s, caches) ──
+@router.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,403 @@
+"""
+batch.py
+────────
+Many workflows from one JSONL file – headless, with bounded concurrency.
+
+    python -m app.batch queries.jsonl -o results.jsonl [--concurrency 4]
+                        [--llm 2] [--browser 1] [--sandbox 3]
+                        [--planner-model …] [--browser-model …]
+
+    POST   /api/batches?concurrency=4     JSONL body → {"id": …}
+    GET    /api/batches/{id}              progress
+    GET    /api/batches/{id}/results      the output JSONL so far
+    POST   /api/batches/{id}/resume       continue a stopped batch
+    DELETE /api/batches/{id}              stop it (resumable)
+
+Input: one JSON object per line – "query" plus, optionally, an "id" and
+any field a /ws request takes (planner_model, bypass_cache, replan, …); a
+bare JSON string is a query. Blank lines and lines starting with # are
+skipped. Ids (default: the line number) must be unique – a repeated one
+is recorded as "invalid" under "<id>@<line>" and not run.
+
+Output: one JSON object per item, appended as the item finishes:
+
+  {"line": 3, "id": "…", "query": "…", "workflow_id": "…", "outcome": "ok",
+   "message": "Agent: Workflow completed successfully.", "resumed": false,
+   "queued_s": 0.0, "run_s": 12.4, "total_s": 12.4, "started": 1.7e9,
+   "steps": [{"description": "…", "status": "done", "error_kind": null, "result": "…"}]}
+
+Items run through `handle_agent_workflow` (via jobs.admitted_workflow)
+with a `HeadlessSink` in place of a WebSocket; step results are read back
+from the workflow's journal. At most `concurrency` items are in flight;
+the LLM, browser and sandbox are bounded by the process-wide gates
+(admission.py, dag_scheduler.TOOL_CONCURRENCY), which the CLI can resize
+with --llm / --browser / --sandbox. All items of a batch queue under one
+session, so on a shared server a batch gets its fair turn and no more.
+
+Resume: every item's workflow id is derived from the output file, the
+item id and the query. Running the same input against the same output
+again skips items already recorded as ok / error / limit, resumes items
+that were in flight from their journals (finished steps are not run
+again) and starts the rest. Items the server rejected (queue full) are
+retried after a pause. A re-run item can appear twice in the output –
+the last record of an id wins.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
+from .events import event_from_text
+from .jobs import admitted_workflow
+from .journal import load_journal, new_workflow_id
+from .metrics import counter
+from .session import SessionContext
+
+BATCH_DIR          = os.getenv("BATCH_DIR") or os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "tasks", "batches"))
+BATCH_RETRIES      = int(os.getenv("BATCH_RETRIES", "5"))        # attempts for an item the server rejected
+BATCH_RETRY_SECONDS = float(os.getenv("BATCH_RETRY_SECONDS", "5"))
+BATCH_RETENTION_SECONDS = float(os.getenv("BATCH_RETENTION_SECONDS", "3600"))   # finished batches listed in memory
+BATCH_MAX_FINISHED = int(os.getenv("BATCH_MAX_FINISHED", "50"))
+FINAL_OUTCOMES     = ("ok", "error", "limit", "invalid")         # recorded items a resume skips
+
+BATCH_ITEMS = counter("batch_items_total", "Batch items finished, by outcome.", ("outcome",))
+
+
+@dataclass
+class BatchItem:
+    line: int
+    key: str
+    query: str
+    request: dict = field(default_factory=dict)
+    error: str | None = None            # unparsable input line
+
+
+def read_items(path: str) -> list[BatchItem]:
+    items = _read_lines(path)
+    first: dict[str, int] = {}
+    for item in items:
+        if item.key in first:
+            # resume state is keyed by id: a second item under it would be skipped or share a journal
+            item.error = item.error or f"duplicate id {item.key!r} (first used on line {first[item.key]})"
+            item.key = f"{item.key}@{item.line}"
+        else:
+            first[item.key] = item.line
+    return items
+
+def _read_lines(path: str) -> list[BatchItem]:
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for n, raw in enumerate(f, 1):
+            raw = raw.strip()
+            if not raw or raw.startswith("#"):
+                continue
+            try:
+                data = json.loads(raw)
+            except ValueError as e:
+                items.append(BatchItem(n, str(n), "", error=f"invalid JSON: {e}"))
+                continue
+            if isinstance(data, str):
+                data = {"query": data}
+            if not isinstance(data, dict) or not str(data.get("query") or "").strip():
+                items.append(BatchItem(n, str(n), "", error="no query"))
+                continue
+            key = str(data.get("id") if data.get("id") is not None else n)
+            items.append(BatchItem(n, key, str(data["query"]), data))
+    return items
+
+def item_workflow_id(output_path: str, item: BatchItem) -> str:
+    seed = f"{os.path.abspath(output_path)}\n{item.key}\n{item.query}"
+    return hashlib.sha1(seed.encode()).hexdigest()[:16]
+
+def recorded_outcomes(output_path: str) -> dict[str, str]:
+    """Outcome of every item in an existing output file (the last record of an id wins)."""
+    out = {}
+    try:
+        with open(output_path, encoding="utf-8") as f:
+            for raw in f:
+                try:
+                    rec = json.loads(raw)
+                    out[str(rec["id"])] = rec.get("outcome")
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return out
+
+
+# ───────────────────────────────────────────────── headless event sink
+class HeadlessSink:
+    """What a workflow would have sent its WebSocket, reduced to what the output record needs."""
+
+    def __init__(self, label: str = "", echo: bool = False):
+        self.label = label
+        self.echo = echo
+        self.tasks: list[dict] = []
+        self.admitted: float | None = None    # monotonic time the workflow started
+        self.outcome: str | None = None
+        self.message = ""                     # last bold status line ("**Agent: …**")
+        self.errors: list[str] = []
+
+    async def send_text(self, text: str):
+        await self.send_event(event_from_text(text))
+
+    async def send_json(self, data):
+        if isinstance(data, dict) and "type" in data:
+            await self.send_event(data)
+
+    async def send_event(self, event: dict):
+        kind = event.get("type")
+        if kind == "tasks" and "tasks" in event:
+            self.tasks = [{"description": t.get("description"), "status": t.get("status")} for t in event["tasks"]]
+        elif kind == "workflow":
+            if event.get("state") == "finished":
+                self.outcome = event.get("outcome")
+            elif self.admitted is None:
+                self.admitted = time.monotonic()
+        elif kind == "message":
+            text = event.get("text", "")
+            if text.startswith("**") and text.endswith("**"):
+                self.message = text.strip("*")
+            if event.get("level") == "error" and len(self.errors) < 20:
+                self.errors.append(text)
+            if self.echo:
+                print(f"[batch {self.label}] {text[:200]}")
+
+
+# ───────────────────────────────────────────────── runner
+class BatchRunner:
+    def __init__(self, input_path: str, output_path: str, *, concurrency: int = 4,
+                 client: str = "batch", defaults: dict | None = None, echo: bool = False,
+                 batch_id: str | None = None):
+        self.id = batch_id or new_workflow_id()
+        self.input_path = input_path
+        self.output_path = output_path
+        self.concurrency = max(1, concurrency)
+        self.client = client                  # one fairness key for the whole batch
+        self.defaults = defaults or {}        # request fields items do not set themselves
+        self.echo = echo
+        self.total = 0
+        self.skipped = 0
+        self.running = 0
+        self.outcomes: dict[str, int] = {}
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.stopped = False                  # cancelled before every item was done
+        self.task: asyncio.Task | None = None
+
+    def progress(self) -> dict:
+        done = sum(self.outcomes.values())
+        return {
+            "id":          self.id,
+            "state":       ("pending" if self.started is None else "running" if self.finished is None
+                            else "stopped" if self.stopped else "finished"),
+            "total":       self.total,
+            "skipped":     self.skipped,
+            "done":        done,
+            "running":     self.running,
+            "remaining":   self.total - self.skipped - done - self.running,
+            "outcomes":    dict(self.outcomes),
+            "concurrency": self.concurrency,
+            "elapsed_s":   round((self.finished or time.time()) - self.started, 1) if self.started else 0.0,
+        }
+
+    async def run(self) -> dict:
+        self.started, self.finished, self.stopped = time.time(), None, False
+        items = await asyncio.to_thread(read_items, self.input_path)
+        recorded = await asyncio.to_thread(recorded_outcomes, self.output_path)
+        todo = [i for i in items if recorded.get(i.key) not in FINAL_OUTCOMES]
+        self.total, self.skipped = len(items), len(items) - len(todo)
+        self.outcomes = {}
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        print(f"[batch] {self.id}: {len(todo)} of {len(items)} item(s) to run, {self.concurrency} at a time")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in todo:
+            queue.put_nowait(item)
+        with open(self.output_path, "a", encoding="utf-8") as out:
+            async def worker():
+                while not queue.empty():
+                    record = await self.run_item(queue.get_nowait())
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+            workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(todo)))]
+            try:
+                await asyncio.gather(*workers)
+            except asyncio.CancelledError:
+                # gather already cancelled the workers – once: a second cancel would cut
+                # the workflows' own cleanup (journal close) short
+                self.stopped = True
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+            except Exception:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+            finally:
+                self.finished = time.time()
+        print(f"[batch] {self.id}: finished {self.progress()['outcomes']} in {self.finished - self.started:.1f}s")
+        return self.progress()
+
+    async def run_item(self, item: BatchItem) -> dict:
+        record = {"line": item.line, "id": item.key, "query": item.query}
+        if item.error:
+            return self._done(record, outcome="invalid", message=item.error)
+
+        workflow_id = item_workflow_id(self.output_path, item)
+        state = await asyncio.to_thread(load_journal, workflow_id)
+        if state and state.outcome == "ok":
+            # finished before the batch stopped, but never made it into the output
+            return self._done(record, workflow_id=workflow_id, outcome="ok", resumed=True,
+                              message="Agent: Workflow completed successfully.",
+                              queued_s=0.0, run_s=0.0, total_s=0.0, started=state.started,
+                              steps=_steps(state))
+
+        ctx = SessionContext.from_request({**self.defaults, **item.request}, client=self.client)
+        resume = state if state and state.resumable else None
+        self.running += 1
+        try:
+            for attempt in range(BATCH_RETRIES + 1):
+                sink = HeadlessSink(item.key, self.echo)
+                started, t0 = time.time(), time.monotonic()
+                await admitted_workflow(sink, ctx, item.query, resume, workflow_id)
+                if sink.admitted is not None or attempt == BATCH_RETRIES:
+                    break
+                await asyncio.sleep(BATCH_RETRY_SECONDS * (attempt + 1))   # queue full – try again later
+                ctx = SessionContext.from_request({**self.defaults, **item.request}, client=self.client)
+        finally:
+            self.running -= 1
+
+        end = time.monotonic()
+        admitted = sink.admitted if sink.admitted is not None else end
+        state = await asyncio.to_thread(load_journal, workflow_id)
+        return self._done(
+            record,
+            workflow_id=workflow_id,
+            outcome=sink.outcome or "rejected",
+            message=sink.message or (sink.errors[-1] if sink.errors else ""),
+            resumed=resume is not None,
+            queued_s=round(admitted - t0, 3),
+            run_s=round(end - admitted, 3),
+            total_s=round(end - t0, 3),
+            started=round(started, 3),
+            steps=_steps(state) if state else [dict(t, error_kind=None, result=None) for t in sink.tasks],
+        )
+
+    def _done(self, record: dict, **fields) -> dict:
+        record.update(fields)
+        outcome = record["outcome"]
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        BATCH_ITEMS.inc(outcome=outcome)
+        done = sum(self.outcomes.values())
+        print(f"[batch] {self.id}: {done + self.skipped}/{self.total} {record['id']}: {outcome}"
+              + (f" in {record['total_s']:.1f}s" if record.get("total_s") else ""))
+        return record
+
+
+def _steps(state) -> list[dict]:
+    return [
+        {"description": t["description"], "status": t["status"], "error_kind": t["error_kind"], "result": t["result"]}
+        for i, t in enumerate(state.tasks) if i not in state.retired
+    ]
+
+
+# ───────────────────────────────────────────────── batches of the server (/api/batches)
+BATCHES: dict[str, BatchRunner] = {}
+
+def batch_paths(batch_id: str) -> tuple[str, str] | None:
+    if not batch_id.isalnum():
+        return None
+    folder = os.path.join(BATCH_DIR, batch_id)
+    return os.path.join(folder, "input.jsonl"), os.path.join(folder, "output.jsonl")
+
+def _prune_batches():
+    """Forgets finished batches past BATCH_RETENTION_SECONDS / BATCH_MAX_FINISHED (their files stay)."""
+    cutoff = time.time() - BATCH_RETENTION_SECONDS
+    finished = sorted((r for r in BATCHES.values() if r.task is not None and r.task.done()),
+                      key=lambda r: r.finished or 0.0, reverse=True)
+    for n, runner in enumerate(finished):
+        if n >= BATCH_MAX_FINISHED or (runner.finished or 0.0) < cutoff:
+            del BATCHES[runner.id]
+
+def start_batch(batch_id: str, concurrency: int, client: str) -> BatchRunner:
+    """Runs a batch whose input is in BATCH_DIR/<id>/ in the background."""
+    _prune_batches()
+    input_path, output_path = batch_paths(batch_id)
+    runner = BatchRunner(input_path, output_path, concurrency=concurrency,
+                         client=f"batch:{client}", batch_id=batch_id)
+    runner.task = asyncio.create_task(runner.run())
+    BATCHES[batch_id] = runner
+    return runner
+
+async def stop_batch(runner: BatchRunner):
+    if runner.task is not None and not runner.task.done():
+        runner.task.cancel()
+        await asyncio.gather(runner.task, return_exceptions=True)
+
+async def aclose_batches():
+    """Stops running batches (server shutdown); they resume from their journals."""
+    await asyncio.gather(*(stop_batch(r) for r in BATCHES.values()))
+
+
+# ───────────────────────────────────────────────── CLI
+def main(argv: list[str] | None = None):
+    ap = argparse.ArgumentParser(prog="python -m app.batch", description="Run agent workflows from a JSONL file.")
+    ap.add_argument("input", help="JSONL with one query per line")
+    ap.add_argument("-o", "--output", help="results JSONL (default: <input>.out.jsonl); re-run to resume")
+    ap.add_argument("--concurrency", type=int, default=None, help="workflows in flight (default MAX_CONCURRENT_WORKFLOWS)")
+    ap.add_argument("--llm", type=int, help="LLM generations in flight")
+    ap.add_argument("--browser", type=int, help="browser steps in flight")
+    ap.add_argument("--sandbox", type=int, help="code_interpreter steps in flight")
+    ap.add_argument("--planner-model")
+    ap.add_argument("--browser-model")
+    ap.add_argument("--bypass-cache", action="store_true")
+    ap.add_argument("--replan", choices=("off", "on_failure", "every_step"))
+    ap.add_argument("--verbose", action="store_true", help="print every item's messages")
+    args = ap.parse_args(argv)
+    output = args.output or os.path.splitext(args.input)[0] + ".out.jsonl"
+    defaults = {k: v for k, v in {
+        "planner_model": args.planner_model, "browser_model": args.browser_model,
+        "bypass_cache": args.bypass_cache or None, "replan": args.replan,
+    }.items() if v is not None}
+    try:
+        return asyncio.run(_run_cli(args, output, defaults))
+    except KeyboardInterrupt:
+        print(f"[batch] interrupted – run the same command again to resume ({output})")
+        return 130
+
+async def _run_cli(args, output: str, defaults: dict) -> int:
+    from .admission import LLM_GATE, WORKFLOW_GATE
+    from .agent import TOOL_LIMITER
+    from .llm_handler import aclose as close_llm_client
+    from .tools.browser_pool import BROWSER_POOL
+    from .tools.sandbox_pool import prewarm as prewarm_sandbox
+
+    concurrency = args.concurrency or WORKFLOW_GATE.slots
+    if concurrency > WORKFLOW_GATE.slots:
+        WORKFLOW_GATE.resize(concurrency)     # this process runs nothing but the batch
+    for gate, limit in ((LLM_GATE, args.llm), (TOOL_LIMITER.semaphore("browser"), args.browser),
+                        (TOOL_LIMITER.semaphore("code_interpreter"), args.sandbox)):
+        if limit:
+            gate.resize(limit)
+
+    sandbox_warmup = asyncio.create_task(prewarm_sandbox())
+    runner = BatchRunner(args.input, output, concurrency=concurrency, defaults=defaults, echo=args.verbose)
+    try:
+        result = await runner.run()
+    finally:
+        sandbox_warmup.cancel()
+        await BROWSER_POOL.aclose()
+        await close_llm_client()
+    print(json.dumps(result))
+    return 0 if set(result["outcomes"]) <= {"ok"} else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
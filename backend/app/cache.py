@@ -0,0 +1,216 @@
+"""
+cache.py
+────────
+Small persistent key → value cache on SQLite with TTL, LRU eviction and a
+bound on entry count and total size. Shared by the tool result cache and
+the LLM response cache. `SQLiteVectorIndex` is the embedding side of the
+LLM cache: bounded, nearest-neighbour by cosine similarity.
+
+Operations are plain synchronous SQLite calls on a local file (well under a
+millisecond each), guarded by a lock so the cache can be used from the
+event loop and from worker threads alike.
+
+    cache = SQLiteLRUCache(path, max_entries=1000, max_bytes=64 << 20, default_ttl=3600)
+    cache.put(key, value, ttl=None, tag=None)
+    cache.get(key) -> str | None
+    cache.invalidate_tag(tag)            drop every entry stored with `tag`
+    cache.clear()
+    cache.stats() -> dict
+
+    index = SQLiteVectorIndex(path, max_rows=500)
+    index.add(scope, key, vector)
+    index.nearest(scope, vector) -> (key, similarity) | None
+"""
+
+from __future__ import annotations
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key       TEXT PRIMARY KEY,
+    value     TEXT NOT NULL,
+    size      INTEGER NOT NULL,
+    tag       TEXT,
+    created   REAL NOT NULL,
+    expires   REAL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used);
+CREATE INDEX IF NOT EXISTS entries_tag ON entries (tag);
+"""
+
+
+class SQLiteLRUCache:
+    def __init__(self, path: str, *, max_entries: int = 1000,
+                 max_bytes: int = 64 * 1024 * 1024, default_ttl: float | None = 3600.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    # opened on first use so importing the module never touches the disk
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, expires = row
+            if expires is not None and expires <= now:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str, *, ttl: float | None = None, tag: str | None = None):
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, tag, created, expires, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, value, size, tag, now, now + ttl if ttl else None, now),
+            )
+            self.stores += 1
+            self._evict(db, now)
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        """Drops expired entries, then least recently used ones until within bounds."""
+        db.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            self.evictions += 1
+
+    def invalidate_tag(self, tag: str) -> int:
+        with self._lock:
+            cur = self._conn().execute("DELETE FROM entries WHERE tag = ?", (tag,))
+            return cur.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn().execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# ───────────────────────────────────────────────── embeddings
+_VECTOR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vectors (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope   TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    vector  TEXT NOT NULL,
+    norm    REAL NOT NULL,
+    UNIQUE (scope, key)
+);
+CREATE INDEX IF NOT EXISTS vectors_scope ON vectors (scope);
+"""
+
+
+class SQLiteVectorIndex:
+    """
+    Maps embedding vectors to cache keys within a scope. Brute-force cosine
+    search – the index is small (max_rows) and only consulted on an exact
+    cache miss, so a linear scan in Python is cheaper than a dependency.
+    The oldest rows are dropped beyond max_rows.
+    """
+
+    def __init__(self, path: str, *, max_rows: int = 500):
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_VECTOR_SCHEMA)
+            self._db = db
+        return self._db
+
+    def add(self, scope: str, key: str, vector: list[float]):
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO vectors (scope, key, vector, norm) VALUES (?, ?, ?, ?)",
+                (scope, key, json.dumps(vector), norm),
+            )
+            db.execute(
+                "DELETE FROM vectors WHERE id <= (SELECT MAX(id) FROM vectors) - ?",
+                (self.max_rows,),
+            )
+
+    def nearest(self, scope: str, vector: list[float]) -> tuple[str, float] | None:
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT key, vector, norm FROM vectors WHERE scope = ?", (scope,)
+            ).fetchall()
+        best: tuple[str, float] | None = None
+        for key, raw, other_norm in rows:
+            other = json.loads(raw)
+            if len(other) != len(vector):
+                continue
+            sim = sum(a * b for a, b in zip(vector, other)) / (norm * other_norm)
+            if best is None or sim > best[1]:
+                best = (key, sim)
+        return best
+
+    def clear(self):
+        with self._lock:
+            self._conn().execute("DELETE FROM vectors")
@@ -0,0 +1,136 @@
+"""
+dag_scheduler.py
+────────────────
+Dependency bookkeeping and per-tool concurrency limits for plan steps.
+
+A plan step may carry an optional `id` and a `depends_on` list naming the
+steps it needs. A step without `depends_on` waits for the step before it,
+so plans written without edges still run strictly in order; an explicit
+`"depends_on": []` lets a step start right away.
+
+`PlanGraph` accepts steps one at a time (the plan is streamed) and answers
+"which pending steps can start now?". When the remaining plan is revised
+mid-run, the replaced steps are retired and the revision is appended. `ToolLimiter` caps how many steps of
+each tool run at once across the whole process, queuing waiting steps
+fairly across sessions (see admission.py).
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, Iterable, List, Set
+
+from .admission import FairSemaphore, OnPosition
+
+# How many steps of each tool may run at the same time (process-wide)
+TOOL_CONCURRENCY: Dict[str, int] = {
+    "browser":          int(os.getenv("BROWSER_CONCURRENCY",          "1")),
+    "code_interpreter": int(os.getenv("CODE_INTERPRETER_CONCURRENCY", "3")),
+    "shell_terminal":   int(os.getenv("SHELL_TERMINAL_CONCURRENCY",   "4")),
+}
+DEFAULT_TOOL_CONCURRENCY = 2
+
+
+class ToolLimiter:
+    """
+    One FairSemaphore per tool name, sized from TOOL_CONCURRENCY; the
+    browser and code_interpreter ones are the browser / sandbox resource
+    classes. `slot(tool, on_position=...)` is an async context manager.
+    """
+
+    def __init__(self, limits: Dict[str, int], default: int = DEFAULT_TOOL_CONCURRENCY):
+        self._limits = limits
+        self._default = default
+        self._sems: Dict[str, FairSemaphore] = {}
+
+    def semaphore(self, tool: str | None) -> FairSemaphore:
+        key = tool or "unknown"
+        if key not in self._sems:
+            self._sems[key] = FairSemaphore(key, self._limits.get(key, self._default))
+        return self._sems[key]
+
+    def slot(self, tool: str | None, on_position: OnPosition | None = None):
+        return self.semaphore(tool).slot(on_position=on_position)
+
+
+class PlanGraph:
+    """
+    Step dependencies of a (possibly still streaming) plan.
+    Steps are addressed by their position in the plan (0-based index).
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}          # step id → index
+        self._wanted: List[List[str]] = []      # raw dependency ids per step
+        self._deps: List[Set[int]] = []         # resolved dependency indices
+        self._unresolved: List[Set[str]] = []   # ids not planned (yet)
+        self._retired: Set[int] = set()         # steps replaced by a plan revision
+        self.closed = False
+
+    def __len__(self):
+        return len(self._deps)
+
+    def add(self, task: dict, base: int = 0) -> int:
+        """
+        Registers the next planned step; returns its index. `base` is the
+        first index of the plan revision the step belongs to – the implicit
+        "previous step" dependency never reaches back before it.
+        """
+        idx = len(self._deps)
+        # steps are addressable by explicit id and by 1-based step number
+        if task.get("id") is not None:
+            self._ids[str(task["id"])] = idx
+        self._ids.setdefault(str(idx + 1), idx)
+
+        raw = task.get("depends_on")
+        if raw is None:
+            wanted = [str(idx)] if idx > base else []   # previous step (1-based number)
+        elif isinstance(raw, (list, tuple)):
+            wanted = [str(d) for d in raw]
+        else:
+            wanted = [str(raw)]
+
+        self._wanted.append(wanted)
+        self._deps.append(set())
+        self._unresolved.append(set(wanted))
+        self._resolve()
+        return idx
+
+    def close(self):
+        """Planning finished: dependencies on steps that never appeared are dropped."""
+        self.closed = True
+        for idx, missing in enumerate(self._unresolved):
+            if missing:
+                print(f"Warning: Step {idx + 1} depends on unknown step(s) {sorted(missing)}; ignoring.")
+                missing.clear()
+
+    def retire(self, indices: Iterable[int]):
+        """Steps replaced by a plan revision: never ready, and no step waits on them."""
+        self._retired.update(indices)
+        for deps in self._deps:
+            deps -= self._retired
+        for key, idx in list(self._ids.items()):
+            if idx in self._retired:
+                del self._ids[key]
+
+    def depends_on(self, idx: int) -> Set[int]:
+        return set(self._deps[idx])
+
+    def ready(self, statuses: List[str], started: Iterable[int]) -> List[int]:
+        """Indices of steps not yet started whose dependencies are all 'done'."""
+        started = set(started)
+        return [
+            idx for idx in range(len(self._deps))
+            if idx not in started
+            and idx not in self._retired
+            and not self._unresolved[idx]
+            and all(statuses[d] == "done" for d in self._deps[idx])
+        ]
+
+    def _resolve(self):
+        for idx, missing in enumerate(self._unresolved):
+            for dep in list(missing):
+                if dep in self._ids:
+                    target = self._ids[dep]
+                    missing.discard(dep)
+                    if target != idx and target not in self._retired:
+                        self._deps[idx].add(target)
@@ -0,0 +1,59 @@
+"""
+error_classifier.py
+───────────────────
+Rule-based handling of failed tool calls, tried before the LLM is asked
+for a correction.
+
+Tools report failures as structured ToolResults (see
+tools/tool_result.py), so a failure with a known mechanical fix can be
+repaired locally – no model round-trip:
+
+  missing_module   shell step        pip install the module, run the step again
+
+`local_fix` returns None for everything else; those failures go to
+review_and_resolve as before. A command outside the shell whitelist
+(not_allowed) is deliberately among them: running it by any other route
+would defeat the whitelist, so only the reviewer may replace it. `legacy_error_scan` is the old substring
+check, kept only to count how many successful results it would have sent
+to the LLM.
+"""
+
+from __future__ import annotations
+import re
+from dataclasses import dataclass
+
+from .tools.tool_result import ToolResult
+
+# words the agent used to treat as failure, wherever they appeared in the output
+LEGACY_ERROR_WORDS = ("error:", "failed", "exception", "traceback", "exit code: 1",
+                      "command not found", "module not found")
+
+_MISSING_MODULE = re.compile(r"No module named ['\"]([\w.]+)['\"]")
+
+
+@dataclass
+class LocalFix:
+    rule: str                    # which rule applied (metrics label)
+    task: dict                   # the tool call to run next
+    note: str                    # what the user is told
+    install: str | None = None   # package to pip install before running `task`
+
+
+def legacy_error_scan(text: str) -> bool:
+    lowered = text.lower()
+    return any(word in lowered for word in LEGACY_ERROR_WORDS)
+
+
+def local_fix(task: dict, result: ToolResult) -> LocalFix | None:
+    """The fix for a failure this module knows how to repair, or None."""
+    tool = task.get("tool")
+    if tool != "shell_terminal":
+        return None          # code_interpreter installs missing modules itself
+
+    if result.error_kind == "missing_module":
+        m = _MISSING_MODULE.search(result.stderr or result.text)
+        if m:
+            package = m.group(1).split(".")[0]
+            return LocalFix("missing_module", dict(task), f"Installing missing module '{package}' and re-running",
+                            install=package)
+    return None
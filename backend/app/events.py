@@ -0,0 +1,223 @@
+"""
+events.py
+─────────
+Typed JSON events for `/ws` and the per-connection send queue.
+
+Server → client frames are JSON objects with a `type`:
+
+  {"type": "message", "level": "info"|"error", "text": "Agent: …"}
+  {"type": "stream",  "text": "…"}                  planner / correction tokens
+  {"type": "log",     "source": "shell", "lines": ["…"]}
+                                                    live tool output – may be dropped
+                                                    (then "summary": true, "dropped": n)
+  {"type": "tasks",   "total": 3, "reset": false,
+                      "changed": [{"id": 0, "description": "…", "status": "done"}]}
+                                                    task list delta, keyed by step id
+  {"type": "batch",   "events": [ … ]}              several of the above, in order
+
+`EventChannel` wraps one WebSocket. Producers never wait for the network:
+`send_event` / `send_text` only queue, and a writer task sends what piled
+up every WS_COALESCE_SECONDS as one frame – adjacent stream and log
+events merged, task deltas folded per step id. Full task lists are turned
+into deltas against what this client already has. When a slow client
+lets more than WS_MAX_PENDING events queue up, log lines are summarised
+("… 120 lines dropped …") instead of stalling the workflow; messages,
+stream text and task updates are never dropped.
+
+Code that writes the old prefixed text frames ("Agent: …", "Agent Stream:…",
+"Agent Output (shell):…", "Agent Task Update:[…]") keeps working:
+`send_text` maps them onto these events. `send_event(websocket, event)`
+sends an event to either an EventChannel or a plain socket (legacy text).
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import os
+import re
+
+from .metrics import counter
+
+WS_COALESCE_SECONDS = float(os.getenv("WS_COALESCE_MS", "30")) / 1000
+WS_MAX_PENDING      = int(os.getenv("WS_MAX_PENDING", "200"))
+WS_CLOSE_SECONDS    = 2.0                      # how long aclose() waits for the last frames
+
+WS_FRAMES  = counter("ws_frames_sent_total", "Frames sent to WebSocket clients.")
+WS_EVENTS  = counter("ws_events_total", "Events queued for WebSocket clients.", ("type",))
+WS_DROPPED = counter("ws_log_lines_dropped_total", "Log lines dropped for lagging WebSocket clients.")
+
+_OUTPUT_RE = re.compile(r"Agent Output \((.*?)\):\n?", re.DOTALL)
+
+
+# ───────────────────────────────────────────────── legacy text ↔ events
+def event_from_text(text: str) -> dict:
+    if text.startswith("Agent Stream:"):
+        return {"type": "stream", "text": text[len("Agent Stream:"):]}
+    m = _OUTPUT_RE.match(text)
+    if m:
+        return {"type": "log", "source": m.group(1), "lines": text[m.end():].split("\n")}
+    if text.startswith("Agent Task Update:"):
+        try:
+            tasks = json.loads(text[len("Agent Task Update:"):])
+            return {"type": "tasks", "tasks": [dict(t, id=i) for i, t in enumerate(tasks)]}
+        except ValueError:
+            pass
+    level = "error" if text.lstrip("*").startswith("Agent Error") else "info"
+    return {"type": "message", "level": level, "text": text}
+
+def text_from_event(event: dict) -> str:
+    """The old text frame for an event (clients that are not EventChannels)."""
+    kind = event.get("type")
+    if kind == "stream":
+        return "Agent Stream:" + event["text"]
+    if kind == "log":
+        return f"Agent Output ({event['source']}):\n" + "\n".join(event["lines"])
+    if kind == "tasks":
+        tasks = [{"description": t.get("description"), "status": t.get("status")} for t in event["tasks"]]
+        return "Agent Task Update:" + json.dumps(tasks)
+    return event.get("text", "")
+
+async def send_event(websocket, event: dict):
+    sender = getattr(websocket, "send_event", None)
+    if sender is not None:
+        await sender(event)
+    else:
+        await websocket.send_text(text_from_event(event))
+
+
+# ───────────────────────────────────────────────── per-connection channel
+class EventChannel:
+    def __init__(self, websocket, *, window: float = WS_COALESCE_SECONDS, max_pending: int = WS_MAX_PENDING):
+        self.websocket = websocket
+        self.window = window
+        self.max_pending = max_pending
+        self.closed = False
+        self._closing = False
+        self.dropped_lines = 0
+        self._pending: list[dict] = []
+        self._tasks: list[tuple] = []          # (description, status) the client has, by step id
+        self._wake = asyncio.Event()
+        self._writer = asyncio.create_task(self._run())
+
+    # ─── producer side (never blocks on the network) ────────────
+    async def send_text(self, text: str):
+        await self.send_event(event_from_text(text))
+
+    async def send_json(self, data):
+        await self.send_event(data if isinstance(data, dict) and "type" in data
+                              else {"type": "message", "level": "info", "text": json.dumps(data)})
+
+    async def send_event(self, event: dict):
+        if self.closed:
+            return
+        if event.get("type") == "tasks" and "tasks" in event:
+            event = self._task_delta(event["tasks"])
+            if event is None:
+                return
+        WS_EVENTS.inc(type=event.get("type", "message"))
+        self._pending.append(event)
+        if len(self._pending) > self.max_pending:
+            self._shed_logs()
+        self._wake.set()
+
+    def _task_delta(self, tasks: list[dict]) -> dict | None:
+        current = [(t.get("description"), t.get("status")) for t in tasks]
+        reset = not current or len(current) < len(self._tasks)
+        changed = [
+            {"id": i, "description": d, "status": s}
+            for i, (d, s) in enumerate(current)
+            if reset or i >= len(self._tasks) or self._tasks[i] != (d, s)
+        ]
+        self._tasks = current
+        if not changed and not reset:
+            return None
+        return {"type": "tasks", "total": len(current), "reset": reset, "changed": changed}
+
+    def _shed_logs(self):
+        """Client is lagging: replace queued log lines by a one-line summary per source."""
+        kept, dropped = [], {}
+        for event in self._pending:
+            if event.get("type") != "log":
+                kept.append(event)
+                continue
+            source = event["source"]
+            if event.get("summary"):                   # fold earlier summaries into the new one
+                dropped[source] = dropped.get(source, 0) + event["dropped"]
+            else:
+                n = len(event["lines"])
+                dropped[source] = dropped.get(source, 0) + n
+                self.dropped_lines += n
+                WS_DROPPED.inc(n)
+        for source, n in dropped.items():
+            kept.append({"type": "log", "source": source, "summary": True, "dropped": n,
+                         "lines": [f"… {n} lines dropped (connection too slow) …"]})
+        self._pending = kept
+
+    # ─── writer side ────────────────────────────────────────────
+    async def _run(self):
+        try:
+            while True:
+                await self._wake.wait()
+                if not self._closing:
+                    await asyncio.sleep(self.window)    # let the burst pile up
+                self._wake.clear()
+                await self._flush()
+                if self._closing and not self._pending:
+                    return
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.closed = True                     # client gone; producers carry on
+            print(f"[ws] send failed: {e}")
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        events, self._pending = coalesce(self._pending), []
+        frame = events[0] if len(events) == 1 else {"type": "batch", "events": events}
+        await self.websocket.send_text(json.dumps(frame))
+        WS_FRAMES.inc()
+
+    async def aclose(self):
+        """Sends what is still queued (for up to WS_CLOSE_SECONDS), then stops the writer."""
+        self._closing = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._writer), WS_CLOSE_SECONDS)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        self._writer.cancel()
+        await asyncio.gather(self._writer, return_exceptions=True)
+        self.closed = True
+
+
+def coalesce(events: list[dict]) -> list[dict]:
+    """Merges adjacent stream / log events and folds task deltas per step id."""
+    out: list[dict] = []
+    tasks_at = None                              # index of the merged tasks event in `out`
+    for event in events:
+        kind = event.get("type")
+        last = out[-1] if out else None
+        if kind == "stream" and last and last.get("type") == "stream":
+            last["text"] += event["text"]
+        elif (kind == "log" and last and last.get("type") == "log"
+              and last["source"] == event["source"] and not last.get("summary")):
+            last["lines"] = last["lines"] + event["lines"]
+        elif kind == "tasks":
+            if tasks_at is None or event.get("reset"):
+                if tasks_at is not None:
+                    out.pop(tasks_at)
+                merged = {"type": "tasks", "total": event["total"], "reset": event.get("reset", False),
+                          "changed": {c["id"]: c for c in event["changed"]}}
+            else:
+                merged = out.pop(tasks_at)
+                merged["total"] = event["total"]
+                merged["changed"].update({c["id"]: c for c in event["changed"]})
+            out.append(merged)                   # at the position of the latest update
+            tasks_at = len(out) - 1
+        else:
+            out.append(dict(event))
+    for event in out:
+        if event.get("type") == "tasks":
+            event["changed"] = [c for i, c in sorted(event["changed"].items()) if i < event["total"]]
+    return out
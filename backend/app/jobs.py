@@ -0,0 +1,251 @@
+"""
+jobs.py
+───────
+Detached workflows: run in the background, independent of any client
+connection, and watched over HTTP.
+
+    POST   /api/workflows                 {"query": "...", models…}  → {"id": …}
+    GET    /api/workflows                 jobs in memory, newest first
+    GET    /api/workflows/{id}            state, outcome, task list, event count
+    GET    /api/workflows/{id}/events     Server-Sent Events from ?offset=N
+                                          (or the Last-Event-ID header + 1)
+    POST   /api/workflows/{id}/resume     continue its journal (journal.py)
+    DELETE /api/workflows/{id}            cancel
+
+A job's events – the same typed events /ws sends (events.py) – go into
+an `EventBuffer` instead of a socket. Every event gets the next offset;
+a stream replays from the offset a client asks for, then follows the
+job live until it finishes, so a client that drops simply reconnects
+with the last offset it saw. The buffer keeps the newest
+JOB_EVENT_BUFFER events; a client asking for older ones first gets
+{"type": "gap", "dropped": n}.
+
+Jobs queue at WORKFLOW_GATE like /ws requests (`admitted_workflow`, also
+used by main.ws_endpoint). Finished jobs stay listed for
+JOB_RETENTION_SECONDS (at most JOB_MAX_FINISHED of them); their journals
+outlive them. Jobs still running at shutdown are cancelled – their
+journals make them resumable after the restart.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from .admission import WORKFLOW_GATE, QueueFull, current_session
+from .agent import handle_agent_workflow
+from .events import event_from_text
+from .journal import JournalState, new_workflow_id
+from .metrics import callback, counter
+from .session import SessionContext
+
+JOB_EVENT_BUFFER      = int(os.getenv("JOB_EVENT_BUFFER", "5000"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+JOB_MAX_FINISHED      = int(os.getenv("JOB_MAX_FINISHED", "200"))
+SSE_KEEPALIVE_SECONDS = 15.0
+
+JOBS_SUBMITTED = counter("jobs_submitted_total", "Detached workflows submitted.", ("kind",))
+
+
+# ───────────────────────────────────────────────── admission (shared with /ws)
+async def admitted_workflow(ws, ctx: SessionContext, user_query: str,
+                            resume: JournalState | None = None, workflow_id: str | None = None):
+    """
+    Runs one workflow (or resumes a journaled one) once WORKFLOW_GATE
+    admits it, telling the client its queue position meanwhile; a full
+    queue is reported and nothing runs.
+    """
+    async def on_position(position: int, queued: int):
+        await ws.send_text(f"Agent: Server busy – your request is number {position} of {queued} in the queue.")
+
+    current_session.set(ctx.client)    # steps and LLM calls queue under this client
+    admitted = False
+    try:
+        async with WORKFLOW_GATE.slot(ctx.client, on_position):
+            admitted = True
+            await handle_agent_workflow(user_query, ctx, ws, resume, workflow_id)
+    except QueueFull as e:
+        await ws.send_text(f"Agent Error: Server is at capacity ({e.queued} requests waiting). Please try again shortly.")
+    except asyncio.CancelledError:
+        if not admitted: # still queued – the workflow reports its own cancellation
+            try:
+                await ws.send_text(f"Agent: Queued request withdrawn ({ctx.cancel_reason or 'cancelled'}).")
+            except Exception:
+                pass
+        raise
+
+
+# ───────────────────────────────────────────────── event buffer
+class EventBuffer:
+    """Stands in for the WebSocket of a detached workflow: events are kept, numbered, for readers."""
+
+    def __init__(self, capacity: int = JOB_EVENT_BUFFER):
+        self.events: deque[dict] = deque(maxlen=capacity)
+        self.first = 0                          # offset of events[0]
+        self.tasks: list[dict] = []             # latest task list
+        self.workflow: dict | None = None       # latest "workflow" event (started / resumed / finished)
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    @property
+    def next_offset(self) -> int:
+        return self.first + len(self.events)
+
+    async def send_text(self, text: str):
+        await self.send_event(event_from_text(text))
+
+    async def send_json(self, data):
+        await self.send_event(data if isinstance(data, dict) and "type" in data
+                              else {"type": "message", "level": "info", "text": json.dumps(data)})
+
+    async def send_event(self, event: dict):
+        if event.get("type") == "tasks" and "tasks" in event:
+            # full list → the /ws delta format, as a reset (readers may join at any point)
+            self.tasks = [{"id": i, "description": t.get("description"), "status": t.get("status")}
+                          for i, t in enumerate(event["tasks"])]
+            event = {"type": "tasks", "total": len(self.tasks), "reset": True, "changed": self.tasks}
+        elif event.get("type") == "workflow":
+            self.workflow = event
+        self.append(event)
+
+    def append(self, event: dict):
+        if self.closed:
+            return
+        if len(self.events) == self.events.maxlen:
+            self.first += 1
+        self.events.append(event)
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, offset: int = 0, idle: float | None = None):
+        """
+        Yields (offset, event) from `offset` on, live, until the buffer is
+        closed and read; (None, None) after `idle` seconds without news.
+        """
+        while True:
+            if offset < self.first:
+                yield self.first - 1, {"type": "gap", "dropped": self.first - offset}
+                offset = self.first
+            while offset < self.next_offset:
+                yield offset, self.events[offset - self.first]
+                offset += 1
+            if self.closed:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), idle)
+            except asyncio.TimeoutError:
+                yield None, None
+
+
+# ───────────────────────────────────────────────── jobs
+@dataclass
+class Job:
+    id: str
+    query: str
+    ctx: SessionContext
+    resume: JournalState | None = None
+    events: EventBuffer = field(default_factory=EventBuffer)
+    created: float = field(default_factory=time.time)
+    finished: float | None = None
+    outcome: str | None = None
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    @property
+    def state(self) -> str:
+        if self.finished is not None:
+            return "finished"
+        return "running" if self.events.workflow else "queued"
+
+    def summary(self) -> dict:
+        return {
+            "id":       self.id,
+            "query":    self.query,
+            "state":    self.state,
+            "outcome":  self.outcome,
+            "created":  self.created,
+            "finished": self.finished,
+            "events":   self.events.next_offset,
+        }
+
+
+class JobManager:
+    def __init__(self):
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def running(self) -> list[Job]:
+        return [j for j in self.jobs.values() if j.finished is None]
+
+    def submit(self, query: str, ctx: SessionContext, resume: JournalState | None = None) -> Job:
+        self._prune()
+        job = Job(id=resume.workflow_id if resume else new_workflow_id(), query=query, ctx=ctx, resume=resume)
+        self.jobs[job.id] = job
+        self.jobs.move_to_end(job.id)
+        job.task = asyncio.create_task(self._run(job))
+        JOBS_SUBMITTED.inc(kind="resume" if resume else "new")
+        return job
+
+    async def _run(self, job: Job):
+        try:
+            await admitted_workflow(job.events, job.ctx, job.query, job.resume, job.id)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            traceback.print_exc()
+            job.events.append({"type": "message", "level": "error", "text": f"Agent Error: {e}"})
+        finally:
+            last = job.events.workflow or {}
+            job.outcome = last.get("outcome") or ("cancelled" if job.ctx.is_cancelled else "rejected")
+            job.finished = time.time()
+            job.events.close()
+
+    async def cancel(self, job: Job, reason: str = "cancelled by user"):
+        if job.task is None or job.task.done():
+            return
+        job.ctx.cancel(reason)
+        job.task.cancel(reason)
+        await asyncio.gather(job.task, return_exceptions=True)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        for n, job in enumerate(reversed(finished)):       # newest first
+            if n >= JOB_MAX_FINISHED or job.finished < cutoff:
+                del self.jobs[job.id]
+
+    async def aclose(self):
+        """Cancels what still runs; their journals keep them resumable."""
+        await asyncio.gather(*(self.cancel(j, "server shutting down") for j in self.running()))
+
+
+JOBS = JobManager()
+
+callback("jobs_running", "Detached workflows not finished yet.", (),
+         lambda: {(): len(JOBS.running())})
+
+
+async def sse_stream(job: Job, offset: int):
+    """The job's events from `offset` as Server-Sent Events, live until it finishes."""
+    events = job.events.follow(offset, idle=SSE_KEEPALIVE_SECONDS)
+    try:
+        async for n, event in events:
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"id: {n}\nevent: {event.get('type', 'message')}\ndata: {json.dumps(event)}\n\n"
+        yield f"event: end\ndata: {json.dumps(job.summary())}\n\n"
+    finally:
+        await events.aclose()
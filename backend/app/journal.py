@@ -0,0 +1,269 @@
+"""
+journal.py
+──────────
+Append-only journal per workflow, so a restart, a crash or a dropped
+WebSocket does not cost the plan and the steps already finished.
+
+Every workflow writes one JSON line per event to
+JOURNAL_DIR/<workflow_id>.jsonl:
+
+  {"type": "start",      "query": "…", "settings": {…}}     request + model choices
+  {"type": "step",       "idx": 0, "base": 0, "task": {…}}   a planned step (base: its plan revision)
+  {"type": "planned",    "steps": 4}                         planning finished
+  {"type": "attempt",    "idx": 0, "attempt": 1, "task": {…}}
+  {"type": "correction", "idx": 0, "source": "llm"|<rule>, "task": {…}}
+  {"type": "result",     "idx": 0, "status": "done"|"error", "task": {…},
+                         "result": "…", "error_kind": null, "description": "…"}
+  {"type": "replan",     "trigger": "failure", "retired": [2, 3]}
+  {"type": "resume",     "replan": false}                    a later run picked it up
+  {"type": "end",        "outcome": "ok"|"error"|"limit"|"cancelled", "message": "…"}
+
+`record()` only queues the line; a flush writes what piled up within
+JOURNAL_FLUSH_SECONDS with one write + fsync (in a thread), so journaling
+costs the workflow neither a syscall per event nor an event-loop stall.
+`aclose()` writes the rest.
+
+`load_journal(id)` replays a journal into a `JournalState`: the plan as it
+stands after revisions, which steps finished and their results. A workflow
+that did not end "ok" can be resumed from it (see handle_agent_workflow):
+finished steps keep their results, everything else runs again.
+
+`compact_journals()` prunes journals older than JOURNAL_RETENTION_HOURS and
+keeps at most JOURNAL_MAX_FILES; `run_compactor()` does so every
+JOURNAL_COMPACT_SECONDS for the life of the server.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from .metrics import counter
+
+JOURNAL_ENABLED         = os.getenv("JOURNAL", "1") != "0"
+JOURNAL_DIR             = os.getenv("JOURNAL_DIR") or os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "tasks", "journal"))
+JOURNAL_FLUSH_SECONDS   = float(os.getenv("JOURNAL_FLUSH_MS", "200")) / 1000
+JOURNAL_RETENTION_HOURS = float(os.getenv("JOURNAL_RETENTION_HOURS", "168"))
+JOURNAL_MAX_FILES       = int(os.getenv("JOURNAL_MAX_FILES", "500"))
+JOURNAL_COMPACT_SECONDS = float(os.getenv("JOURNAL_COMPACT_SECONDS", "3600"))
+
+_ID_RE = re.compile(r"^[0-9a-f]{8,32}$")
+
+RECORDS = counter("journal_records_total", "Workflow journal records written.", ("type",))
+FSYNCS  = counter("journal_fsyncs_total", "Workflow journal flushes (one write + fsync each).")
+PRUNED  = counter("journal_pruned_total", "Workflow journals removed by compaction.")
+
+ACTIVE: set[str] = set()          # workflows with an open journal in this process
+
+
+def new_workflow_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+def journal_path(workflow_id: str) -> str | None:
+    """Path of a workflow's journal, or None for an id that is not one of ours."""
+    if not _ID_RE.match(workflow_id or ""):
+        return None
+    return os.path.join(JOURNAL_DIR, f"{workflow_id}.jsonl")
+
+
+# ───────────────────────────────────────────────── writer
+class WorkflowJournal:
+    def __init__(self, workflow_id: str, *, enabled: bool = JOURNAL_ENABLED,
+                 flush_seconds: float = JOURNAL_FLUSH_SECONDS):
+        self.workflow_id = workflow_id
+        self.path = journal_path(workflow_id) if enabled else None
+        self.flush_seconds = flush_seconds
+        self._buffer: list[str] = []
+        self._flusher: asyncio.Task | None = None
+        self._lock = asyncio.Lock()           # one flush at a time keeps records in order
+        self._file = None
+        if self.path:
+            ACTIVE.add(workflow_id)
+
+    def record(self, kind: str, **fields):
+        if not self.path:
+            return
+        entry = {"t": round(time.time(), 3), "type": kind, **fields}
+        self._buffer.append(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        RECORDS.inc(type=kind)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_seconds)
+        self._flusher = None
+        await asyncio.shield(self.flush())    # a started write is never abandoned halfway
+
+    async def flush(self):
+        async with self._lock:
+            if not self._buffer:
+                return
+            data, self._buffer = "".join(self._buffer), []
+            try:
+                await asyncio.to_thread(self._write, data)
+            except OSError as e:
+                print(f"[journal] write to {self.path} failed: {e}")
+
+    def _write(self, data: str):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        FSYNCS.inc()
+
+    async def aclose(self):
+        """Writes what is queued and closes the file – even when the caller is cancelled meanwhile."""
+        if not self.path:
+            return
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await asyncio.shield(self._close())
+
+    async def _close(self):
+        try:
+            await self.flush()
+            async with self._lock:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+        finally:
+            ACTIVE.discard(self.workflow_id)
+
+
+# ───────────────────────────────────────────────── replay
+@dataclass
+class JournalState:
+    workflow_id: str
+    query: str = ""
+    settings: dict = field(default_factory=dict)   # request fields for SessionContext.from_request
+    tasks: list[dict] = field(default_factory=list)
+    retired: set[int] = field(default_factory=set)
+    planned: bool = False                          # the plan (as revised) was complete
+    outcome: str | None = None                     # None: never ended (crash / restart)
+    started: float = 0.0
+    updated: float = 0.0
+
+    @property
+    def resumable(self) -> bool:
+        return self.outcome != "ok" and self.workflow_id not in ACTIVE
+
+    def done_steps(self) -> list[dict]:
+        return [t for i, t in enumerate(self.tasks) if t["status"] == "done" and i not in self.retired]
+
+    def summary(self) -> dict:
+        live = [t for i, t in enumerate(self.tasks) if i not in self.retired]
+        return {
+            "workflow_id": self.workflow_id,
+            "query":       self.query,
+            "started":     self.started,
+            "updated":     self.updated,
+            "steps":       len(live),
+            "done":        sum(t["status"] == "done" for t in live),
+            "planned":     self.planned,
+            "outcome":     self.outcome,
+            "running":     self.workflow_id in ACTIVE,
+            "resumable":   self.resumable,
+        }
+
+
+def load_journal(workflow_id: str) -> JournalState | None:
+    """Replays a workflow's journal; None when there is none."""
+    path = journal_path(workflow_id)
+    if not path or not os.path.exists(path):
+        return None
+    state = JournalState(workflow_id)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue                     # torn last line of a crashed write
+            _apply(state, entry)
+    return state
+
+def _apply(state: JournalState, entry: dict):
+    kind = entry.get("type")
+    state.updated = entry.get("t", state.updated)
+    if kind == "start":
+        state.query = entry.get("query", "")
+        state.settings = entry.get("settings") or {}
+        state.started = entry.get("t", 0.0)
+    elif kind == "step":
+        state.tasks.append({"original_task": entry["task"], "base": entry.get("base", 0),
+                            "description": entry["task"].get("description"), "status": "pending",
+                            "result": None, "final_executed_task": None, "error_kind": None})
+    elif kind == "planned":
+        state.planned = True
+    elif kind == "result" and 0 <= entry.get("idx", -1) < len(state.tasks):
+        state.tasks[entry["idx"]].update(
+            status=entry.get("status"), result=entry.get("result"),
+            final_executed_task=entry.get("task"), error_kind=entry.get("error_kind"),
+            description=entry.get("description") or state.tasks[entry["idx"]]["description"])
+    elif kind == "replan":
+        state.retired.update(entry.get("retired", []))
+        for i in entry.get("retired", []):
+            if 0 <= i < len(state.tasks) and state.tasks[i]["status"] != "done":
+                state.tasks[i]["status"] = "replaced"
+        state.planned = False                # the revision's steps follow
+    elif kind == "resume":
+        state.outcome = None
+        if entry.get("replan"):              # planned again from scratch
+            state.tasks, state.retired, state.planned = [], set(), False
+    elif kind == "end":
+        state.outcome = entry.get("outcome")
+
+def list_journals() -> list[dict]:
+    """Summaries of every journal on disk, newest first."""
+    try:
+        names = os.listdir(JOURNAL_DIR)
+    except FileNotFoundError:
+        return []
+    out = []
+    for name in names:
+        if name.endswith(".jsonl"):
+            state = load_journal(name[:-len(".jsonl")])
+            if state:
+                out.append(state.summary())
+    return sorted(out, key=lambda s: s["updated"], reverse=True)
+
+
+# ───────────────────────────────────────────────── compaction
+def compact_journals(*, retention_hours: float = JOURNAL_RETENTION_HOURS,
+                     max_files: int = JOURNAL_MAX_FILES) -> int:
+    """Removes expired journals, then the oldest beyond `max_files`; returns how many."""
+    try:
+        entries = [e for e in os.scandir(JOURNAL_DIR) if e.name.endswith(".jsonl")]
+    except FileNotFoundError:
+        return 0
+    entries = [e for e in entries if e.name[:-len(".jsonl")] not in ACTIVE]
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    cutoff = time.time() - retention_hours * 3600
+    keep = max(0, max_files - len(ACTIVE))
+    removed = 0
+    for n, entry in enumerate(entries):
+        if n >= keep or entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError as e:
+                print(f"[journal] could not remove {entry.path}: {e}")
+    if removed:
+        PRUNED.inc(removed)
+        print(f"[journal] pruned {removed} old journal(s)")
+    return removed
+
+async def run_compactor():
+    while True:
+        try:
+            await asyncio.to_thread(compact_journals)
+        except Exception as e:
+            print(f"[journal] compaction failed: {e}")
+        await asyncio.sleep(JOURNAL_COMPACT_SECONDS)
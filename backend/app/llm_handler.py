@@ -3,19 +3,32 @@ llm_handler.py
 ──────────────
 Centralised helpers for talking to a local Ollama server.
 
-✓ Lists local models via the Ollama **HTTP API** (no CLI required)
-✓ Falls back to `ollama list --json` if the REST endpoint is unreachable
-✓ Auto-pulls a model the first time it is requested
+✓ Model catalog (`MODEL_CATALOG`): /api/tags metadata + residency, cached
+  for MODELS_TTL_SECONDS and revalidated in the background – no blocking
+  HTTP call and no `ollama` CLI on the request path
+✓ Pulls models lazily – in a background warm-up and on first use, never at
+  import time – and reports pull progress to listeners
+✓ Async chat helpers on a pooled keep-alive connection (`achat`, …)
+✓ Token streaming (`astream_chat`) for progressive UI output
+✓ Model residency: keep_alive on every call, preloading of the model the
+  next plan step needs, /api/ps tracking and per-model load times
+✓ Persistent response cache keyed on (model, system prompt hash, prompt),
+  with an optional embedding-similarity tier for near-duplicate queries
 ✓ Exposes helpers used by the rest of the backend
 """
 from __future__ import annotations
 
-import http.client, json, os, ssl, subprocess, traceback, urllib.parse, shutil
-from typing import Dict, List
+import asyncio, hashlib, json, os, traceback
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
 
+import httpx
 import ollama
 from dotenv import load_dotenv
 
+from .admission import LLM_GATE
+from .cache import SQLiteLRUCache, SQLiteVectorIndex
+from .metrics import callback, counter, histogram, span
+
 # ─── env / defaults ──────────────────────────────────────────────
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"), override=True)
 
@@ -23,81 +36,194 @@ OLLAMA                 = os.getenv("OLLAMA_ENDPOINT", "http://localhost:11434")
 PLANNING_TOOLING_MODEL = os.getenv("PLANNING_TOOLING_MODEL", "llama3:latest")
 DEEPCODER_MODEL        = os.getenv("DEEPCODER_MODEL",        "deepcoder:latest")
 
+# per-call ceiling for a single chat round-trip (seconds)
+OLLAMA_TIMEOUT         = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+# size of the keep-alive pool shared by every async caller
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16"))
+# models pulled by the start-up warm-up (others are pulled on first use)
+WARMUP_MODELS          = [m.strip() for m in os.getenv(
+    "WARMUP_MODELS", f"{PLANNING_TOOLING_MODEL},{DEEPCODER_MODEL}").split(",") if m.strip()]
+# a pull may take a long time on a slow link
+OLLAMA_PULL_TIMEOUT    = float(os.getenv("OLLAMA_PULL_TIMEOUT", "3600"))
+# how long Ollama keeps a model in memory after our last request
+OLLAMA_KEEP_ALIVE      = os.getenv("OLLAMA_KEEP_ALIVE", "15m")
+# preload the model the next plan step needs (0 disables)
+MODEL_PRELOAD          = os.getenv("MODEL_PRELOAD", "1") == "1"
+# /api/ps results are reused for this long (seconds)
+RESIDENCY_POLL_SECONDS = float(os.getenv("RESIDENCY_POLL_SECONDS", "10"))
+# the model catalog is served from cache this long, then revalidated behind
+# the response; past MODELS_MAX_STALE_SECONDS a request waits for /api/tags
+MODELS_TTL_SECONDS       = float(os.getenv("MODELS_TTL_SECONDS", "30"))
+MODELS_MAX_STALE_SECONDS = float(os.getenv("MODELS_MAX_STALE_SECONDS", "600"))
+# a failed refresh is not retried for this long, doubling per consecutive
+# failure up to MODELS_TTL_SECONDS; the cached catalog (or []) and the error
+# are served meanwhile
+MODELS_RETRY_SECONDS     = float(os.getenv("MODELS_RETRY_SECONDS", "5"))
+
+# response cache (initial plans only); bypassed per request
+LLM_CACHE_ENABLED     = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_DIR         = os.getenv(
+    "LLM_CACHE_DIR", os.path.join(os.path.dirname(__file__), "..", "tasks", ".cache")
+)
+LLM_CACHE_TTL         = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "500"))
+LLM_CACHE_MAX_MB      = float(os.getenv("LLM_CACHE_MAX_MB", "32"))
+# optional second tier: reuse answers for near-duplicate queries
+LLM_CACHE_SEMANTIC    = os.getenv("LLM_CACHE_SEMANTIC", "0") == "1"
+LLM_CACHE_EMBED_MODEL = os.getenv("LLM_CACHE_EMBED_MODEL", "nomic-embed-text")
+LLM_CACHE_SIMILARITY  = float(os.getenv("LLM_CACHE_SIMILARITY", "0.95"))
+
 _client = ollama.Client(host=OLLAMA)
+_async_client: ollama.AsyncClient | None = None
+_async_transport: httpx.AsyncHTTPTransport | None = None   # its connection pool – ours to close
 
-# ──────────────────────────────────────────────────────────────────
-# 1) minimal HTTP helper that avoids the `context` kwarg on plain HTTP
-# -----------------------------------------------------------------
-def _http_json(method: str, path: str, body: Dict | None = None) -> Dict:
-    url  = urllib.parse.urlparse(OLLAMA)
-    port = url.port or (443 if url.scheme == "https" else 80)
-
-    if url.scheme == "https":
-        conn = http.client.HTTPSConnection(
-            url.hostname,
-            port,
-            context=ssl._create_unverified_context()      # accept self-signed
-        )
-    else:
-        conn = http.client.HTTPConnection(url.hostname, port)
-
-    conn.request(
-        method, path, json.dumps(body or {}),
-        {"Content-Type": "application/json"},
-    )
-    res  = conn.getresponse()
-    data = res.read().decode()
-    conn.close()
-    return json.loads(data)
+# ─── metrics (request latency is the "llm" / "llm_stream" span) ──
+LLM_REQUESTS    = counter("llm_requests_total", "LLM requests by outcome.", ("model", "outcome"))
+LLM_TOKENS      = counter("llm_tokens_total", "Tokens evaluated by Ollama.", ("model", "kind"))
+LLM_TOKEN_RATE  = histogram("llm_tokens_per_second", "Generation speed reported by Ollama.", ("model",),
+                            buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400))
+LLM_FIRST_TOKEN = histogram("llm_first_token_seconds", "Time to the first streamed token.", ("model",))
+MODEL_LOAD      = histogram("ollama_model_load_seconds", "Model load time reported by Ollama.", ("model",))
+MODEL_CATALOG_REQUESTS  = counter("model_catalog_requests_total", "Model catalog reads by cache state.", ("result",))
+MODEL_CATALOG_REFRESHES = counter("model_catalog_refreshes_total", "Model catalog refreshes from /api/tags.", ("outcome",))
 
-# ─── 2) discover local models ────────────────────────────────────
-def list_local_models() -> List[str]:
+def _record_usage(model: str, resp) -> None:
+    """Token counts / speed and load time from a final Ollama response."""
+    RESIDENCY.observe(model, resp.get("load_duration"))
+    prompt_tokens, eval_tokens = resp.get("prompt_eval_count") or 0, resp.get("eval_count") or 0
+    LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    LLM_TOKENS.inc(eval_tokens, model=model, kind="completion")
+    eval_ns = resp.get("eval_duration") or 0
+    if eval_tokens and eval_ns:
+        LLM_TOKEN_RATE.observe(eval_tokens / (eval_ns / 1e9), model=model)
+
+# ─── 1) model catalog (what /api/models serves) ──────────────────
+class ModelCatalog:
     """
-    Returns e.g.  ["llama3:latest", "qwen2.5:7b", …]
+    Local models with their metadata, cached for MODELS_TTL_SECONDS.
+
+    A request never waits on Ollama while there is something cached: a
+    stale catalog is served as is and refreshed in the background
+    (stale-while-revalidate); only the very first call – or one after
+    MODELS_MAX_STALE_SECONDS – waits for /api/tags. Concurrent refreshes
+    share one task, and a failed refresh keeps the last good catalog.
+    A failure is remembered too: until its backoff runs out, requests get
+    the cached catalog (or []) with the error and Ollama is not asked again.
+    The ETag covers models and error, so it changes exactly when the
+    response body does.
     """
-    # preferred: REST
-    try:
-        resp = _http_json("GET", "/api/tags")
-        out: List[str] = [
-            m.get("model") or m.get("name")
-            for m in resp.get("models", [])
-            if (m.get("model") or m.get("name"))
-        ]
-        if out:
-            return sorted(set(out))
-    except Exception as e:
-        print(f"[ollama] REST discovery failed: {e} – falling back to CLI")
 
-    # fallback: CLI
-    try:
-        if not shutil.which("ollama"):
-            raise FileNotFoundError("ollama CLI not found in PATH")
+    def __init__(self):
+        self.models: List[Dict] = []
+        self.etag = ""
+        self.error: str | None = None
+        self.refreshes = 0
+        self._fetched_at: float | None = None   # loop time of the last successful refresh
+        self._retry_at = 0.0                     # no refresh before this loop time
+        self._failures = 0                       # consecutive failed refreshes
+        self._refreshing: asyncio.Task | None = None
 
-        raw = subprocess.check_output(
-            ["ollama", "list", "--json"], text=True
-        )
-        # one JSON object PER LINE
-        names = [
-            json.loads(line)["name"]
-            for line in raw.splitlines()
-            if line.strip()
-        ]
-        return sorted(set(names))
-
-    except Exception as e2:
-        print(f"[ollama] CLI fallback failed: {e2}")
-        return []          # fail-soft → empty dropdowns
+    def _age(self) -> float:
+        if self._fetched_at is None:
+            return float("inf")
+        return asyncio.get_running_loop().time() - self._fetched_at
 
-# ─── 3) small wrappers used by the rest of the app ───────────────
-def _ensure(model: str):
-    try:
-        _client.pull(model)
-    except Exception as e:
-        print(f"[ollama] pull failed for {model}: {e}")
+    async def get(self) -> tuple[List[Dict], str]:
+        """(models, etag) – from the cache whenever it is usable."""
+        age = self._age()
+        if self._failures and asyncio.get_running_loop().time() < self._retry_at:
+            MODEL_CATALOG_REQUESTS.inc(result="backoff")
+        elif age > MODELS_MAX_STALE_SECONDS:
+            await self.refresh()
+        elif age > MODELS_TTL_SECONDS:
+            self._start_refresh()                # serve stale, revalidate behind it
+            MODEL_CATALOG_REQUESTS.inc(result="stale")
+        else:
+            MODEL_CATALOG_REQUESTS.inc(result="fresh")
+        return self.models, self.etag
 
-for _m in (PLANNING_TOOLING_MODEL, DEEPCODER_MODEL):
-    _ensure(_m)
+    def invalidate(self) -> None:
+        """A model was pulled or removed: the next `get` revalidates."""
+        self._retry_at = 0.0
+        if self._fetched_at is not None:
+            self._fetched_at -= MODELS_TTL_SECONDS + 1
 
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        return self._refreshing
+
+    async def refresh(self) -> List[Dict]:
+        """Fetches the catalog now (joining a refresh already under way)."""
+        MODEL_CATALOG_REQUESTS.inc(result="wait")
+        # shield: a client that goes away must not abort the refresh others wait on
+        await asyncio.shield(self._start_refresh())
+        return self.models
+
+    async def _refresh(self) -> None:
+        try:
+            with span("ollama_tags"):
+                tags, resident = await asyncio.gather(
+                    asyncio.wait_for(_get_async_client().list(), timeout=5),
+                    RESIDENCY.refresh(),
+                )
+            models = sorted((_model_entry(m, resident) for m in tags.get("models", []) or []
+                             if m.get("model") or m.get("name")), key=lambda m: m["name"])
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if error != self.error:
+                print(f"[ollama] model discovery failed: {error}")
+            self._failures += 1
+            delay = min(MODELS_RETRY_SECONDS * 2 ** (self._failures - 1),
+                        max(MODELS_TTL_SECONDS, MODELS_RETRY_SECONDS))
+            self._retry_at = asyncio.get_running_loop().time() + delay
+            self._set(self.models, error)
+            MODEL_CATALOG_REFRESHES.inc(outcome="error")
+            return
+        self._failures = 0
+        self._set(models, None)
+        self._fetched_at = asyncio.get_running_loop().time()
+        self.refreshes += 1
+        MODEL_CATALOG_REFRESHES.inc(outcome="ok")
+
+    def _set(self, models: List[Dict], error: str | None) -> None:
+        payload = json.dumps({"models": models, "error": error}, sort_keys=True, default=str)
+        self.models, self.error = models, error
+        self.etag = '"' + hashlib.sha1(payload.encode()).hexdigest()[:16] + '"'
+
+    def stats(self) -> Dict:
+        return {"models": len(self.models), "age_seconds": self._age() if self._fetched_at else None,
+                "refreshes": self.refreshes, "error": self.error}
+
+
+def _model_entry(m, resident: Dict[str, Dict]) -> Dict:
+    name = m.get("model") or m.get("name")
+    details = m.get("details") or {}
+    loaded = resident.get(name)
+    return {
+        "name":               name,
+        "size":               m.get("size"),
+        "modified_at":        str(m.get("modified_at") or ""),
+        "digest":             (m.get("digest") or "")[:12],
+        "family":             details.get("family"),
+        "parameter_size":     details.get("parameter_size"),
+        "quantization_level": details.get("quantization_level"),
+        "resident":           loaded is not None,
+        "size_vram":          (loaded or {}).get("size_vram"),
+        "expires_at":         (loaded or {}).get("expires_at"),
+    }
+
+MODEL_CATALOG = ModelCatalog()
+
+# ─── 2) discover local models ────────────────────────────────────
+async def list_local_models() -> List[str]:
+    """
+    Returns e.g.  ["llama3:latest", "qwen2.5:7b", …]  (empty while Ollama is unreachable)
+    """
+    models, _etag = await MODEL_CATALOG.get()
+    return [m["name"] for m in models]
+
+# ─── 3) small wrappers used by the rest of the app ───────────────
 def chat(model: str, messages: List[Dict]) -> str | None:
     try:
         return _client.chat(model=model, messages=messages)["message"]["content"]
@@ -114,3 +240,471 @@ def simple_prompt(model: str, prompt: str, system: str | None = None):
 # Back-compat helpers
 send_prompt                = simple_prompt
 send_prompt_with_functions = simple_prompt
+
+# ─── 4) async API (used by agent / api – never blocks the loop) ──
+def _get_async_client() -> ollama.AsyncClient:
+    """
+    One AsyncClient per process. httpx keeps HTTP/1.1 connections to
+    OLLAMA_ENDPOINT alive between calls, so concurrent sessions share a
+    warm pool instead of each opening a fresh socket. The pool (an httpx
+    transport) is created here and handed to ollama, so `aclose` can close
+    it without reaching into the library's client.
+    """
+    global _async_client, _async_transport
+    if _async_client is None:
+        _async_transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+        )
+        _async_client = ollama.AsyncClient(
+            host=OLLAMA,
+            timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=10.0),
+            transport=_async_transport,
+        )
+    return _async_client
+
+async def aclose():
+    """Closes the pooled connections (called on app shutdown)."""
+    global _async_client, _async_transport
+    if _async_transport is not None:
+        transport, _async_client, _async_transport = _async_transport, None, None
+        try:
+            await transport.aclose()
+        except Exception as e:
+            print(f"[ollama] closing async client failed: {e}")
+
+async def achat(
+    model: str,
+    messages: List[Dict],
+    *,
+    timeout: float | None = None,
+    cache: bool = True,
+    similar: str | None = None,
+) -> str | None:
+    """
+    Async twin of `chat`. Returns None on failure or timeout.
+    Cancelling the awaiting task (e.g. the WebSocket went away) aborts
+    the in-flight HTTP request and returns its connection to the pool.
+    `cache=False` bypasses the response cache; `similar` enables the
+    semantic tier (see `cache_lookup`). Waits for an LLM_GATE slot first;
+    `timeout` starts once the request is admitted.
+    """
+    cached = await cache_lookup(model, messages, similar) if cache else _count_bypass()
+    if cached is not None:
+        return cached
+    await ensure_model(model)
+    await LLM_GATE.acquire()
+    try:
+        with span("llm", model):
+            resp = await asyncio.wait_for(
+                _get_async_client().chat(model=model, messages=messages, keep_alive=OLLAMA_KEEP_ALIVE),
+                timeout=timeout or OLLAMA_TIMEOUT,
+            )
+        _record_usage(model, resp)
+        LLM_REQUESTS.inc(model=model, outcome="ok")
+        content = resp["message"]["content"]
+        if cache:
+            await cache_store(model, messages, content, similar)
+        return content
+    except asyncio.TimeoutError:
+        LLM_REQUESTS.inc(model=model, outcome="timeout")
+        print(f"[ollama] chat with {model} timed out after {timeout or OLLAMA_TIMEOUT:.0f}s")
+        return None
+    except Exception:
+        LLM_REQUESTS.inc(model=model, outcome="error")
+        traceback.print_exc()
+        return None
+    finally:
+        LLM_GATE.release()
+
+async def asimple_prompt(
+    model: str,
+    prompt: str,
+    system: str | None = None,
+    *,
+    timeout: float | None = None,
+    cache: bool = True,
+    similar: str | None = None,
+) -> str | None:
+    msgs = ([{"role": "system", "content": system}] if system else []) + [
+        {"role": "user", "content": prompt}
+    ]
+    return await achat(model, msgs, timeout=timeout, cache=cache, similar=similar)
+
+async def astream_chat(
+    model: str,
+    messages: List[Dict],
+    *,
+    timeout: float | None = None,
+    cache: bool = True,
+    similar: str | None = None,
+) -> AsyncIterator[str]:
+    """
+    Yields content tokens as Ollama generates them.
+    `timeout` bounds the whole generation; a failure mid-stream raises
+    RuntimeError so callers never mistake a truncated answer for a
+    complete one. Closing the generator early closes the HTTP response.
+    A cached answer is yielded in one piece; only a stream that ran to
+    its end is stored. The LLM_GATE slot is held until the stream ends.
+    """
+    cached = await cache_lookup(model, messages, similar) if cache else _count_bypass()
+    if cached is not None:
+        yield cached
+        return
+    await ensure_model(model)
+    await LLM_GATE.acquire()
+
+    loop     = asyncio.get_running_loop()
+    deadline = loop.time() + (timeout or OLLAMA_TIMEOUT)
+    stream   = None
+    started  = loop.time()
+    try:
+        with span("llm_stream", model):
+            stream = await asyncio.wait_for(
+                _get_async_client().chat(model=model, messages=messages, stream=True,
+                                         keep_alive=OLLAMA_KEEP_ALIVE),
+                timeout=deadline - loop.time(),
+            )
+            parts: List[str] = []
+            while True:
+                try:
+                    part = await asyncio.wait_for(
+                        stream.__anext__(), timeout=max(deadline - loop.time(), 0.001)
+                    )
+                except StopAsyncIteration:
+                    break
+                if part.get("done"):
+                    _record_usage(model, part)
+                token = part["message"]["content"]
+                if token:
+                    if not parts:
+                        LLM_FIRST_TOKEN.observe(loop.time() - started, model=model)
+                    parts.append(token)
+                    yield token
+        LLM_REQUESTS.inc(model=model, outcome="ok")
+        if cache:
+            await cache_store(model, messages, "".join(parts), similar)
+    except asyncio.TimeoutError as e:
+        LLM_REQUESTS.inc(model=model, outcome="timeout")
+        print(f"[ollama] stream from {model} timed out after {timeout or OLLAMA_TIMEOUT:.0f}s")
+        raise RuntimeError(f"LLM stream from {model} timed out") from e
+    except (asyncio.CancelledError, GeneratorExit):
+        raise
+    except Exception as e:
+        LLM_REQUESTS.inc(model=model, outcome="error")
+        traceback.print_exc()
+        raise RuntimeError(f"LLM stream from {model} failed: {e}") from e
+    finally:
+        LLM_GATE.release()
+        if stream is not None:
+            try:
+                await stream.aclose()
+            except Exception:
+                pass
+
+def astream_prompt(
+    model: str,
+    prompt: str,
+    system: str | None = None,
+    *,
+    timeout: float | None = None,
+    cache: bool = True,
+    similar: str | None = None,
+) -> AsyncIterator[str]:
+    msgs = ([{"role": "system", "content": system}] if system else []) + [
+        {"role": "user", "content": prompt}
+    ]
+    return astream_chat(model, msgs, timeout=timeout, cache=cache, similar=similar)
+
+# ─── 5) response cache ───────────────────────────────────────────
+_llm_cache = SQLiteLRUCache(
+    os.path.join(LLM_CACHE_DIR, "llm_responses.sqlite"),
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024),
+    default_ttl=LLM_CACHE_TTL,
+)
+_llm_vectors = SQLiteVectorIndex(
+    os.path.join(LLM_CACHE_DIR, "llm_embeddings.sqlite"),
+    max_rows=LLM_CACHE_MAX_ENTRIES,
+)
+_cache_counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0, "stored": 0}
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _split_messages(messages: List[Dict]) -> tuple[str, List[Dict]]:
+    system = "\n".join(m["content"] for m in messages if m.get("role") == "system")
+    rest   = [m for m in messages if m.get("role") != "system"]
+    return system, rest
+
+def llm_cache_key(model: str, messages: List[Dict]) -> str:
+    """(model, system prompt hash, prompt) → cache key."""
+    system, rest = _split_messages(messages)
+    return _sha(json.dumps([model, _sha(system), rest], ensure_ascii=False))
+
+def _semantic_scope(model: str, messages: List[Dict], similar: str) -> str:
+    """
+    Everything but the `similar` text (the user query) must match exactly:
+    same model, system prompt and prompt template around the query.
+    """
+    system, rest = _split_messages(messages)
+    template = json.dumps(rest, ensure_ascii=False).replace(json.dumps(similar)[1:-1], "\0")
+    return _sha(json.dumps([model, _sha(system), template], ensure_ascii=False))
+
+async def _embed(text: str) -> List[float] | None:
+    try:
+        resp = await asyncio.wait_for(
+            _get_async_client().embeddings(model=LLM_CACHE_EMBED_MODEL, prompt=text),
+            timeout=30,
+        )
+        return list(resp["embedding"]) or None
+    except Exception as e:
+        print(f"[llm-cache] embedding with {LLM_CACHE_EMBED_MODEL} failed: {e}")
+        return None
+
+def _count_bypass() -> None:
+    _cache_counters["bypassed"] += 1
+    return None
+
+async def cache_lookup(model: str, messages: List[Dict], similar: str | None = None) -> str | None:
+    """
+    Exact hit on (model, system hash, prompt); else, with LLM_CACHE_SEMANTIC
+    and a `similar` text, the answer of the most similar earlier query
+    (cosine ≥ LLM_CACHE_SIMILARITY) sent with the same prompt template.
+    """
+    if not LLM_CACHE_ENABLED:
+        return None
+    try:
+        hit = _llm_cache.get(llm_cache_key(model, messages))
+        if hit is not None:
+            _cache_counters["exact_hits"] += 1
+            return hit
+        if LLM_CACHE_SEMANTIC and similar:
+            vector = await _embed(similar)
+            best = _llm_vectors.nearest(_semantic_scope(model, messages, similar), vector) if vector else None
+            if best and best[1] >= LLM_CACHE_SIMILARITY:
+                hit = _llm_cache.get(best[0])
+                if hit is not None:
+                    print(f"[llm-cache] semantic hit (similarity {best[1]:.3f})")
+                    _cache_counters["semantic_hits"] += 1
+                    return hit
+    except Exception as e:
+        print(f"[llm-cache] lookup failed: {e}")
+    _cache_counters["misses"] += 1
+    return None
+
+async def cache_store(model: str, messages: List[Dict], content: str, similar: str | None = None):
+    if not LLM_CACHE_ENABLED or not content or not content.strip():
+        return
+    try:
+        key = llm_cache_key(model, messages)
+        _llm_cache.put(key, content)
+        _cache_counters["stored"] += 1
+        if LLM_CACHE_SEMANTIC and similar:
+            vector = await _embed(similar)
+            if vector:
+                _llm_vectors.add(_semantic_scope(model, messages, similar), key, vector)
+    except Exception as e:
+        print(f"[llm-cache] store failed: {e}")
+
+def llm_cache_stats() -> Dict:
+    stats = {"enabled": LLM_CACHE_ENABLED, "semantic": LLM_CACHE_SEMANTIC, **_cache_counters}
+    if LLM_CACHE_ENABLED:
+        stats.update({k: v for k, v in _llm_cache.stats().items()
+                      if k in ("entries", "bytes", "evictions", "max_entries", "max_bytes")})
+    return stats
+
+def llm_cache_clear():
+    _llm_cache.clear()
+    _llm_vectors.clear()
+
+# ─── 6) model readiness: lazy pulls + start-up warm-up ───────────
+ProgressListener = Callable[[Dict], Awaitable[None]]
+
+_model_state: Dict[str, Dict] = {}                # model → {"state", "status", "completed", "total", "error"}
+_pulls: Dict[str, asyncio.Task] = {}              # in-flight pull per model (single flight)
+_progress_listeners: set[ProgressListener] = set()
+
+def add_progress_listener(listener: ProgressListener):
+    """`listener(event)` is awaited for every pull progress update."""
+    _progress_listeners.add(listener)
+
+def remove_progress_listener(listener: ProgressListener):
+    _progress_listeners.discard(listener)
+
+async def _publish(model: str, **fields):
+    state = _model_state.setdefault(model, {})
+    state.update(fields)
+    event = {"model": model, **state}
+    for listener in list(_progress_listeners):
+        try:
+            await listener(event)
+        except Exception:
+            _progress_listeners.discard(listener)   # client gone
+
+def model_status() -> Dict[str, Dict]:
+    return {m: dict(s) for m, s in _model_state.items()}
+
+def model_ready(model: str) -> bool:
+    return _model_state.get(model, {}).get("state") == "ready"
+
+async def _pull(model: str) -> bool:
+    client = _get_async_client()
+    try:
+        await client.show(model)                   # already present locally
+        await _publish(model, state="ready", status="present", error=None)
+        return True
+    except ollama.ResponseError as e:
+        if e.status_code != 404:
+            await _publish(model, state="error", error=str(e))
+            return False
+    except Exception as e:
+        print(f"[ollama] cannot reach Ollama to check {model}: {e}")
+        await _publish(model, state="error", error=str(e))
+        return False
+
+    print(f"[ollama] pulling {model} …")
+    await _publish(model, state="pulling", status="starting", completed=0, total=0, error=None)
+    async def consume():
+        last_sent = 0.0
+        loop = asyncio.get_running_loop()
+        async for part in await client.pull(model, stream=True):
+            status = part.get("status") or ""
+            completed, total = part.get("completed") or 0, part.get("total") or 0
+            # progress ticks are frequent – forward at most ~2 per second
+            if loop.time() - last_sent >= 0.5 or not total:
+                last_sent = loop.time()
+                await _publish(model, status=status, completed=completed, total=total)
+
+    try:
+        await asyncio.wait_for(consume(), timeout=OLLAMA_PULL_TIMEOUT)
+    except Exception as e:
+        print(f"[ollama] pull failed for {model}: {e}")
+        await _publish(model, state="error", error=str(e) or type(e).__name__)
+        return False
+    print(f"[ollama] {model} ready")
+    MODEL_CATALOG.invalidate()
+    await _publish(model, state="ready", status="success", error=None)
+    return True
+
+async def ensure_model(model: str) -> bool:
+    """
+    Makes sure `model` is available locally, pulling it if needed.
+    Concurrent callers share one pull. Returns False if it could not be
+    checked or pulled (the caller's request will then report the error).
+    """
+    if model_ready(model):
+        return True
+    task = _pulls.get(model)
+    if task is None or task.done():
+        task = asyncio.ensure_future(_pull(model))
+        _pulls[model] = task
+        task.add_done_callback(lambda t, m=model: _pulls.pop(m, None) if _pulls.get(m) is t else None)
+    # shield: a cancelled request must not abort a pull others are waiting on
+    return await asyncio.shield(task)
+
+async def warm_up(models: List[str] | None = None):
+    """Background start-up task: pulls WARMUP_MODELS one after another."""
+    for model in models or WARMUP_MODELS:
+        await ensure_model(model)
+
+# ─── 7) model residency ──────────────────────────────────────────
+class ModelResidency:
+    """
+    Keeps the models a workflow is about to use loaded in Ollama.
+
+    The agent calls `prepare(models)` with the model(s) its next plan steps
+    need; each one that /api/ps does not list as resident is preloaded in
+    the background (an empty generate with keep_alive), so the load
+    overlaps with the current step instead of stalling the next one.
+    Load times come from Ollama's own `load_duration` – of preloads and of
+    ordinary requests that had to load the model.
+    """
+
+    LOAD_THRESHOLD = 0.05     # seconds; below this the model was already in memory
+
+    def __init__(self):
+        self.resident: Dict[str, Dict] = {}     # model → {"size_vram", "expires_at"}
+        self.loads: Dict[str, Dict] = {}        # model → {"count", "total", "last", "max"}
+        self.preloads = 0
+        self._checked_at = 0.0
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def observe(self, model: str, load_duration_ns) -> None:
+        """Records a load reported by Ollama (nanoseconds)."""
+        seconds = (load_duration_ns or 0) / 1e9
+        if seconds < self.LOAD_THRESHOLD:
+            return
+        MODEL_LOAD.observe(seconds, model=model)
+        entry = self.loads.setdefault(model, {"count": 0, "total": 0.0, "last": 0.0, "max": 0.0})
+        entry["count"] += 1
+        entry["total"] += seconds
+        entry["last"] = seconds
+        entry["max"] = max(entry["max"], seconds)
+        self.resident.setdefault(model, {})
+
+    async def refresh(self, force: bool = False) -> Dict[str, Dict]:
+        """Resident models according to /api/ps (cached RESIDENCY_POLL_SECONDS)."""
+        loop = asyncio.get_running_loop()
+        if not force and loop.time() - self._checked_at < RESIDENCY_POLL_SECONDS:
+            return self.resident
+        try:
+            resp = await asyncio.wait_for(_get_async_client().ps(), timeout=5)
+            self.resident = {
+                (m.get("model") or m.get("name")): {
+                    "size_vram": m.get("size_vram"),
+                    "expires_at": str(m.get("expires_at") or ""),
+                }
+                for m in resp.get("models", []) or []
+            }
+            self._checked_at = loop.time()
+        except Exception as e:
+            print(f"[ollama] /api/ps failed: {e}")
+        return self.resident
+
+    async def preload(self, model: str) -> None:
+        if model in await self.refresh():
+            return
+        print(f"[ollama] preloading {model}")
+        if not await ensure_model(model):
+            return
+        try:
+            resp = await _get_async_client().generate(model=model, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+            self.preloads += 1
+            self.observe(model, resp.get("load_duration"))
+            self.resident.setdefault(model, {})
+        except Exception as e:
+            print(f"[ollama] preload of {model} failed: {e}")
+
+    def prepare(self, models: List[str | None]) -> None:
+        """Fire-and-forget preload of `models` (None entries are ignored)."""
+        if not MODEL_PRELOAD:
+            return
+        for model in dict.fromkeys(m for m in models if m):
+            task = self._inflight.get(model)
+            if task is None or task.done():
+                task = asyncio.ensure_future(self.preload(model))
+                self._inflight[model] = task
+                task.add_done_callback(lambda t, m=model: self._inflight.pop(m, None) if self._inflight.get(m) is t else None)
+
+    async def stats(self) -> Dict:
+        resident = await self.refresh()
+        return {
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "preload_enabled": MODEL_PRELOAD,
+            "resident": resident,
+            "preloads": self.preloads,
+            "load_seconds": {
+                m: {**e, "mean": e["total"] / e["count"]} for m, e in self.loads.items()
+            },
+        }
+
+RESIDENCY = ModelResidency()
+
+callback("llm_cache_events_total", "LLM response cache lookups and stores.", ("event",),
+         lambda: {(k,): v for k, v in _cache_counters.items()}, kind="counter")
+callback("ollama_model_resident", "Models loaded in Ollama at the last /api/ps check.", ("model",),
+         lambda: {(m,): 1 for m in RESIDENCY.resident})
@@ -8,69 +8,207 @@ main.py ─ FastAPI application entry-point
 
 from __future__ import annotations
 import asyncio, json, os, sys, traceback
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 
 from .api   import router as api_router
-from .agent import handle_agent_workflow
+from .batch import aclose_batches
+from .events import EventChannel
+from .jobs import JOBS, admitted_workflow
+from .journal import load_journal, run_compactor
+from .session import SessionContext
+from .tools.browser_pool import BROWSER_POOL
+from .tools.sandbox_pool import prewarm as prewarm_sandbox
 from .llm_handler import (
-    PLANNING_TOOLING_MODEL,
-    DEEPCODER_MODEL,
+    aclose as close_llm_client,
+    add_progress_listener,
+    model_status,
+    MODEL_CATALOG,
+    remove_progress_listener,
+    warm_up as warm_up_models,
 )
 
 print(f"Python: {sys.executable}")
 print(f"Asyncio policy: {type(asyncio.get_event_loop_policy()).__name__}")
 
-app = FastAPI(title="Local AI Agent Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # nothing here may block: the server accepts connections right away and
+    # models / the code sandbox zygote get ready in the background
+    model_warmup   = asyncio.create_task(warm_up_models())
+    sandbox_warmup = asyncio.create_task(prewarm_sandbox())
+    compactor      = asyncio.create_task(run_compactor())   # prunes old workflow journals
+    catalog        = asyncio.create_task(MODEL_CATALOG.refresh())   # first /api/models is a cache hit
+    yield
+    model_warmup.cancel()
+    sandbox_warmup.cancel()
+    compactor.cancel()
+    catalog.cancel()
+    await JOBS.aclose()       # detached workflows: cancelled, resumable from their journals
+    await aclose_batches()
+    await BROWSER_POOL.aclose()
+    await close_llm_client()
+
+app = FastAPI(title="Local AI Agent Backend", lifespan=lifespan)
 app.include_router(api_router, prefix="/api")
 
 # ─────────────────────────── WebSocket chat ────────────────────────────
+async def _receive_loop(ws: WebSocket, inbox: asyncio.Queue):
+    """
+    Reads client frames into `inbox` for the lifetime of the socket.
+    Runs beside the workflow so a closed tab is noticed mid-run;
+    `None` is queued once the client is gone.
+    """
+    try:
+        while True:
+            await inbox.put(await ws.receive_text())
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"[ws] receive failed: {e}")
+    await inbox.put(None)
+
+def _progress_text(event: dict) -> str | None:
+    """One chat line for a model pull progress event."""
+    model, state = event["model"], event.get("state")
+    if state == "pulling":
+        total = event.get("total") or 0
+        pct = f" {100 * (event.get('completed') or 0) / total:.0f}%" if total else ""
+        return f"Agent: Pulling model {model}: {event.get('status', '')}{pct}"
+    if state == "ready" and event.get("status") == "success":
+        return f"Agent: Model {model} is ready."
+    if state == "error":
+        return f"Agent Error: Model {model} unavailable: {event.get('error')}"
+    return None
+
+async def _cancel_workflow(workflow: asyncio.Task, ctx: SessionContext, reason: str):
+    """
+    Cancels a running workflow and waits until it has unwound: Ollama
+    requests aborted, tool process groups killed, queue slots released.
+    """
+    ctx.cancel(reason)
+    workflow.cancel(reason)
+    try:
+        await workflow
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        traceback.print_exc()
+
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket):
+    """
+    Client → server frames:
+      {"query": "...", "planner_model": ..., "browser_model": ...,
+       "bypass_cache": false}      start a workflow (cancels the running one, if any)
+      {"type": "cancel"}           cancel the running workflow
+      {"type": "resume", "workflow_id": "..."}
+                                   continue a journaled workflow that did not complete
+    Closing the socket cancels the running workflow too (it stays resumable).
+
+    Server → client frames are typed JSON events (see events.py), sent
+    through one coalescing EventChannel per socket.
+    """
     await ws.accept()
-
-    # runtime defaults – will be overwritten by first client message
-    planner_model = PLANNING_TOOLING_MODEL
-    browser_model = os.getenv("BROWSER_AGENT_INTERNAL_MODEL", "qwen2.5:7b")
-    code_model    = os.getenv("DEEPCODER_MODEL",              "deepcoder:latest")
-
+    channel = EventChannel(ws)   # everything this socket is sent goes through here
+    # fairness key: tabs of one client share a turn in every queue
+    client = ws.client.host if ws.client else "anonymous"
+    ctx: SessionContext | None = None   # this socket's choices, updated per message
+
+    inbox: asyncio.Queue = asyncio.Queue()
+    reader = asyncio.create_task(_receive_loop(ws, inbox))
+
+    async def on_pull_progress(event: dict):
+        text = _progress_text(event)
+        if text:
+            await channel.send_text(text)
+    add_progress_listener(on_pull_progress)
+    for event in model_status().values():
+        if event.get("state") == "pulling":
+            await channel.send_text("Agent: Models are still being pulled; the first request may wait for them.")
+            break
+
+    workflow: asyncio.Task | None = None       # the request being worked on
+    workflow_ctx: SessionContext | None = None
+    incoming = asyncio.create_task(inbox.get())
     try:
         while True:
-            raw = await ws.receive_text()
+            waiters = {incoming} if workflow is None else {incoming, workflow}
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            if workflow is not None and workflow.done():
+                finished, workflow = workflow, None
+                finished.result()   # re-raise unexpected errors
+            if not incoming.done():
+                continue
+
+            raw = incoming.result()
+            if raw is None:
+                # client closed tab / refreshed – abort in-flight LLM calls and tools
+                if workflow is not None:
+                    await _cancel_workflow(workflow, workflow_ctx, "client disconnected")
+                    workflow = None
+                break
+            incoming = asyncio.create_task(inbox.get())
             try:
                 data = json.loads(raw)
             except json.JSONDecodeError:
-                await ws.send_text("Agent Error: invalid JSON payload.")
+                await channel.send_text("Agent Error: invalid JSON payload.")
+                continue
+
+            if data.get("type") == "cancel":
+                if workflow is None:
+                    await channel.send_text("Agent: Nothing to cancel.")
+                else:
+                    await _cancel_workflow(workflow, workflow_ctx, "cancelled by user")
+                    workflow = None
                 continue
 
-            # new key names coming from frontend
-            user_query    = data.get("query", "")
-            planner_model = data.get("planner_model", planner_model)
-            browser_model = data.get("browser_model", browser_model)
-            code_model    = data.get("code_model",    code_model)
+            resume = None
+            if data.get("type") == "resume":
+                workflow_id = str(data.get("workflow_id", ""))
+                if workflow is not None:
+                    # the running one may be the workflow asked for: let its journal close first
+                    await _cancel_workflow(workflow, workflow_ctx, "superseded by a resumed workflow")
+                    workflow = None
+                resume = await asyncio.to_thread(load_journal, workflow_id)
+                if resume is None:
+                    await channel.send_text(f"Agent Error: No journal found for workflow '{workflow_id}'.")
+                    continue
+                if not resume.resumable:
+                    state = "is running elsewhere" if resume.outcome != "ok" else "already completed"
+                    await channel.send_text(f"Agent: Workflow {workflow_id} {state}; nothing to resume.")
+                    continue
+                data = dict(resume.settings, query=resume.query)
+
+            user_query = data.get("query", "")
+            # model choices / cache flag travel with the request, never via os.environ
+            ctx = SessionContext.from_request(data, client=client, previous=ctx)
 
             if not user_query:
-                await ws.send_text("Agent Error: empty query.")
+                await channel.send_text("Agent Error: empty query.")
                 continue
 
-            # expose chosen tool-specific models to sub-processes
-            os.environ["BROWSER_AGENT_INTERNAL_MODEL"] = browser_model
-            os.environ["DEEPCODER_MODEL"]              = code_model
-
-            await handle_agent_workflow(user_query, planner_model, ws)
+            if workflow is not None:
+                # a new query supersedes the running one
+                await _cancel_workflow(workflow, workflow_ctx, "superseded by a new request")
+            workflow, workflow_ctx = asyncio.create_task(admitted_workflow(channel, ctx, user_query, resume)), ctx
 
     except WebSocketDisconnect:
         # client closed tab / refreshed – nothing to do
         pass
     except Exception as e:
         traceback.print_exc()
-        try:
-            await ws.send_text(f"Agent Error: {e}")
-        except Exception:
-            pass
+        await channel.send_text(f"Agent Error: {e}")
     finally:
+        remove_progress_listener(on_pull_progress)
+        incoming.cancel()
+        if workflow is not None and not workflow.done():
+            await _cancel_workflow(workflow, workflow_ctx, "connection closed")
+        reader.cancel()
+        await channel.aclose()
         try:
             await ws.close()
         except Exception:
@@ -0,0 +1,224 @@
+"""
+metrics.py
+──────────
+Timing spans, counters, gauges and histograms, exported at /api/metrics in
+the Prometheus text format (0.0.4). Self-contained – no client library.
+
+    from .metrics import span, counter, histogram
+    with span("tool", "browser"):            # latency histogram + in-flight gauge
+        ...
+    TOKENS = counter("llm_tokens_total", "Tokens processed.", ("model", "kind"))
+    TOKENS.inc(42, model="llama3", kind="completion")
+    callback("x_total", "…", ("tool",), lambda: {("shell",): 3}, kind="counter")
+
+Every span is recorded in `agent_stage_seconds{stage, detail}` and counted in
+`agent_stage_inflight` while it runs; spans that end in an exception also
+bump `agent_stage_errors_total`. METRICS_LOG_SPANS=1 prints each span.
+
+With METRICS=0 every factory returns a shared no-op object and `span()` a
+no-op context manager, so instrumented code costs one function call.
+"""
+
+from __future__ import annotations
+import math
+import os
+import time
+from typing import Callable, Dict, Iterable, Tuple
+
+METRICS_ENABLED   = os.getenv("METRICS", "1") == "1"
+METRICS_LOG_SPANS = os.getenv("METRICS_LOG_SPANS", "0") == "1"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+# ───────────────────────────────────────────────── metric types
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Callback(_Metric):
+    """
+    Samples read from `fn() -> {label tuple: value}` at scrape time, for
+    numbers another module already keeps (cache counters, load times).
+    """
+
+    def __init__(self, name, help, labelnames, fn: Callable[[], Dict[LabelKey, float]], kind: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        try:
+            samples = self.fn()
+        except Exception as e:
+            print(f"[metrics] collecting {self.name} failed: {e}")
+            samples = {}
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in sorted(samples.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[LabelKey, list] = {}     # key → [bucket counts…, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = f'le="{_num(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class _Noop:
+    """Stands in for every metric (and span) when METRICS=0."""
+    def inc(self, *a, **kw): pass
+    def dec(self, *a, **kw): pass
+    def set(self, *a, **kw): pass
+    def observe(self, *a, **kw): pass
+    def render(self): return []
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NOOP = _Noop()
+
+
+# ───────────────────────────────────────────────── registry
+_registry: Dict[str, _Metric] = {}
+
+def _register(metric: _Metric):
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _registry.setdefault(metric.name, metric)
+
+def counter(name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    return _register(Counter(name, help, labelnames))
+
+def gauge(name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+    return _register(Gauge(name, help, labelnames))
+
+def histogram(name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labelnames, buckets))
+
+def callback(name: str, help: str, labelnames: Tuple[str, ...],
+             fn: Callable[[], Dict[LabelKey, float]], kind: str = "gauge") -> Callback:
+    return _register(Callback(name, help, labelnames, fn, kind))
+
+def render() -> str:
+    """All registered metrics in Prometheus text exposition format."""
+    lines: list[str] = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ───────────────────────────────────────────────── spans
+STAGE_SECONDS  = histogram("agent_stage_seconds", "Duration of workflow stages.", ("stage", "detail"))
+STAGE_INFLIGHT = gauge("agent_stage_inflight", "Stages currently running.", ("stage",))
+STAGE_ERRORS   = counter("agent_stage_errors_total", "Stages that ended with an exception.", ("stage", "detail"))
+
+
+class _Span:
+    __slots__ = ("stage", "detail", "start")
+
+    def __init__(self, stage: str, detail: str):
+        self.stage = stage
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        STAGE_INFLIGHT.inc(stage=self.stage)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        STAGE_INFLIGHT.dec(stage=self.stage)
+        STAGE_SECONDS.observe(seconds, stage=self.stage, detail=self.detail)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage, detail=self.detail)
+        if METRICS_LOG_SPANS:
+            status = f" error={exc_type.__name__}" if exc_type else ""
+            print(f"[span] stage={self.stage} detail={self.detail} seconds={seconds:.3f}{status}")
+        return False
+
+def span(stage: str, detail: str = ""):
+    """Times a block: `with span("review", tool):` – works around awaits too."""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Span(stage, detail or "")
@@ -0,0 +1,292 @@
+"""
+plan_parser.py
+──────────────
+Incremental parser for the planner's JSON output.
+
+The planner answers with a JSON array of task objects, streamed token by
+token. `PlanStreamParser.feed()` scans only the new characters and hands
+back every top-level task object whose closing brace has arrived, so the
+agent can start on step 1 while step 2 is still being generated.
+
+Each object is decoded exactly once. Only a fragment that fails
+`json.loads` is passed through `repair_json` – a single bad task never
+forces the whole plan to be re-parsed. A task that lacks its closing
+brace is cut off where the next task (or the array's `]`) begins and
+repaired on its own, so it is not swallowed by its neighbour.
+
+Used by the planner stream, `parse_plan` and the correction parsing in
+`review_and_resolve`.
+"""
+from __future__ import annotations
+
+import json
+import re
+from typing import Dict, List
+
+# Attempt to import json_repair, fall back to strict parsing if not available
+try:
+    from json_repair import repair_json
+    JSON_REPAIR_AVAILABLE = True
+except ImportError:
+    JSON_REPAIR_AVAILABLE = False
+    def repair_json(s): # Define a dummy function if library is missing
+        return s
+
+
+# openers outside an object; inside one, everything up to the next bracket
+# that is not in a string – group 1 the bracket; group 2 set ("\\" when it
+# ends on an escape) if the text ends inside a string instead
+_OUTSIDE    = re.compile(r'[{\[]')
+_INSIDE     = re.compile(r'(?:[^"{}\[\]]++|"(?:[^"\\]|\\.)*+")*+'
+                         r'(?:([{}\[\]])|"(?:[^"\\]|\\.)*+(\\?)\Z|\Z)', re.DOTALL)
+_IN_STRING  = re.compile(r'["\\]')
+_OPENER     = {"}": "{", "]": "["}
+_DECODER    = json.JSONDecoder()
+# an incomplete object longer than this is walked instead of re-decoded on every `}`
+_REDECODE_CHARS = 4096
+_FENCE      = re.compile(r'^```(?:json)?\s*|\s*```$', re.MULTILINE)
+
+
+def validate_task(task, idx: int, default_description: str | None = None) -> Dict:
+    """Checks one plan item; fills in a default description. Raises ValueError."""
+    if not isinstance(task, dict):
+        raise ValueError(f"Item at index {idx} in plan is not a dictionary: {task}")
+    if 'tool' not in task:
+        raise ValueError(f"Task at index {idx} is missing 'tool' key: {task}")
+    # Ensure description exists, provide a default if missing
+    if 'description' not in task or not task.get('description'):
+        print(f"Warning: Task at index {idx} missing description. Generating default.")
+        task['description'] = default_description or f"Execute {task.get('tool', 'unknown tool')} step {idx+1}"
+    return task
+
+
+def _unwrap(obj) -> List:
+    """
+    Turns one decoded value into candidate task dicts.
+    Accepts a bare task, a list of tasks, or a wrapper such as
+    {"plan": [...]} / {"steps": [...]} that some models emit.
+    """
+    if isinstance(obj, list):
+        return obj
+    if isinstance(obj, dict) and 'tool' not in obj:
+        lists = [v for v in obj.values() if isinstance(v, list) and v and all(isinstance(t, dict) for t in v)]
+        if len(lists) == 1:
+            return lists[0]
+    return [obj]
+
+
+class PlanStreamParser:
+    """
+    Feed raw LLM text chunk by chunk; collect completed, validated tasks.
+
+    Tracks just enough state (open brackets, in-string, escape) to find
+    top-level object boundaries, jumping between structural characters
+    with a regex rather than visiting every character. Chunks are only
+    collected until one brings a `}` – no object can complete before
+    that (close() picks up the rest). An object is first handed to the C decoder as it stands:
+    complete and valid, it is done in one call; merely incomplete (and
+    short), it waits for the next `}`; a malformed or long one is walked
+    bracket by bracket, once, to find where it ends. Text outside objects (markdown fences,
+    the array brackets, commas, chatter) is skipped without decoding and
+    never kept.
+    Call `close()` once the stream ends to salvage a truncated tail.
+    """
+
+    def __init__(self, default_description: str | None = None):
+        self.default_description = default_description
+        self.emitted    = 0       # tasks handed out so far
+        self.repaired   = 0       # fragments that needed repair_json
+        self.failed: List[str] = []   # fragments that could not be salvaged
+        self.saw_json   = False   # an array/object opener was seen at all
+        self._unscanned: List[str] = []   # chunks collected since the last scan
+        self._parts: List[str] = []   # text of the open object from earlier scans
+        self._stack: List[str] = []   # open `{` / `[` of the current object (empty: none open)
+        self._in_string = False
+        self._escape    = False
+
+    # ─── public API ────────────────────────────────────────────
+    def feed(self, chunk: str) -> List[Dict]:
+        """Consume `chunk`; return the tasks it completed (possibly none)."""
+        self._unscanned.append(chunk)
+        if "}" not in chunk:
+            return []
+        chunk, self._unscanned = "".join(self._unscanned), []
+        return self._scan(chunk)
+
+    def _scan(self, chunk: str) -> List[Dict]:
+        done: List[Dict] = []
+        if self._parts and not self._stack:   # an object still waiting to be complete: decode it again
+            chunk = self._take(chunk, 0, len(chunk))
+        start = 0 if self._stack else -1    # where the open object's text begins in `chunk`
+        i, n = 0, len(chunk)
+        while i < n:
+            if self._in_string:
+                if self._escape:            # char after a backslash
+                    self._escape = False
+                    i += 1
+                    continue
+                m = _IN_STRING.search(chunk, i)
+                if m is None:
+                    break
+                i = m.end()
+                if m.group() == "\\":
+                    self._escape = True
+                else:
+                    self._in_string = False
+                continue
+
+            if not self._stack:
+                m = _OUTSIDE.search(chunk, i)
+                if m is None:
+                    break
+                ch, i = m.group(), m.end()
+                self.saw_json = True
+                if ch == "{":
+                    try:
+                        obj, i = _DECODER.raw_decode(chunk, i - 1)
+                    except json.JSONDecodeError as e:
+                        incomplete = e.pos >= len(chunk.rstrip()) or e.msg.startswith("Unterminated string")
+                        if incomplete and n - i < _REDECODE_CHARS:
+                            self._parts.append(chunk[i - 1:])   # try again when more has arrived
+                            return done
+                        self._stack.append(ch)                  # malformed / long: find its end below
+                        start = i - 1
+                        continue
+                    done.extend(self._validate_all(obj))
+                continue
+
+            m = _INSIDE.match(chunk, i)
+            ch, i = m.group(1), m.end()
+            if ch is None:
+                if m.group(2) is not None:  # the string goes on in the next chunk
+                    self._in_string = True
+                    self._escape = m.group(2) == "\\"
+                break
+            if ch == "{" and len(self._stack) == 1 and self._last_char(chunk, i - 1, start) != ":":
+                # not a value: a new task while the current one lacks its `}` –
+                # close the current one here and repair it on its own
+                done.extend(self._decode(self._take(chunk, start, i - 1).rstrip().rstrip(",")))
+                start = i - 1
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif _OPENER[ch] in self._stack:
+                # normally the innermost opener; otherwise the inner closers are missing
+                # and this one closes them implicitly (repair_json restores them)
+                del self._stack[len(self._stack) - 1 - self._stack[::-1].index(_OPENER[ch]):]
+                if not self._stack:
+                    done.extend(self._decode(self._take(chunk, start, i)))
+                    start = -1
+            else:
+                # a closer of the enclosing array: the object ended without its `}`
+                done.extend(self._decode(self._take(chunk, start, i - 1)))
+                self._stack.clear()
+                start = -1
+
+        if self._stack:
+            self._parts.append(chunk[start:])
+        return done
+
+    def close(self) -> List[Dict]:
+        """End of stream: repair and return whatever unterminated object is left."""
+        done = self._scan("".join(self._unscanned)) if self._unscanned else []
+        self._unscanned = []
+        tail = self.pending
+        self._parts, self._stack = [], []
+        self._in_string = self._escape = False
+        return done + (self._decode(tail, strict=False) if tail.strip() else [])
+
+    @property
+    def pending(self) -> str:
+        """Unterminated object text left over (non-empty ⇒ truncated output)."""
+        return "".join(self._parts)
+
+    # ─── internals ─────────────────────────────────────────────
+    def _take(self, chunk: str, start: int, end: int) -> str:
+        """The current object's text up to `chunk[end]` (exclusive); forgets the pieces."""
+        fragment = "".join(self._parts) + chunk[start:end]
+        self._parts = []
+        return fragment
+
+    def _last_char(self, chunk: str, end: int, start: int) -> str:
+        """Last non-blank character of the current object before `chunk[end]`."""
+        j = end - 1
+        while j >= max(start, 0) and chunk[j].isspace():
+            j -= 1
+        if j >= max(start, 0):
+            return chunk[j]
+        for part in reversed(self._parts):
+            stripped = part.rstrip()
+            if stripped:
+                return stripped[-1]
+        return ""
+
+    def _decode(self, fragment: str, strict: bool = True) -> List[Dict]:
+        """
+        json.loads the fragment; on failure repair just this fragment.
+        Cleanly decoded objects are validated strictly (a task without a
+        'tool' is a planning error); repaired guesses are dropped instead.
+        """
+        try:
+            obj = json.loads(fragment) if strict else None
+        except json.JSONDecodeError:
+            obj = None
+        if obj is None:
+            try:
+                obj = json.loads(repair_json(fragment))
+                self.repaired += 1
+                strict = False
+            except Exception:
+                self.failed.append(fragment)
+                return []
+
+        return self._validate_all(obj, strict)
+
+    def _validate_all(self, obj, strict: bool = True) -> List[Dict]:
+        tasks: List[Dict] = []
+        for item in _unwrap(obj):
+            if not strict and not (isinstance(item, dict) and 'tool' in item):
+                self.failed.append(json.dumps(item)[:200])
+                continue
+            tasks.append(validate_task(item, self.emitted, self.default_description))
+            self.emitted += 1
+        return tasks
+
+
+def parse_plan_text(text: str, default_description: str | None = None) -> List[Dict]:
+    """
+    Parses a complete planner answer. Returns [] for an empty JSON array;
+    raises ValueError when no JSON (or nothing salvageable) is found.
+    """
+    if not text or not text.strip():
+        raise ValueError("Received empty plan.")
+    parser = PlanStreamParser(default_description)
+    try:
+        # fast path: the whole answer is already valid JSON – one decode
+        return parser._validate_all(json.loads(text))
+    except json.JSONDecodeError:
+        pass
+    tasks = parser.feed(text) + parser.close()
+    if parser.failed and JSON_REPAIR_AVAILABLE:
+        # a fragment could not be salvaged on its own: whole-text repair may recover more
+        whole = PlanStreamParser(default_description)
+        try:
+            recovered = whole._validate_all(json.loads(repair_json(_FENCE.sub("", text).strip())), strict=False)
+        except Exception:
+            recovered = []
+        if len(recovered) > len(tasks):
+            return recovered
+    if not tasks and (parser.failed or not parser.saw_json):
+        detail = parser.failed[0][:500] if parser.failed else text[:500]
+        raise ValueError(f"No valid JSON task found in plan output:\n{detail}")
+    return tasks
+
+
+def parse_correction(text: str, default_description: str | None = None) -> Dict:
+    """
+    Parses a correction answer (one JSON tool call). A missing description
+    is filled with `default_description`. Raises ValueError.
+    """
+    tasks = parse_plan_text(text, default_description)
+    if not tasks:
+        raise ValueError("Correction is not a valid task dictionary (missing 'tool' key).")
+    return tasks[0]
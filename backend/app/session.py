@@ -0,0 +1,77 @@
+"""
+session.py
+──────────
+Per-session execution context.
+
+One `SessionContext` is built per request from the client's choices and
+handed down explicitly – handle_agent_workflow → steps → tools – so
+concurrent sessions never share mutable state. Nothing here (or below it)
+writes os.environ; environment variables only provide the defaults.
+
+    ctx = SessionContext.from_request(data, client="10.0.0.7")
+    await handle_agent_workflow(query, ctx, websocket)
+    ctx.cancel("cancelled by client")  # flag it; the workflow task is cancelled by its owner
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+import uuid
+from dataclasses import dataclass, field, replace
+
+from .llm_handler import PLANNING_TOOLING_MODEL
+
+DEFAULT_BROWSER_MODEL = os.getenv("BROWSER_AGENT_INTERNAL_MODEL", "qwen2.5:7b")
+DEFAULT_MAX_STEPS     = int(os.getenv("MAX_WORKFLOW_STEPS", "10"))
+DEFAULT_MAX_RETRIES   = int(os.getenv("MAX_STEP_RETRIES", "2"))
+REPLAN_MODES          = ("off", "on_failure", "every_step")
+DEFAULT_REPLAN        = os.getenv("REPLAN_MODE", "on_failure")
+DEFAULT_MAX_REPLANS   = int(os.getenv("MAX_REPLANS", "2"))
+
+
+@dataclass
+class SessionContext:
+    # model choices
+    planner_model: str = PLANNING_TOOLING_MODEL
+    browser_model: str = DEFAULT_BROWSER_MODEL
+    use_cache: bool    = True                   # False: the client's "bypass cache" flag
+    # limits
+    max_steps: int     = DEFAULT_MAX_STEPS      # steps started per workflow
+    max_retries: int   = DEFAULT_MAX_RETRIES    # self-repair attempts per step
+    replan: str        = DEFAULT_REPLAN         # when to revise the remaining plan (REPLAN_MODES)
+    max_replans: int   = DEFAULT_MAX_REPLANS    # plan revisions per workflow
+    # identity
+    client: str        = "anonymous"            # fairness key for admission queues
+    session_id: str    = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    # cancellation
+    cancelled: asyncio.Event = field(default_factory=asyncio.Event, repr=False, compare=False)
+    cancel_reason: str | None = None
+
+    @classmethod
+    def from_request(cls, data: dict, *, client: str = "anonymous",
+                     previous: "SessionContext | None" = None) -> "SessionContext":
+        """
+        Context for one client message. Model fields the message leaves out
+        keep the values of `previous` (the socket's last request); the
+        cancellation event is always fresh.
+        """
+        base = previous or cls(client=client)
+        return replace(
+            base,
+            planner_model=data.get("planner_model") or base.planner_model,
+            browser_model=data.get("browser_model") or base.browser_model,
+            use_cache=not data.get("bypass_cache", False),
+            replan=data.get("replan") if data.get("replan") in REPLAN_MODES else base.replan,
+            client=client,
+            cancelled=asyncio.Event(),
+            cancel_reason=None,
+        )
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self.cancelled.is_set():
+            self.cancel_reason = reason
+        self.cancelled.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancelled.is_set()
@@ -0,0 +1,181 @@
+"""
+step_results.py
+───────────────
+Outputs of finished plan steps, kept so later steps can build on them
+instead of fetching the same data again.
+
+One `StepResultStore` lives for one workflow. Every finished step's
+output is stored compressed to at most STEP_RESULT_TOKENS; `context_for`
+assembles the outputs a step should see – its dependencies first, then
+the most recent other results – within STEP_CONTEXT_TOKENS. The browser
+tool receives this as its `context_hint`, and `review_and_resolve`
+includes it when asking for a correction.
+
+Compression is deterministic by default: blank-line runs and repeated
+lines are folded, then the middle of a long output is cut (head + tail,
+tail-biased for errors). With STEP_SUMMARIZE=1 an output above the
+budget is additionally summarised by the planning model in the
+background; the truncated form is used until the summary arrives.
+
+Tokens are estimated as characters / 4 – close enough for budgeting
+prompts and free to compute.
+
+    store = StepResultStore(ctx)
+    store.record(idx, task, result, status)
+    hint = store.context_for(idx, deps={0, 2})
+    await store.aclose()
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Iterable
+
+from .llm_handler import asimple_prompt
+from .metrics import histogram
+
+STEP_RESULT_TOKENS  = int(os.getenv("STEP_RESULT_TOKENS", "300"))
+STEP_CONTEXT_TOKENS = int(os.getenv("STEP_CONTEXT_TOKENS", "1200"))
+STEP_SUMMARIZE      = os.getenv("STEP_SUMMARIZE", "0") == "1"
+REVIEW_OUTPUT_TOKENS = int(os.getenv("REVIEW_OUTPUT_TOKENS", "600"))   # failing output shown to review
+SUMMARY_TIMEOUT     = 60.0
+CHARS_PER_TOKEN     = 4
+
+CONTEXT_TOKENS = histogram("step_context_tokens", "Estimated tokens of prior-step context handed to a step.",
+                           buckets=(0, 50, 100, 200, 400, 800, 1200, 2000, 4000))
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _fold_lines(text: str) -> str:
+    """Drops blank-line runs and collapses identical consecutive lines."""
+    out: list[str] = []
+    last, repeats = None, 0
+    for line in text.replace("\r\n", "\n").split("\n"):
+        line = line.rstrip()
+        if line == last:
+            if line:
+                repeats += 1
+            continue
+        if repeats:
+            out.append(f"  (previous line repeated {repeats}×)")
+        repeats = 0
+        if not line and out and not out[-1]:
+            continue
+        out.append(line)
+        last = line
+    if repeats:
+        out.append(f"  (previous line repeated {repeats}×)")
+    return "\n".join(out).strip()
+
+def compress(text: str, max_tokens: int, keep: str = "both") -> str:
+    """
+    Fits `text` into roughly `max_tokens`. keep="both" keeps 40 % head /
+    60 % tail, keep="tail" 20 % / 80 % (errors and results come last).
+    """
+    text = _fold_lines(text or "")
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    head_share = 0.2 if keep == "tail" else 0.4
+    head_chars = int(max_chars * head_share)
+    tail_chars = max_chars - head_chars
+    head, tail = text[:head_chars], text[-tail_chars:]
+    # cut on line boundaries where that loses little
+    if "\n" in head[head_chars // 2:]:
+        head = head[:head.rindex("\n")]
+    if "\n" in tail[:tail_chars // 2]:
+        tail = tail[tail.index("\n") + 1:]
+    omitted = len(text) - len(head) - len(tail)
+    return f"{head}\n… [{omitted} chars omitted] …\n{tail}"
+
+
+@dataclass
+class StepResult:
+    idx: int
+    description: str
+    tool: str
+    status: str
+    text: str            # compressed output
+    raw_chars: int
+
+
+class StepResultStore:
+    def __init__(self, ctx=None, *, result_tokens: int = STEP_RESULT_TOKENS,
+                 context_tokens: int = STEP_CONTEXT_TOKENS, summarize: bool = STEP_SUMMARIZE):
+        self.ctx = ctx
+        self.result_tokens = result_tokens
+        self.context_tokens = context_tokens
+        self.summarize = summarize
+        self.results: dict[int, StepResult] = {}
+        self._summaries: set[asyncio.Task] = set()
+
+    def record(self, idx: int, task: dict, result: str, status: str):
+        text = compress(result, self.result_tokens)
+        self.results[idx] = StepResult(
+            idx=idx,
+            description=task.get("description") or f"{task.get('tool')} step",
+            tool=task.get("tool") or "unknown",
+            status=status,
+            text=text,
+            raw_chars=len(result or ""),
+        )
+        if self.summarize and status == "done" and estimate_tokens(result or "") > self.result_tokens:
+            job = asyncio.create_task(self._summarize(idx, result))
+            self._summaries.add(job)
+            job.add_done_callback(self._summaries.discard)
+
+    async def _summarize(self, idx: int, result: str):
+        words = max(20, self.result_tokens * 3 // 4)
+        prompt = (
+            f"Summarise the following tool output in at most {words} words. Keep every number, "
+            "name, URL, file path and error message a follow-up step might need. "
+            "Output only the summary.\n\n"
+            f"{compress(result, self.result_tokens * 8)}"
+        )
+        model = getattr(self.ctx, "planner_model", None)
+        if not model:
+            return
+        summary = await asimple_prompt(model, prompt, timeout=SUMMARY_TIMEOUT,
+                                       cache=getattr(self.ctx, "use_cache", True))
+        if summary and idx in self.results:
+            self.results[idx].text = compress(summary.strip(), self.result_tokens)
+
+    def context_for(self, idx: int, deps: Iterable[int] = ()) -> str:
+        """
+        Prior results for step `idx` within the context budget: direct
+        dependencies first, then other finished steps, newest first.
+        """
+        deps = [d for d in sorted(deps) if d in self.results and d != idx]
+        others = sorted((i for i in self.results if i not in deps and i != idx), reverse=True)
+        budget = self.context_tokens
+        parts: list[tuple[int, str]] = []
+        for i in deps + others:
+            r = self.results[i]
+            block = f"Step {i + 1} [{r.tool}, {r.status}] {r.description}:\n{r.text}"
+            cost = estimate_tokens(block)
+            if cost > budget:
+                if i in deps and budget > 50:       # a dependency is worth a shorter form
+                    block = f"Step {i + 1} [{r.tool}, {r.status}] {r.description}:\n" \
+                            f"{compress(r.text, budget - 20)}"
+                    cost = estimate_tokens(block)
+                else:
+                    continue
+            parts.append((i, block))
+            budget -= cost
+        text = "\n\n".join(block for _, block in sorted(parts))
+        CONTEXT_TOKENS.observe(estimate_tokens(text))
+        return text
+
+    def stats(self) -> dict:
+        raw = sum(r.raw_chars for r in self.results.values())
+        kept = sum(len(r.text) for r in self.results.values())
+        return {"steps": len(self.results), "raw_chars": raw, "kept_chars": kept}
+
+    async def aclose(self):
+        for job in list(self._summaries):
+            job.cancel()
+        if self._summaries:
+            await asyncio.gather(*self._summaries, return_exceptions=True)
@@ -0,0 +1,183 @@
+"""
+tool_cache.py
+─────────────
+Opt-in (TOOL_CACHE=1) content-addressed cache for deterministic tool calls.
+
+The key is a SHA-256 of the tool name plus its normalised parameters
+(shell argv after shlex, code with line endings / trailing blanks
+normalised), so a planner that regenerates the same command or snippet –
+in a retry or in another session – gets the stored result back instead of
+running it again.
+
+Cacheability rules (`cache_rule`)
+---------------------------------
+  shell_terminal   echo / pwd                          → cached for TOOL_CACHE_TTL
+                   ls / cat / grep / head / tail        → cached, tag "fs", TOOL_CACHE_FS_TTL
+                   date, mkdir, touch, pip, python, …   → never; mutating ones drop the "fs" entries
+  code_interpreter snippets that import only pure stdlib modules
+                   (PURE_MODULES), call no I/O builtin (open, input,
+                   eval, …) and no to_* / save* / write* / read_* method
+                                                        → cached for TOOL_CACHE_TTL
+                   anything else – any other import (numpy, pandas,
+                   yfinance, os, time, random, …)       → never, and drops the "fs" entries
+  browser / other  never (the web is not deterministic)
+
+Only successful results ("Exit Code: 0 …") are stored.
+"""
+
+from __future__ import annotations
+import ast
+import hashlib
+import json
+import os
+import re
+import shlex
+from collections import defaultdict
+from dataclasses import dataclass
+
+from .cache import SQLiteLRUCache
+
+TOOL_CACHE_ENABLED     = os.getenv("TOOL_CACHE", "0") == "1"
+TOOL_CACHE_TTL         = float(os.getenv("TOOL_CACHE_TTL", "86400"))
+TOOL_CACHE_FS_TTL      = float(os.getenv("TOOL_CACHE_FS_TTL", "300"))
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "2000"))
+TOOL_CACHE_MAX_MB      = float(os.getenv("TOOL_CACHE_MAX_MB", "64"))
+KEY_VERSION            = 1      # bump when the normalisation changes
+
+# shell commands whose output depends only on their arguments
+SHELL_PURE       = {"echo", "pwd"}
+# read-only commands whose output depends on the file system
+SHELL_READS_FS   = {"ls", "cat", "grep", "head", "tail"}
+# commands that change the file system / environment
+SHELL_MUTATES_FS = {"mkdir", "rmdir", "touch", "pip", "pip3", "python", "python3"}
+
+# the only modules a cacheable snippet may import: no clock, entropy, files,
+# network or environment behind any of them
+PURE_MODULES = {
+    "math", "cmath", "decimal", "fractions", "numbers", "statistics",
+    "json", "re", "string", "textwrap", "unicodedata", "difflib",
+    "itertools", "functools", "operator", "collections", "heapq", "bisect",
+    "array", "struct", "copy", "pprint", "dataclasses", "enum", "typing", "abc",
+    "base64", "binascii", "hashlib", "zlib",
+}
+# builtins that read, write or run something outside the snippet (hash / id vary per process)
+_IMPURE_BUILTINS = {"open", "input", "exec", "eval", "compile", "__import__", "breakpoint",
+                    "globals", "vars", "hash", "id"}
+# methods that read or write files / URLs: df.to_csv, np.save, fig.savefig, pd.read_csv, f.write
+_IO_METHOD = re.compile(r"^(to_|save|write|read_)")
+
+
+@dataclass
+class CacheRule:
+    key: str | None          # None → not cacheable
+    ttl: float = TOOL_CACHE_TTL
+    tag: str | None = None
+    invalidates_fs: bool = False
+
+
+def _digest(tool: str, params) -> str:
+    payload = json.dumps({"v": KEY_VERSION, "tool": tool, "params": params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def normalize_code(code: str) -> str:
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+def is_pure_code(code: str) -> bool:
+    """True when the snippet's output can only depend on its source (see PURE_MODULES)."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(alias.name.split(".")[0] not in PURE_MODULES for alias in node.names):
+                return False
+        elif isinstance(node, ast.ImportFrom):
+            if node.level or (node.module or "").split(".")[0] not in PURE_MODULES:
+                return False
+        elif isinstance(node, ast.Name) and node.id in _IMPURE_BUILTINS:
+            return False
+        elif isinstance(node, ast.Attribute) and _IO_METHOD.match(node.attr):
+            return False
+    return True
+
+def cache_rule(task: dict) -> CacheRule:
+    """Decides whether (and how) the result of `task` may be cached."""
+    tool = task.get("tool")
+
+    if tool == "shell_terminal":
+        command = task.get("command", [])
+        full_cmd = " ".join(command) if isinstance(command, list) else str(command)
+        try:
+            argv = shlex.split(full_cmd)
+        except ValueError:
+            return CacheRule(None)
+        if not argv:
+            return CacheRule(None)
+        name = argv[0]
+        if name in SHELL_PURE:
+            return CacheRule(_digest(tool, argv))
+        if name in SHELL_READS_FS:
+            return CacheRule(_digest(tool, argv), ttl=TOOL_CACHE_FS_TTL, tag="fs")
+        return CacheRule(None, invalidates_fs=name in SHELL_MUTATES_FS)
+
+    if tool == "code_interpreter":
+        code = normalize_code(task.get("code", ""))
+        if not code or not is_pure_code(code):
+            return CacheRule(None, invalidates_fs=True)
+        return CacheRule(_digest(tool, code))
+
+    return CacheRule(None)
+
+
+class ToolResultCache:
+    """SQLiteLRUCache plus the rules above and per-tool counters."""
+
+    def __init__(self, directory: str, enabled: bool = TOOL_CACHE_ENABLED):
+        self.enabled = enabled
+        self.store = SQLiteLRUCache(
+            os.path.join(directory, "tool_results.sqlite"),
+            max_entries=TOOL_CACHE_MAX_ENTRIES,
+            max_bytes=int(TOOL_CACHE_MAX_MB * 1024 * 1024),
+            default_ttl=TOOL_CACHE_TTL,
+        )
+        self.counters: dict[str, dict[str, int]] = defaultdict(
+            lambda: {"hits": 0, "misses": 0, "uncacheable": 0}
+        )
+
+    def lookup(self, task: dict) -> tuple[CacheRule, str | None]:
+        """Returns the rule for `task` and the cached result, if any."""
+        rule = cache_rule(task)
+        if not self.enabled:
+            return rule, None
+        counts = self.counters[task.get("tool") or "unknown"]
+        if rule.key is None:
+            counts["uncacheable"] += 1
+            return rule, None
+        try:
+            value = self.store.get(rule.key)
+        except Exception as e:
+            print(f"[tool-cache] lookup failed: {e}")
+            value = None
+        counts["hits" if value is not None else "misses"] += 1
+        return rule, value
+
+    def record(self, rule: CacheRule, result: str):
+        """Stores a fresh result (successes only) and applies invalidation."""
+        if not self.enabled:
+            return
+        try:
+            if rule.invalidates_fs:
+                self.store.invalidate_tag("fs")
+            if rule.key is not None and isinstance(result, str) and result.startswith("Exit Code: 0"):
+                self.store.put(rule.key, result, ttl=rule.ttl, tag=rule.tag)
+        except Exception as e:
+            print(f"[tool-cache] store failed: {e}")
+
+    def stats(self) -> dict:
+        stats = {"enabled": self.enabled, "per_tool": dict(self.counters)}
+        if self.enabled:
+            stats.update(self.store.stats())
+        return stats
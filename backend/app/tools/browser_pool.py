@@ -0,0 +1,232 @@
+"""
+browser_pool.py
+───────────────
+Pool of long-lived `run_browser_task.py --worker` processes.
+
+Each worker imports browser_use / langchain_ollama / Playwright once and
+keeps one Chromium running; every task gets a fresh BrowserContext inside
+it. The parent talks to a worker over a Unix socketpair (newline-delimited
+JSON, see run_browser_task.py), so stray prints from the libraries can
+never corrupt a result.
+
+A worker is recycled after BROWSER_WORKER_MAX_TASKS tasks, when its process
+tree (worker + Chromium) grows beyond BROWSER_WORKER_MAX_RSS_MB, when it
+asks to be, or when a task times out / is cancelled. A replacement is
+started in the background so the next task finds a warm browser.
+
+Public API
+----------
+    BROWSER_POOL.run(instructions, model, timeout, on_line=None) -> dict
+        {"result": "..."} or {"error": "..."}
+        The worker's log lines are passed to `on_line` while the task runs.
+    await BROWSER_POOL.aclose()
+"""
+
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import sys
+
+from ..metrics import span
+from .process_runner import OnLine, kill_process_group, tree_rss_mb
+
+PYTHON = sys.executable
+RUNNER = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "run_browser_task.py")
+)
+
+BROWSER_POOL_SIZE         = int(os.getenv("BROWSER_POOL_SIZE", "1"))
+BROWSER_WORKER_MAX_TASKS  = int(os.getenv("BROWSER_WORKER_MAX_TASKS", "25"))
+BROWSER_WORKER_MAX_RSS_MB = float(os.getenv("BROWSER_WORKER_MAX_RSS_MB", "2048"))
+WORKER_START_TIMEOUT      = float(os.getenv("BROWSER_WORKER_START_TIMEOUT", "90"))
+MAX_MESSAGE               = 16 * 1024 * 1024
+
+log = logging.getLogger(__name__)
+
+
+class BrowserWorker:
+    """One `run_browser_task.py --worker` process and its socket."""
+
+    def __init__(self):
+        self.proc: asyncio.subprocess.Process | None = None
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.tasks_done = 0
+        self.on_line: OnLine | None = None      # receives log lines of the current task
+        self._log_pump: asyncio.Task | None = None
+
+    @property
+    def pid(self) -> int | None:
+        return self.proc.pid if self.proc else None
+
+    async def start(self):
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                PYTHON, RUNNER, "--worker", str(child_sock.fileno()),
+                pass_fds=(child_sock.fileno(),),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                env={**os.environ, "PYTHONIOENCODING": "utf-8"},
+                start_new_session=True,          # own process group (Chromium too)
+            )
+        finally:
+            child_sock.close()
+        self._log_pump = asyncio.create_task(self._pump_logs())
+        self.reader, self.writer = await asyncio.open_unix_connection(
+            sock=parent_sock, limit=MAX_MESSAGE
+        )
+        hello = await asyncio.wait_for(self._recv(), timeout=WORKER_START_TIMEOUT)
+        if not hello.get("ready"):
+            raise RuntimeError(hello.get("error") or "browser worker did not report ready")
+        log.info("worker %s ready", self.pid)
+
+    async def request(self, payload: dict) -> dict:
+        self.writer.write((json.dumps(payload) + "\n").encode())
+        await self.writer.drain()
+        return await self._recv()
+
+    async def _recv(self) -> dict:
+        line = await self.reader.readline()
+        if not line:
+            raise RuntimeError("browser worker exited unexpectedly")
+        return json.loads(line)
+
+    async def _pump_logs(self):
+        """Drains the worker's stdout/stderr so it never blocks on a full pipe."""
+        async for raw in self.proc.stdout:
+            line = raw.decode(errors='replace').rstrip()
+            log.debug("worker %s: %s", self.pid, line)
+            if self.on_line:
+                try:
+                    await self.on_line("stderr", line)
+                except Exception:
+                    pass
+
+    def rss_mb(self) -> float:
+        return tree_rss_mb(self.pid) if self.pid else 0.0
+
+    def kill(self):
+        """Hard stop: the whole process group, including Chromium."""
+        if self.proc and self.proc.returncode is None:
+            kill_process_group(self.proc.pid)
+        if self.writer:
+            self.writer.close()
+
+    async def stop(self, grace: float = 10.0):
+        """Polite shutdown, then kill whatever is left."""
+        try:
+            if self.writer and self.proc and self.proc.returncode is None:
+                self.writer.write(b'{"op": "shutdown"}\n')
+                await self.writer.drain()
+                await asyncio.wait_for(self.proc.wait(), timeout=grace)
+        except Exception:
+            pass
+        self.kill()
+        if self.proc:
+            await self.proc.wait()
+        if self._log_pump:
+            self._log_pump.cancel()
+
+
+# ───────────────────────────────────────────────── pool
+class BrowserPool:
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._slots = asyncio.Semaphore(self.size)
+        self._idle: asyncio.Queue = asyncio.Queue()  # ready workers (None = "spawn yourself")
+        self._live = 0                                # started or starting workers
+        self._ids = itertools.count(1)
+        self._bg: set[asyncio.Task] = set()
+
+    async def _spawn(self) -> BrowserWorker:
+        self._live += 1
+        worker = BrowserWorker()
+        try:
+            with span("browser_worker_start"):
+                await worker.start()
+            return worker
+        except BaseException:
+            self._live -= 1
+            worker.kill()
+            raise
+
+    async def _checkout(self) -> BrowserWorker:
+        while True:
+            if self._idle.empty() and self._live < self.size:
+                return await self._spawn()
+            worker = await self._idle.get()
+            if worker is not None and worker.proc.returncode is None:
+                return worker
+            if worker is not None:             # died while idle
+                self._live -= 1
+                worker.kill()
+
+    async def _retire(self, worker: BrowserWorker, replace: bool = True):
+        self._live -= 1
+        await worker.stop()
+        if replace and self._live < self.size:
+            try:
+                self._idle.put_nowait(await self._spawn())
+            except Exception as e:
+                log.warning("replacement worker failed to start: %s", e)
+                self._idle.put_nowait(None)    # wake a waiter so it retries itself
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._bg.add(task)
+        task.add_done_callback(self._bg.discard)
+
+    async def run(self, instructions: str, model: str, timeout: float,
+                  on_line: OnLine | None = None) -> dict:
+        async with self._slots:
+            try:
+                worker = await self._checkout()
+            except Exception as e:
+                return {"error": f"browser worker failed to start: {e}"}
+
+            finished = False
+            worker.on_line = on_line
+            try:
+                res = await asyncio.wait_for(
+                    worker.request({"id": next(self._ids), "instructions": instructions, "model": model}),
+                    timeout=timeout,
+                )
+                finished = True
+            except asyncio.TimeoutError:
+                return {"error": f"browser task exceeded {timeout:.0f} s.", "timeout": True}
+            except Exception as e:
+                return {"error": f"browser worker failed: {e}"}
+            finally:
+                worker.on_line = None
+                if not finished:
+                    # mid-task (timeout, crash or cancellation): worker is unusable
+                    worker.kill()
+                    self._background(self._retire(worker))
+
+            worker.tasks_done += 1
+            rss = worker.rss_mb()
+            if res.pop("recycle", False) or worker.tasks_done >= BROWSER_WORKER_MAX_TASKS \
+                    or rss > BROWSER_WORKER_MAX_RSS_MB:
+                log.info("recycling worker %s (tasks=%d, rss=%.0f MB)", worker.pid, worker.tasks_done, rss)
+                self._background(self._retire(worker))
+            else:
+                self._idle.put_nowait(worker)
+            return res
+
+    async def aclose(self):
+        for task in list(self._bg):
+            task.cancel()
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            if worker is not None:
+                self._live -= 1
+                await worker.stop(grace=3.0)
+
+
+BROWSER_POOL = BrowserPool(BROWSER_POOL_SIZE)
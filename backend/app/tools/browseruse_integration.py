@@ -1,8 +1,10 @@
 """
 browseruse_integration.py
 ─────────────────────────
-Utility that launches `run_browser_task.py` in a separate Python
-process so an LLM can drive Playwright through the Browser-Use library.
+Utility that runs a Browser-Use task in a separate Python process so an
+LLM can drive Playwright. By default the task goes to a warm worker from
+`browser_pool` (BROWSER_POOL_SIZE > 0); with BROWSER_POOL_SIZE=0 a fresh
+`run_browser_task.py` process is launched per call.
 
 Public coroutine
 ----------------
@@ -10,26 +12,23 @@ Public coroutine
                    websocket,
                    *,
                    browser_model: str | None = None,
-                   context_hint: str | None = None) -> str
-Returns the final summary string from the isolated browser task, or an
-error string starting with “Error: …”.
+                   context_hint: str | None = None) -> ToolResult
+Returns a ToolResult whose text is the final summary from the isolated
+browser task, or an error starting with “Error: …”.
 """
 
 from __future__ import annotations
-import asyncio
 import json
+import logging
 import os
-import subprocess
-import sys
-import traceback
 
-# paths
-PYTHON = sys.executable
-RUNNER = os.path.abspath(
-    os.path.join(os.path.dirname(__file__), "..", "..", "run_browser_task.py")
-)
+from .browser_pool import BROWSER_POOL, BROWSER_POOL_SIZE, MAX_MESSAGE, PYTHON, RUNNER
+from .process_runner import ProcessResult, WebSocketLineSink, run_process
+from .tool_result import ToolResult
 
-print(f"[browser-use] helper path: {RUNNER}")
+BROWSER_TIMEOUT = 240.0   # matches the agent timeout inside the worker
+
+log = logging.getLogger(__name__)
 
 # ───────────────────────────────────────────────── prompt helper
 def _build_prompt(user_instruction: str, context_hint: str | None = None) -> str:
@@ -48,18 +47,19 @@ def _build_prompt(user_instruction: str, context_hint: str | None = None) -> str
     return header + "\n--- USER TASK ---\n" + user_instruction.strip()
 
 # ───────────────────────────────────────────────── subprocess helper
-async def _run_subprocess(cmd: list[str], timeout: float):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        None,
-        lambda: subprocess.run(
+async def _run_subprocess(cmd: list[str], timeout: float, websocket) -> ProcessResult:
+    # stderr carries the task's log and is streamed; stdout is the JSON result
+    sink = WebSocketLineSink(websocket, "browser", streams=("stderr",))
+    try:
+        return await run_process(
             cmd,
-            capture_output=True,
-            text=True,
             timeout=timeout,
+            on_line=sink,
             env={**os.environ, "PYTHONIOENCODING": "utf-8"},
-        ),
-    )
+            head_chars=MAX_MESSAGE,
+        )
+    finally:
+        await sink.flush()
 
 # ───────────────────────────────────────────────── public coroutine
 async def browse_website(
@@ -68,53 +68,73 @@ async def browse_website(
     *,
     browser_model: str | None = None,
     context_hint: str | None = None,
-) -> str:
+) -> ToolResult:
     """
     Launch an isolated browser subprocess and return its final result.
     """
     if not os.path.exists(RUNNER):
         err = f"Error: helper script not found at {RUNNER}"
         await websocket.send_text(f"Agent Error: {err}")
-        return err
+        return ToolResult.error("not_found", err)
 
     instructions = _build_prompt(user_instruction, context_hint)
     model = browser_model or os.getenv("BROWSER_AGENT_INTERNAL_MODEL", "qwen2.5:7b")
 
+    if BROWSER_POOL_SIZE > 0:
+        await websocket.send_text("Agent: handing task to warm browser worker…")
+        # small grace on top of the worker's own timeout for context setup
+        sink = WebSocketLineSink(websocket, "browser")
+        try:
+            result = await BROWSER_POOL.run(instructions, model, timeout=BROWSER_TIMEOUT + 15,
+                                            on_line=sink)
+        finally:
+            await sink.flush()
+        if result.get("timeout"):
+            await websocket.send_text(
+                f"Agent Error: browser worker hard-timeout ({BROWSER_TIMEOUT:.0f} s)."
+            )
+            return ToolResult.timeout(f"Error: browser worker exceeded {BROWSER_TIMEOUT:.0f} s.")
+        return await _finish(result, websocket)
+
     await websocket.send_text("Agent: launching browser subprocess…")
 
     payload = json.dumps({"instructions": instructions, "model": model})
     cmd = [PYTHON, RUNNER, payload]
 
-    try:
-        proc = await _run_subprocess(cmd, timeout=240.0)
-    except subprocess.TimeoutExpired:
+    proc = await _run_subprocess(cmd, timeout=BROWSER_TIMEOUT, websocket=websocket)
+    if proc.timed_out:
         await websocket.send_text(
             "Agent Error: browser subprocess hard-timeout (240 s)."
         )
-        return "Error: browser subprocess exceeded 240 s."
+        return ToolResult.timeout("Error: browser subprocess exceeded 240 s.")
 
-    stdout = (proc.stdout or "").strip()
-    stderr = (proc.stderr or "").strip()
+    stdout = proc.stdout.strip()
+    stderr = proc.stderr.strip()
 
     if proc.returncode != 0:
         await websocket.send_text(
             f"Agent Error: browser subprocess exit {proc.returncode}"
         )
         if stderr:
-            print(f"[browser-stderr]\n{stderr}\n")
-        return f"Error: browser subprocess exit {proc.returncode}."
+            log.warning("browser subprocess exit %s:\n%s", proc.returncode, stderr)
+        return ToolResult(stderr=stderr, error_kind="nonzero_exit",
+                          message=f"Error: browser subprocess exit {proc.returncode}.")
 
     # decode stdout JSON
     try:
         result = json.loads(stdout or "{}")
     except json.JSONDecodeError:
         await websocket.send_text("Agent Error: malformed JSON from browser task.")
-        print(f"[browser-stdout]\n{stdout}\n")
-        return "Error: browser task returned malformed JSON."
+        log.warning("malformed JSON from browser task:\n%s", stdout)
+        return ToolResult.error("tool_error", "Error: browser task returned malformed JSON.")
+
+    return await _finish(result, websocket)
 
+async def _finish(result: dict, websocket) -> ToolResult:
+    """Maps a task result dict to the tool's result contract."""
     if "error" in result:
         await websocket.send_text(f"Agent Error: {result['error'][:200]}")
-        return f"Error: {result['error']}"
+        return ToolResult.error("tool_error", f"Error: {result['error']}")
 
     await websocket.send_text("Agent: browser action completed.")
-    return result.get("result", "Browser task finished (no result key).")
+    return ToolResult(message=result.get("result", "Browser task finished (no result key)."))
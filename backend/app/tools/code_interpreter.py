@@ -1,86 +1,81 @@
 import subprocess
 import tempfile
 import os
-import asyncio
 import traceback
 import sys
 import re
 
+from .dependencies import ensure_dependencies, pip_install
+from .process_runner import WebSocketLineSink, run_process
+from .sandbox_pool import SANDBOX_ENABLED, run_snippet
+from .tool_result import ToolResult
+
 TIMEOUT_SECONDS = 30
 
-async def execute_python_code_subprocess(code: str, websocket) -> str:
+def _missing_module(err: str) -> str | None:
+    if "ModuleNotFoundError: No module named" not in err:
+        return None
+    missing = re.search(r"No module named ['\"](.+?)['\"]", err)
+    return missing.group(1) if missing else None
+
+async def execute_python_code_subprocess(code: str, websocket) -> ToolResult:
     """
     Executes Python code in a subprocess.
-    On ModuleNotFoundError, auto-installs the missing package via pip and retries.
+    On ModuleNotFoundError (an import the pre-resolution scan could not
+    see), auto-installs the missing package via pip and retries – only if
+    the install worked; otherwise the missing_module result is returned.
     """
     # 1) Write to temp file
     with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, encoding='utf-8') as tmp:
         script_path = tmp.name
         tmp.write(code)
 
-    def run_script():
-        return subprocess.run(
-            [sys.executable, script_path],
-            capture_output=True,
-            text=True,
-            timeout=TIMEOUT_SECONDS
-        )
+    async def run_script():
+        sink = WebSocketLineSink(websocket, "python")
+        try:
+            proc = await run_process([sys.executable, script_path],
+                                     timeout=TIMEOUT_SECONDS, on_line=sink)
+        finally:
+            await sink.flush()
+        if proc.timed_out:
+            raise subprocess.TimeoutExpired(script_path, TIMEOUT_SECONDS)
+        return proc
 
     try:
         await websocket.send_text(f"Agent: Running Python script {os.path.basename(script_path)}...")
         print(f"Executing code file: {script_path}")
 
-        loop = asyncio.get_running_loop()
-        proc = await loop.run_in_executor(None, run_script)
-
-        out, err = proc.stdout or "", proc.stderr or ""
-        code_ret = proc.returncode
-        result = f"Exit Code: {code_ret}\n"
-        if out:
-            result += f"Output:\n{out}\n"
-        if err:
-            result += f"Errors:\n{err}\n"
+        proc = await run_script()
+        result = ToolResult.from_process(proc.returncode, proc.stdout, proc.stderr)
 
         # 2) Auto-install on missing module
-        if code_ret != 0 and "ModuleNotFoundError: No module named" in err:
-            missing = re.search(r"No module named ['\"](.+?)['\"]", err)
-            if missing:
-                pkg = missing.group(1)
-                await websocket.send_text(f"Agent: Installing missing package '{pkg}'...")
-                print(f"Auto-installing: {pkg}")
-                subprocess.run([sys.executable, '-m', 'pip', 'install', pkg], check=False)
-
-                # Retry
-                proc2 = await loop.run_in_executor(None, run_script)
-                out2, err2 = proc2.stdout or "", proc2.stderr or ""
-                code2 = proc2.returncode
-                retry_res = f"After install -> Exit Code: {code2}\n"
-                if out2:
-                    retry_res += f"Output:\n{out2}\n"
-                if err2:
-                    retry_res += f"Errors:\n{err2}\n"
-                return retry_res.strip()
-
-        return result.strip()
+        missing = _missing_module(proc.stderr) if result.error_kind == "missing_module" else None
+        if missing and await pip_install(missing, websocket):
+            # Retry
+            proc2 = await run_script()
+            return ToolResult.from_process(proc2.returncode, proc2.stdout, proc2.stderr,
+                                           "After install -> Exit Code")
+
+        return result
 
     except subprocess.TimeoutExpired:
         timeout_msg = f"Error: Python execution timed out after {TIMEOUT_SECONDS}s."
         await websocket.send_text(f"Agent Error: {timeout_msg}")
         print(timeout_msg)
-        return timeout_msg
+        return ToolResult.timeout(timeout_msg)
 
     except FileNotFoundError:
         fnf = "Error: Python interpreter not found."
         await websocket.send_text(f"Agent Error: {fnf}")
         print(fnf)
-        return fnf
+        return ToolResult.error("not_found", fnf)
 
     except Exception as e:
         exc = f"Error executing Python code: {e}"
         await websocket.send_text(f"Agent Error: {exc}")
         print(exc)
         traceback.print_exc()
-        return exc
+        return ToolResult.error("exception", exc)
 
     finally:
         # 3) Cleanup
@@ -89,5 +84,52 @@ async def execute_python_code_subprocess(code: str, websocket) -> str:
         except OSError:
             pass
 
-async def execute_python_code(code: str, websocket) -> str:
+async def execute_python_code_sandboxed(code: str, websocket) -> ToolResult:
+    """
+    Executes Python code in a fresh fork of the warm sandbox zygote
+    (see sandbox_pool). Same result contract and auto-install retry as
+    the subprocess path, plus per-run CPU / memory limits.
+    """
+    async def run_once(label: str = "Exit Code") -> ToolResult:
+        sink = WebSocketLineSink(websocket, "python")
+        try:
+            res = await run_snippet(code, TIMEOUT_SECONDS, on_line=sink)
+        finally:
+            await sink.flush()
+        if res.timed_out:
+            raise subprocess.TimeoutExpired("sandbox", TIMEOUT_SECONDS)
+        err = res.stderr
+        if res.killed_reason == "memory":
+            err += "\nKilled: memory limit exceeded."
+        return ToolResult.from_process(res.returncode, res.stdout, err, label, killed=res.killed_reason)
+
+    try:
+        await websocket.send_text("Agent: Running Python snippet in warm sandbox...")
+        result = await run_once()
+
+        # Auto-install on missing module
+        missing = _missing_module(result.stderr) if result.error_kind == "missing_module" else None
+        if missing and await pip_install(missing, websocket):
+            result = await run_once("After install -> Exit Code")
+
+        return result
+
+    except subprocess.TimeoutExpired:
+        timeout_msg = f"Error: Python execution timed out after {TIMEOUT_SECONDS}s."
+        await websocket.send_text(f"Agent Error: {timeout_msg}")
+        print(timeout_msg)
+        return ToolResult.timeout(timeout_msg)
+
+    except Exception as e:
+        exc = f"Error executing Python code: {e}"
+        await websocket.send_text(f"Agent Error: {exc}")
+        print(exc)
+        traceback.print_exc()
+        return ToolResult.error("exception", exc)
+
+async def execute_python_code(code: str, websocket) -> ToolResult:
+    # Install the snippet's missing imports up front (see dependencies.py)
+    await ensure_dependencies(code, websocket)
+    if SANDBOX_ENABLED:
+        return await execute_python_code_sandboxed(code, websocket)
     return await execute_python_code_subprocess(code, websocket)
@@ -0,0 +1,324 @@
+"""
+dependencies.py
+───────────────
+Dependency pre-resolution for `code_interpreter` snippets.
+
+Before a snippet runs, `ensure_dependencies(code, websocket)`:
+
+  1. scans its imports statically (ast; a regex fallback for code that
+     does not parse) – top-level names only, relative imports skipped,
+     imports guarded by `except ImportError` treated as optional;
+  2. drops everything importable: the installed-module index (a set,
+     built once per process in a thread, updated after each install –
+     repeated checks are a set lookup), confirmed with find_spec on a
+     miss. A standard-library module missing from the image (tkinter, …)
+     stays missing – pip cannot provide it;
+  3. keeps only modules it may install: those in IMPORT_TO_DIST, in
+     PIP_ALLOWED (numpy, requests, …) or found in the wheelhouse. A typo,
+     a module the snippet writes itself or an arbitrary PyPI name is left
+     to fail in the snippet; PIP_INSTALL_ANY=1 lifts the restriction;
+  4. maps import names to distributions (IMPORT_TO_DIST, e.g.
+     cv2 → opencv-python; PIP_PACKAGE_MAP="mod=dist,…" adds more);
+  5. installs whatever is missing with ONE pip call, bounded by
+     PIP_TIMEOUT_SECONDS, using the persistent PIP_CACHE_DIR and – when
+     set – the local wheelhouse PIP_WHEELHOUSE (PIP_OFFLINE=1: nothing
+     but the wheelhouse).
+
+Snippets that need the same package at the same time share one install;
+a package that failed to install is not retried for PIP_RETRY_SECONDS.
+The ModuleNotFoundError fallback (imports the scan cannot see, e.g.
+importlib.import_module) goes through `pip_install` here as well.
+"""
+
+from __future__ import annotations
+import ast
+import asyncio
+import importlib
+import importlib.metadata
+import importlib.util
+import os
+import pkgutil
+import re
+import sys
+import time
+
+from ..metrics import counter, span
+from .process_runner import WebSocketLineSink, run_process
+
+PIP_TIMEOUT_SECONDS = float(os.getenv("PIP_TIMEOUT_SECONDS", "300"))
+PIP_CACHE_DIR       = os.getenv("PIP_CACHE_DIR") or os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "tasks", ".cache", "pip"))
+PIP_WHEELHOUSE      = os.getenv("PIP_WHEELHOUSE", "")
+PIP_OFFLINE         = os.getenv("PIP_OFFLINE", "0") == "1"
+PIP_RETRY_SECONDS   = float(os.getenv("PIP_RETRY_SECONDS", "600"))
+PREINSTALL          = os.getenv("CODE_PREINSTALL", "1") != "0"
+PIP_INSTALL_ANY     = os.getenv("PIP_INSTALL_ANY", "0") == "1"   # install any unresolved import
+
+# import name → distribution name, where they differ
+IMPORT_TO_DIST = {
+    "cv2": "opencv-python",
+    "PIL": "Pillow",
+    "sklearn": "scikit-learn",
+    "skimage": "scikit-image",
+    "yaml": "PyYAML",
+    "bs4": "beautifulsoup4",
+    "dateutil": "python-dateutil",
+    "dotenv": "python-dotenv",
+    "docx": "python-docx",
+    "pptx": "python-pptx",
+    "fitz": "PyMuPDF",
+    "Crypto": "pycryptodome",
+    "OpenSSL": "pyOpenSSL",
+    "jwt": "PyJWT",
+    "serial": "pyserial",
+    "usb": "pyusb",
+    "magic": "python-magic",
+    "attr": "attrs",
+    "gi": "PyGObject",
+    "Levenshtein": "python-Levenshtein",
+    "mpl_toolkits": "matplotlib",
+    "jose": "python-jose",
+    "multipart": "python-multipart",
+    "telegram": "python-telegram-bot",
+    "zmq": "pyzmq",
+    "Bio": "biopython",
+}
+for _pair in filter(None, os.getenv("PIP_PACKAGE_MAP", "").split(",")):
+    _mod, _, _dist = _pair.partition("=")
+    if _mod.strip() and _dist.strip():
+        IMPORT_TO_DIST[_mod.strip()] = _dist.strip()
+
+# import names that may be installed as is (besides IMPORT_TO_DIST and the
+# wheelhouse); PIP_ALLOWED_PACKAGES="mod,…" adds more
+PIP_ALLOWED = {
+    "numpy", "pandas", "scipy", "matplotlib", "seaborn", "plotly", "sympy",
+    "statsmodels", "networkx", "requests", "httpx", "lxml", "html5lib",
+    "openpyxl", "xlrd", "tabulate", "tqdm", "pytz", "tzdata", "regex",
+    "chardet", "markdown", "pypdf", "PyPDF2", "reportlab", "xmltodict",
+    "toml", "jsonschema", "pydantic", "pyarrow", "polars", "numexpr",
+    "faker", "nltk", "textblob", "wordcloud", "folium", "geopy", "shapely",
+    "qrcode", "imageio", "feedparser", "emoji", "unidecode", "rich",
+}
+PIP_ALLOWED.update(m.strip() for m in os.getenv("PIP_ALLOWED_PACKAGES", "").split(",") if m.strip())
+
+_IMPORT_RE = re.compile(r"^\s*(?:from\s+([A-Za-z_]\w*)[\w.]*\s+import\s|import\s+([A-Za-z_][\w., ]*))", re.M)
+_IMPORT_ERRORS = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+
+DEPENDENCIES = counter("code_dependencies_total", "Snippet imports by resolution outcome.", ("outcome",))
+
+
+# ───────────────────────────────────────────────── static scan
+def scan_imports(code: str) -> tuple[set[str], set[str]]:
+    """Top-level modules a snippet imports: (required, optional)."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        names = set()
+        for m in _IMPORT_RE.finditer(code):
+            if m.group(1):
+                names.add(m.group(1))
+            else:
+                names.update(part.split()[0].split(".")[0] for part in m.group(2).split(",") if part.strip())
+        return names, set()
+
+    required, optional = set(), set()
+
+    def visit(node, guarded: bool):
+        if isinstance(node, ast.Try):
+            catches = any(_catches_import_error(h) for h in node.handlers)
+            for child in node.body:
+                visit(child, guarded or catches)
+            for child in node.handlers + node.orelse + node.finalbody:
+                visit(child, guarded)
+            return
+        if isinstance(node, ast.Import):
+            names = [alias.name.split(".")[0] for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module.split(".")[0]]
+        else:
+            names = []
+        (optional if guarded else required).update(names)
+        for child in ast.iter_child_nodes(node):
+            visit(child, guarded)
+
+    visit(tree, False)
+    return required, optional - required
+
+def _catches_import_error(handler: ast.ExceptHandler) -> bool:
+    if handler.type is None:
+        return True
+    types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    return any(isinstance(t, ast.Name) and t.id in _IMPORT_ERRORS for t in types)
+
+def dist_for(module: str) -> str:
+    return IMPORT_TO_DIST.get(module, module)
+
+def _normalize(dist: str) -> str:
+    return re.sub(r"[-_.]+", "-", dist).lower()
+
+def _wheelhouse_dists() -> set[str]:
+    """Normalized names of the distributions in a local PIP_WHEELHOUSE."""
+    try:
+        files = os.listdir(PIP_WHEELHOUSE) if PIP_WHEELHOUSE else []
+    except OSError:
+        return set()
+    return {_normalize(re.split(r"-\d", f, maxsplit=1)[0]) for f in files
+            if f.endswith((".whl", ".tar.gz", ".zip"))}
+
+
+# ───────────────────────────────────────────────── resolver
+class DependencyResolver:
+    def __init__(self):
+        self.index: set[str] | None = None          # importable top-level modules
+        self.failed: dict[str, float] = {}          # module → time its install failed
+        self._wheelhouse: set[str] | None = None    # distributions in PIP_WHEELHOUSE
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._index_lock = asyncio.Lock()
+
+    async def _load_index(self) -> set[str]:
+        if self.index is None:
+            async with self._index_lock:
+                if self.index is None:
+                    self.index = await asyncio.to_thread(_installed_modules)
+        return self.index
+
+    def installable(self, module: str) -> bool:
+        """Whether `module` may be pip-installed (see the module docstring, step 3)."""
+        if module in sys.stdlib_module_names:
+            return False
+        if PIP_INSTALL_ANY or module in IMPORT_TO_DIST or module in PIP_ALLOWED:
+            return True
+        if self._wheelhouse is None:
+            self._wheelhouse = _wheelhouse_dists()
+        return _normalize(dist_for(module)) in self._wheelhouse
+
+    async def missing(self, modules) -> list[str]:
+        """The modules of `modules` to install now: not importable, allowed, not failed lately."""
+        index = await self._load_index()
+        now = time.monotonic()
+        out = []
+        for module in sorted(set(modules)):
+            if module in index or _importable(module):
+                index.add(module)
+                DEPENDENCIES.inc(outcome="present")
+            elif not self.installable(module):
+                print(f"[deps] not installing '{module}': not in the package allowlist")
+                DEPENDENCIES.inc(outcome="not_allowed")
+            elif now - self.failed.get(module, -PIP_RETRY_SECONDS) < PIP_RETRY_SECONDS:
+                DEPENDENCIES.inc(outcome="known_failure")
+            else:
+                out.append(module)
+        return out
+
+    async def ensure(self, code: str, websocket) -> list[str]:
+        """Installs the snippet's missing imports; returns the ones whose install failed now."""
+        required, _optional = scan_imports(code)
+        need = await self.missing(required)
+        if not need:
+            return []
+        installed = await self.install(need, websocket)
+        return [m for m in need if m not in installed]
+
+    async def install(self, modules: list[str], websocket) -> set[str]:
+        """Installs the distributions for `modules` (single-flight); returns the modules now importable."""
+        mine = [m for m in modules if m not in self._inflight]
+        loop = asyncio.get_running_loop()
+        futures = {m: self._inflight.get(m) for m in modules}
+        for m in mine:
+            futures[m] = self._inflight[m] = loop.create_future()
+        try:
+            if mine:
+                ok = await self._pip(mine, websocket)
+                for m in mine:
+                    futures[m].set_result(m in ok)
+        except BaseException:
+            for m in mine:
+                if not futures[m].done():
+                    futures[m].set_result(False)
+            raise
+        finally:
+            for m in mine:
+                self._inflight.pop(m, None)
+        results = await asyncio.gather(*(asyncio.shield(f) for f in futures.values()))
+        return {m for m, ok in zip(futures, results) if ok}
+
+    async def _pip(self, modules: list[str], websocket) -> set[str]:
+        dists = [dist_for(m) for m in modules]
+        await websocket.send_text(f"Agent: Installing missing package(s) {', '.join(dists)}...")
+        print(f"Auto-installing: {' '.join(dists)}")
+        ok = await self._pip_run(dists, websocket)
+        if not ok and len(dists) > 1:
+            # pip gives up on the whole batch for one bad name – find the good ones,
+            # one at a time (parallel pips would race on the same site-packages)
+            ok = True
+            for dist in dists:
+                ok &= await self._pip_run([dist], websocket)
+
+        importlib.invalidate_caches()
+        index = await self._load_index()
+        found = set()
+        for m in modules:
+            if _importable(m):
+                index.add(m)
+                found.add(m)
+                DEPENDENCIES.inc(outcome="installed")
+            else:
+                self.failed[m] = time.monotonic()
+                DEPENDENCIES.inc(outcome="failed")
+        return found
+
+    async def _pip_run(self, dists: list[str], websocket) -> bool:
+        cmd = [sys.executable, "-m", "pip", "install", "--disable-pip-version-check",
+               "--cache-dir", PIP_CACHE_DIR]
+        if PIP_WHEELHOUSE:
+            cmd += ["--find-links", PIP_WHEELHOUSE]
+        if PIP_OFFLINE:
+            cmd += ["--no-index"]
+        sink = WebSocketLineSink(websocket, "pip")
+        try:
+            with span("pip_install"):
+                res = await run_process(cmd + dists, timeout=PIP_TIMEOUT_SECONDS, on_line=sink)
+        finally:
+            await sink.flush()
+        if res.timed_out:
+            print(f"pip install {' '.join(dists)} timed out after {PIP_TIMEOUT_SECONDS:.0f}s")
+            return False
+        return res.returncode == 0
+
+
+def _importable(module: str) -> bool:
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+def _installed_modules() -> set[str]:
+    # what is really on sys.path – not sys.stdlib_module_names, which also
+    # names stdlib modules this image leaves out
+    modules = set(sys.builtin_module_names)
+    modules.update(importlib.metadata.packages_distributions())
+    modules.update(m.name for m in pkgutil.iter_modules())
+    return modules
+
+
+RESOLVER = DependencyResolver()
+
+async def ensure_dependencies(code: str, websocket) -> list[str]:
+    if not PREINSTALL:
+        return []
+    try:
+        return await RESOLVER.ensure(code, websocket)
+    except Exception as e:
+        print(f"[deps] pre-resolution failed: {e}")
+        return []
+
+async def pip_install(module: str, websocket) -> bool:
+    """
+    Installs the distribution providing `module` (dotted names allowed).
+    True only when the module is importable now – False for a module that
+    may not be installed, so callers never re-run a snippet for nothing.
+    """
+    top = module.split(".")[0]
+    if not await RESOLVER.missing([top]):
+        return top in (RESOLVER.index or ())
+    return top in await RESOLVER.install([top], websocket)
@@ -0,0 +1,273 @@
+"""
+process_runner.py
+─────────────────
+Shared asyncio process runner for the tools.
+
+Children are started with `asyncio.create_subprocess_exec` in their own
+session (process group), so no executor thread is held while they run and
+everything they spawn can be stopped together. stdout / stderr are read
+line by line as they arrive: every line is handed to an optional `on_line`
+callback (used to stream output to the WebSocket) and stored in an
+`OutputBuffer` that keeps only the first and last part of a long output.
+
+On timeout, or when the awaiting task is cancelled (client gone), the
+whole process group gets SIGTERM, then SIGKILL after KILL_GRACE_SECONDS.
+
+Public API
+----------
+    await run_process(cmd, timeout=..., on_line=None, ...) -> ProcessResult
+    OutputBuffer(head_chars, tail_chars)
+    pump_lines(reader, stream, buffer, on_line)     read a stream into a buffer
+    kill_process_group(pid, sig=SIGKILL)
+    tree_rss_mb(pid) -> float                       resident memory of a process tree
+    WebSocketLineSink(websocket, label)             on_line → batched frames
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+import signal
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+OUTPUT_HEAD_CHARS  = int(os.getenv("TOOL_OUTPUT_HEAD_CHARS", "8000"))
+OUTPUT_TAIL_CHARS  = int(os.getenv("TOOL_OUTPUT_TAIL_CHARS", "8000"))
+KILL_GRACE_SECONDS = 2.0
+READ_CHUNK         = 64 * 1024
+MAX_LINE_CHARS     = 64 * 1024     # longer "lines" (no newline) are split
+LINE_FLUSH_SECONDS = 0.25          # WebSocketLineSink batching interval
+SINK_MAX_LINE      = 500           # chars of one line shown live
+SINK_MAX_BATCH     = 40            # lines per live frame; the rest is summarised
+
+OnLine = Callable[[str, str], Awaitable[None]]   # (stream name, line) → None
+
+
+# ───────────────────────────────────────────────── output buffer
+class OutputBuffer:
+    """
+    Keeps the first `head_chars` and the last `tail_chars` of a stream of
+    lines; anything in between is dropped and counted.
+    """
+
+    def __init__(self, head_chars: int = OUTPUT_HEAD_CHARS, tail_chars: int = OUTPUT_TAIL_CHARS):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self._head: list[str] = []
+        self._head_len = 0
+        self._tail: deque[str] = deque()
+        self._tail_len = 0
+        self.dropped_lines = 0
+        self.dropped_chars = 0
+
+    def append(self, line: str):
+        if not self._tail and self._head_len + len(line) <= self.head_chars:
+            self._head.append(line)
+            self._head_len += len(line)
+            return
+        if len(line) > self.tail_chars:
+            self.dropped_chars += len(line) - self.tail_chars
+            line = line[-self.tail_chars:]
+        self._tail.append(line)
+        self._tail_len += len(line)
+        while self._tail_len > self.tail_chars:
+            old = self._tail.popleft()
+            self._tail_len -= len(old)
+            self.dropped_lines += 1
+            self.dropped_chars += len(old)
+
+    @property
+    def truncated(self) -> bool:
+        return self.dropped_chars > 0
+
+    def text(self) -> str:
+        head, tail = "".join(self._head), "".join(self._tail)
+        if not self.truncated:
+            return head + tail
+        marker = f"\n… [{self.dropped_lines} lines / {self.dropped_chars} chars omitted] …\n"
+        return head + marker + tail
+
+
+async def pump_lines(reader: asyncio.StreamReader, stream: str,
+                     buffer: OutputBuffer, on_line: Optional[OnLine] = None):
+    """Reads `reader` to EOF, line by line, into `buffer` (and `on_line`)."""
+    partial = ""
+    while True:
+        chunk = await reader.read(READ_CHUNK)
+        if not chunk:
+            break
+        partial += chunk.decode("utf-8", errors="replace")
+        *lines, partial = partial.split("\n")
+        if len(partial) > MAX_LINE_CHARS:
+            lines.append(partial)
+            partial = ""
+        for line in lines:
+            buffer.append(line + "\n")
+            if on_line:
+                await on_line(stream, line)
+    if partial:
+        buffer.append(partial)
+        if on_line:
+            await on_line(stream, partial)
+
+
+# ───────────────────────────────────────────────── process groups
+def kill_process_group(pid: int | None, sig: int = signal.SIGKILL):
+    if not pid:
+        return
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def tree_rss_mb(pid: int) -> float:
+    """Resident memory of `pid` and all its descendants (Linux /proc; 0 elsewhere)."""
+    total_kb, stack, seen = 0, [pid], set()
+    while stack:
+        p = stack.pop()
+        if p in seen:
+            continue
+        seen.add(p)
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+            for tid in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{tid}/children") as f:
+                    stack.extend(int(c) for c in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+async def _terminate(proc: asyncio.subprocess.Process):
+    """SIGTERM the group, SIGKILL it if the leader is still there after the grace period."""
+    kill_process_group(proc.pid, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=KILL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+    # SIGKILL the group regardless: stragglers may ignore SIGTERM after the leader exited
+    kill_process_group(proc.pid)
+    await proc.wait()
+
+
+# ───────────────────────────────────────────────── runner
+@dataclass
+class ProcessResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+    truncated: bool = False
+    duration: float = 0.0
+
+
+async def run_process(
+    cmd: list[str],
+    *,
+    timeout: float,
+    on_line: Optional[OnLine] = None,
+    env: Optional[dict] = None,
+    cwd: Optional[str] = None,
+    stdin_data: Optional[bytes] = None,
+    head_chars: int = OUTPUT_HEAD_CHARS,
+    tail_chars: int = OUTPUT_TAIL_CHARS,
+) -> ProcessResult:
+    """
+    Runs `cmd` to completion (or `timeout` seconds). Raises FileNotFoundError /
+    PermissionError like subprocess does when `cmd[0]` cannot be started.
+    """
+    start = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        cwd=cwd,
+        start_new_session=True,
+    )
+    out_buf = OutputBuffer(head_chars, tail_chars)
+    err_buf = OutputBuffer(head_chars, tail_chars)
+
+    async def communicate():
+        if stdin_data is not None:
+            proc.stdin.write(stdin_data)
+            await proc.stdin.drain()
+            proc.stdin.close()
+        await asyncio.gather(
+            pump_lines(proc.stdout, "stdout", out_buf, on_line),
+            pump_lines(proc.stderr, "stderr", err_buf, on_line),
+        )
+        return await proc.wait()
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        await _terminate(proc)
+    except BaseException:
+        # cancelled (client disconnected) or the callback failed
+        await asyncio.shield(_terminate(proc))
+        raise
+
+    return ProcessResult(
+        returncode=proc.returncode,
+        stdout=out_buf.text(),
+        stderr=err_buf.text(),
+        timed_out=timed_out,
+        truncated=out_buf.truncated or err_buf.truncated,
+        duration=time.monotonic() - start,
+    )
+
+
+# ───────────────────────────────────────────────── live output to the client
+class WebSocketLineSink:
+    """
+    `on_line` callback that forwards output lines to the WebSocket as
+    "Agent Output (<label>):" frames, batched every LINE_FLUSH_SECONDS so a
+    chatty process cannot flood the client. Call `flush()` when done.
+    """
+
+    def __init__(self, websocket, label: str, streams: tuple[str, ...] = ("stdout", "stderr")):
+        self.websocket = websocket
+        self.label = label
+        self.streams = streams
+        self._pending: list[str] = []
+        self._timer: asyncio.Task | None = None
+
+    async def __call__(self, stream: str, line: str):
+        if stream not in self.streams:
+            return
+        if len(line) > SINK_MAX_LINE:
+            line = line[:SINK_MAX_LINE] + " …"
+        self._pending.append(line if stream == "stdout" else f"[{stream}] {line}")
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(LINE_FLUSH_SECONDS)
+        self._timer = None
+        await self._send()
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self._send()
+
+    async def _send(self):
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        if len(lines) > SINK_MAX_BATCH:
+            skipped = len(lines) - SINK_MAX_BATCH
+            lines = lines[:SINK_MAX_BATCH // 2] + [f"… ({skipped} lines) …"] + lines[-SINK_MAX_BATCH // 2:]
+        try:
+            await self.websocket.send_text(f"Agent Output ({self.label}):\n" + "\n".join(lines))
+        except Exception:
+            pass   # client gone; output is still kept in the result
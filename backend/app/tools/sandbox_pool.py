@@ -0,0 +1,219 @@
+"""
+sandbox_pool.py
+───────────────
+Warm Python sandboxes for `code_interpreter`.
+
+A multiprocessing *forkserver* acts as the zygote: it is a clean Python
+process (not a fork of the web server) that imports SANDBOX_PRELOAD once
+(numpy, pandas, … – whatever is installed). Every snippet then runs in a
+fresh fork of it, so imports are already paid for and copy-on-write keeps
+snippets isolated from each other.
+
+The snippet source reaches the child over a pipe – nothing is written to
+disk. stdout/stderr come back over socketpairs and are read line by line
+(see process_runner), so output can be streamed while it runs. Each run gets an RLIMIT_CPU
+budget and is killed (whole process group) when it exceeds its wall-clock
+timeout or its resident memory passes SANDBOX_MAX_RSS_MB. At most
+SANDBOX_POOL_SIZE snippets run at once.
+
+Public API
+----------
+    SANDBOX_ENABLED                               bool
+    await run_snippet(code, timeout, on_line=None) -> SandboxResult
+    await prewarm()                               start the zygote early
+"""
+
+from __future__ import annotations
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from dataclasses import dataclass
+
+from ..metrics import span
+from .process_runner import OnLine, OutputBuffer, kill_process_group, pump_lines, tree_rss_mb
+
+SANDBOX_PRELOAD     = [m.strip() for m in os.getenv("SANDBOX_PRELOAD", "numpy,pandas").split(",") if m.strip()]
+SANDBOX_POOL_SIZE   = int(os.getenv("SANDBOX_POOL_SIZE", "4"))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "30"))
+SANDBOX_MAX_RSS_MB  = float(os.getenv("SANDBOX_MAX_RSS_MB", "1024"))
+RSS_POLL_SECONDS    = 0.25
+
+SANDBOX_ENABLED = (
+    os.getenv("SANDBOX_POOL", "1") != "0"
+    and "forkserver" in multiprocessing.get_all_start_methods()
+)
+
+_ctx = multiprocessing.get_context("forkserver") if SANDBOX_ENABLED else None
+_zygote_lock = threading.Lock()
+_slots = asyncio.Semaphore(max(1, SANDBOX_POOL_SIZE))
+
+
+def _ensure_zygote() -> None:
+    """
+    Starts the fork server unless it is running (blocking: run in a thread).
+    It preloads sandbox_zygote – which spares each fork the re-import of
+    this process's __main__ – then this module, so the fork target is
+    already imported, then SANDBOX_PRELOAD.
+    """
+    from multiprocessing import forkserver
+    with _zygote_lock:
+        _ctx.set_forkserver_preload([f"{__package__}.sandbox_zygote", __name__] + SANDBOX_PRELOAD)
+        forkserver.ensure_running()
+
+def _start(proc) -> None:
+    _ensure_zygote()                             # (re)starts it if it is not running
+    proc.start()
+
+
+@dataclass
+class SandboxResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+    killed_reason: str | None = None   # "timeout" | "memory" | "cpu" | None
+
+
+# ───────────────────────────────────────────────── child side
+def _sandbox_main(code_conn, out_sock, err_sock, cpu_seconds: int):
+    """Runs inside the fresh fork: wire up stdio, apply limits, exec the snippet."""
+    import builtins, importlib, linecache, resource, sys, traceback
+
+    os.setsid()                                  # own group → killpg reaches children
+    os.dup2(out_sock.fileno(), 1)
+    os.dup2(err_sock.fileno(), 2)
+    out_sock.close()
+    err_sock.close()
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+
+    if cpu_seconds > 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+
+    code = code_conn.recv_bytes().decode("utf-8")
+    code_conn.close()
+
+    filename = "<snippet>"
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+    importlib.invalidate_caches()                # see packages installed after the fork server started
+
+    status = 0
+    try:
+        exec(compile(code, filename, "exec"), {"__name__": "__main__", "__builtins__": builtins})
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException as e:
+        # skip this frame so the traceback starts at the snippet, like `python script.py`
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+    os._exit(status)
+
+
+# ───────────────────────────────────────────────── parent side
+async def _read_lines(sock: socket.socket, stream: str, buffer: OutputBuffer,
+                     on_line: OnLine | None) -> None:
+    reader, writer = await asyncio.open_connection(sock=sock)
+    try:
+        await pump_lines(reader, stream, buffer, on_line)
+    finally:
+        writer.close()
+
+async def _wait_exit(proc) -> None:
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    loop.add_reader(proc.sentinel, lambda: done.done() or done.set_result(None))
+    try:
+        await done
+    finally:
+        loop.remove_reader(proc.sentinel)
+
+async def _watch_memory(pid: int, limit_mb: float) -> None:
+    while True:
+        await asyncio.sleep(RSS_POLL_SECONDS)
+        if tree_rss_mb(pid) > limit_mb:
+            return
+
+async def prewarm():
+    """Starts the zygote (and its preload imports) ahead of the first snippet."""
+    if _ctx is None:
+        return
+    try:
+        await asyncio.to_thread(_ensure_zygote)
+    except Exception as e:
+        print(f"[sandbox] fork server warm-up failed: {e}")
+
+async def run_snippet(code: str, timeout: float, on_line: OnLine | None = None) -> SandboxResult:
+    """Executes `code` in a fresh fork of the warm zygote."""
+    async with _slots:
+        out_r, out_w = socket.socketpair()
+        err_r, err_w = socket.socketpair()
+        code_r, code_w = _ctx.Pipe(duplex=False)
+        proc = _ctx.Process(
+            target=_sandbox_main,
+            args=(code_r, out_w, err_w, SANDBOX_CPU_SECONDS),
+            daemon=True,
+        )
+        try:
+            # first start blocks until the zygote has finished its imports
+            with span("sandbox_start"):
+                await asyncio.to_thread(_start, proc)
+        finally:
+            for end in (out_w, err_w, code_r):
+                end.close()
+
+        killed_reason = None
+        out_buf, err_buf = OutputBuffer(), OutputBuffer()
+        try:
+            await asyncio.to_thread(code_w.send_bytes, code.encode("utf-8"))
+            code_w.close()
+
+            run = asyncio.gather(
+                _read_lines(out_r, "stdout", out_buf, on_line),
+                _read_lines(err_r, "stderr", err_buf, on_line),
+                _wait_exit(proc),
+            )
+            memory = asyncio.create_task(_watch_memory(proc.pid, SANDBOX_MAX_RSS_MB))
+            try:
+                done, _ = await asyncio.wait({run, memory}, timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if run not in done:
+                    killed_reason = "memory" if memory in done else "timeout"
+                    kill_process_group(proc.pid)
+                await run
+            finally:
+                memory.cancel()
+        except BaseException:
+            kill_process_group(proc.pid)           # cancelled (client gone) or failed
+            raise
+        finally:
+            if not code_w.closed:
+                code_w.close()
+            await asyncio.to_thread(proc.join, 5)
+
+        stdout, stderr = out_buf.text(), err_buf.text()
+        returncode = proc.exitcode if proc.exitcode is not None else -signal.SIGKILL
+        if returncode == -signal.SIGXCPU:
+            killed_reason = killed_reason or "cpu"
+            stderr += f"\nCPU time limit exceeded ({SANDBOX_CPU_SECONDS}s)."
+        return SandboxResult(
+            returncode=returncode,
+            stdout=stdout,
+            stderr=stderr,
+            timed_out=killed_reason == "timeout",
+            killed_reason=killed_reason,
+        )
@@ -0,0 +1,42 @@
+"""
+sandbox_zygote.py
+─────────────────
+Imported by the sandbox fork server (the zygote, see sandbox_pool) as its
+first preload – the web server itself never imports it.
+
+Every fork is told to re-import the parent's __main__ (the uvicorn
+launcher, a script, …) before running its target – a per-snippet import
+the zygote exists to avoid, and the forkserver's own "__main__" preload
+does not work on CPython < 3.14. The fork's preparation data already names
+that __main__ ("init_main_from_name" / "init_main_from_path"), so the
+zygote wraps multiprocessing.spawn.prepare: each fork first installs a
+stand-in __main__ carrying that identity, which makes the fix-up a no-op.
+Snippets get their own globals anyway. Nothing is handed over through the
+environment, so the web server never touches os.environ for it.
+"""
+
+from __future__ import annotations
+import importlib.machinery
+import sys
+import types
+from multiprocessing import spawn
+
+
+def adopt_parent_main(data: dict) -> None:
+    """Installs a __main__ that already matches what `data` asks the fork to import."""
+    stand_in = types.ModuleType("__main__")
+    if "init_main_from_name" in data:
+        stand_in.__spec__ = importlib.machinery.ModuleSpec(data["init_main_from_name"], None)
+    elif "init_main_from_path" in data:
+        stand_in.__file__ = data["init_main_from_path"]
+    else:
+        return
+    sys.modules["__main__"] = stand_in
+
+
+def _prepare(data: dict, _prepare=spawn.prepare) -> None:
+    adopt_parent_main(data)
+    _prepare(data)
+
+
+spawn.prepare = _prepare                     # runs in each fork, before its target is unpickled
@@ -1,8 +1,9 @@
-import subprocess
 import shlex
-import asyncio
 import traceback
 
+from .process_runner import WebSocketLineSink, run_process
+from .tool_result import ToolResult
+
 # Whitelist expanded to permit pip/python for runtime installs
 ALLOWED_COMMANDS = {
     'ls', 'pwd', 'echo', 'cat', 'grep', 'mkdir', 'rmdir',
@@ -11,7 +12,7 @@ ALLOWED_COMMANDS = {
 }
 TIMEOUT_SECONDS = 15
 
-async def execute_shell_command(full_command: str, websocket) -> str:
+async def execute_shell_command(full_command: str, websocket) -> ToolResult:
     """
     Safely execute whitelisted shell commands (including pip/python).
     """
@@ -25,18 +26,18 @@ async def execute_shell_command(full_command: str, websocket) -> str:
         err = f"Error parsing command: {e}"
         await websocket.send_text(f"Agent Error: {err}")
         print(err)
-        return err
+        return ToolResult.error("invalid_command", err)
 
     if not cmd_parts:
         await websocket.send_text("Agent Error: Empty command.")
-        return "Error: Empty command."
+        return ToolResult.error("invalid_command", "Error: Empty command.")
 
     cmd, args = cmd_parts[0], cmd_parts[1:]
     if cmd not in ALLOWED_COMMANDS:
         err = f"Error: Command '{cmd}' not allowed."
         await websocket.send_text(f"Agent Error: {err}")
         print(err)
-        return err
+        return ToolResult.error("not_allowed", err)
 
     # 2) Sanitize args
     for arg in args:
@@ -45,7 +46,7 @@ async def execute_shell_command(full_command: str, websocket) -> str:
                 err = f"Error: Unsafe argument '{arg}'"
                 await websocket.send_text(f"Agent Error: {err}")
                 print(err)
-                return err
+                return ToolResult.error("unsafe_argument", err)
 
     # 3) Execute
     try:
@@ -53,52 +54,39 @@ async def execute_shell_command(full_command: str, websocket) -> str:
         await websocket.send_text(f"Agent: Running: {' '.join(cmd_exec)}")
         print(f"Executing: {cmd_exec}")
 
-        loop = asyncio.get_running_loop()
-        proc = await loop.run_in_executor(
-            None,
-            lambda: subprocess.run(
-                cmd_exec,
-                capture_output=True,
-                text=True,
-                timeout=TIMEOUT_SECONDS,
-                shell=False
-            )
-        )
+        sink = WebSocketLineSink(websocket, "shell")
+        try:
+            proc = await run_process(cmd_exec, timeout=TIMEOUT_SECONDS, on_line=sink)
+        finally:
+            await sink.flush()
+
+        if proc.timed_out:
+            tm_err = f"Error: Timeout after {TIMEOUT_SECONDS}s."
+            await websocket.send_text(f"Agent Error: {tm_err}")
+            print(tm_err)
+            return ToolResult.timeout(tm_err)
 
         code = proc.returncode
-        out, err_out = proc.stdout or "", proc.stderr or ""
         print(f"Shell finished: exit={code}")
 
-        result = f"Exit Code: {code}\n"
-        if out:
-            result += f"Output:\n{out}\n"
-        if err_out:
-            result += f"Errors:\n{err_out}\n"
-
         await websocket.send_text(f"Agent: Shell finished (Exit: {code}).")
-        return result.strip()
-
-    except subprocess.TimeoutExpired:
-        tm_err = f"Error: Timeout after {TIMEOUT_SECONDS}s."
-        await websocket.send_text(f"Agent Error: {tm_err}")
-        print(tm_err)
-        return tm_err
+        return ToolResult.from_process(code, proc.stdout, proc.stderr)
 
     except FileNotFoundError:
         not_found = f"Error: Command '{cmd}' not found."
         await websocket.send_text(f"Agent Error: {not_found}")
         print(not_found)
-        return not_found
+        return ToolResult.error("not_found", not_found)
 
     except PermissionError as e:
         perm_err = f"Error: Permission denied for '{cmd}': {e}"
         await websocket.send_text(f"Agent Error: {perm_err}")
         print(perm_err)
-        return perm_err
+        return ToolResult.error("permission", perm_err)
 
     except Exception as e:
         exc = f"Error executing shell '{full_command}': {e}"
         await websocket.send_text(f"Agent Error: {exc}")
         print(exc)
         traceback.print_exc()
-        return exc
+        return ToolResult.error("exception", exc)
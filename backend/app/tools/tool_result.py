@@ -0,0 +1,109 @@
+"""
+tool_result.py
+──────────────
+The structured result every tool returns.
+
+A `ToolResult` carries what the run actually produced – exit code,
+stdout, stderr, whether it timed out – plus an `error_kind` decided by
+the tool itself (or by `classify_exit` for a finished process), so the
+agent never has to guess success from words in the output. `str(result)`
+renders the text the UI, the caches and the LLM prompts have always seen:
+
+    Exit Code: 0
+    Output:
+    …
+    Errors:
+    …
+
+Results without a process (validation errors, browser answers) carry
+their text in `message` instead.
+
+Error kinds
+-----------
+  timeout           the run hit its time limit
+  nonzero_exit      the process failed (exit code ≠ 0), nothing more specific
+  missing_module    ModuleNotFoundError in stderr
+  syntax_error      SyntaxError / IndentationError in stderr
+  resource_limit    killed by the sandbox (memory / CPU)
+  not_allowed       shell command outside the whitelist
+  unsafe_argument   shell argument with metacharacters
+  invalid_command   empty or unparsable command
+  not_found         executable / interpreter not found
+  permission        permission denied
+  unknown_tool      the plan named a tool that does not exist
+  tool_error        any other tool failure ("Error: …" text, browser errors)
+  exception         unexpected exception inside the tool
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+
+
+@dataclass
+class ToolResult:
+    exit_code: int | None = None      # None: no process ran (or its code is unknown)
+    stdout: str = ""
+    stderr: str = ""
+    timed_out: bool = False
+    error_kind: str | None = None     # None = success
+    message: str = ""                 # text of a result without process output
+    label: str = "Exit Code"          # "After install -> Exit Code" for a retried run
+
+    @property
+    def ok(self) -> bool:
+        return self.error_kind is None
+
+    @property
+    def text(self) -> str:
+        if self.exit_code is None:
+            return self.message
+        result = f"{self.label}: {self.exit_code}\n"
+        if self.stdout:
+            result += f"Output:\n{self.stdout}\n"
+        if self.stderr:
+            result += f"Errors:\n{self.stderr}\n"
+        return result.strip()
+
+    def __str__(self) -> str:
+        return self.text
+
+    # ─── constructors ───────────────────────────────────────────
+    @classmethod
+    def from_process(cls, exit_code: int, stdout: str, stderr: str,
+                     label: str = "Exit Code", killed: str | None = None) -> "ToolResult":
+        return cls(exit_code=exit_code, stdout=stdout, stderr=stderr, label=label,
+                   error_kind=classify_exit(exit_code, stderr, killed))
+
+    @classmethod
+    def error(cls, kind: str, message: str, *, timed_out: bool = False) -> "ToolResult":
+        return cls(error_kind=kind, message=message, timed_out=timed_out)
+
+    @classmethod
+    def timeout(cls, message: str) -> "ToolResult":
+        return cls(error_kind="timeout", message=message, timed_out=True)
+
+    @classmethod
+    def from_text(cls, text: str) -> "ToolResult":
+        """Result of a tool (or cache entry) that only produced text."""
+        text = text or ""
+        if text.startswith(("Exit Code: ", "After install -> Exit Code: ")):
+            code = text.split(": ", 1)[1].split("\n", 1)[0].strip()
+            return cls(message=text, error_kind=None if code == "0" else "nonzero_exit")
+        return cls(message=text, error_kind="tool_error" if text.startswith("Error") else None)
+
+    @classmethod
+    def coerce(cls, value) -> "ToolResult":
+        return value if isinstance(value, ToolResult) else cls.from_text(str(value))
+
+
+def classify_exit(exit_code: int, stderr: str, killed: str | None = None) -> str | None:
+    """Error kind of a finished process, or None when it succeeded."""
+    if exit_code == 0:
+        return None
+    if killed:
+        return "resource_limit"
+    if "ModuleNotFoundError: No module named" in stderr:
+        return "missing_module"
+    if "SyntaxError:" in stderr or "IndentationError:" in stderr:
+        return "syntax_error"
+    return "nonzero_exit"
@@ -3,6 +3,13 @@
    ❶  Waits for DOMContentLoaded                 (fixes empty UI)
    ❷  Fetches /api/models and populates three <select>s
    ❸  Sends chosen models in every WebSocket message
+   ❹  Renders streamed LLM output ("Agent Stream:" frames) inline
+   ❺  "Bypass LLM cache" checkbox → bypass_cache flag per request
+   ❻  "Cancel" button → {"type": "cancel"} stops the running workflow
+   ❼  Server frames are typed JSON events (message / stream / log /
+       tasks / batch); task deltas keyed by step id update #taskList
+   ❽  The running workflow's id is kept per tab; after a reconnect
+       (server restart, page reload) {"type": "resume"} continues it
 ----------------------------------------------------------------*/
 document.addEventListener("DOMContentLoaded", () => {
     /* ─── grab DOM handles ──────────────────────────────────── */
@@ -12,7 +19,23 @@ document.addEventListener("DOMContentLoaded", () => {
     const chat = $("chatHistory");
     const tasks= $("taskList");
     const plannerSel = $("modelSelect");          // already in markup
-    let browserSel, codeSel;                      // injected later
+    let browserSel;                               // injected later
+
+    /* ─── cache bypass toggle ───────────────────────────────── */
+    const bypassWrap  = document.createElement("div");
+    const bypassLabel = document.createElement("label");
+    const bypassBox   = document.createElement("input");
+    bypassBox.type = "checkbox";
+    bypassBox.id   = "bypassCache";
+    bypassLabel.append(bypassBox, " Bypass LLM cache");
+    bypassWrap.appendChild(bypassLabel);
+    plannerSel.parentNode.appendChild(bypassWrap);
+
+    /* ─── cancel button (a new query also cancels the running one) ─ */
+    const cancelBtn = document.createElement("button");
+    cancelBtn.id = "cancelButton";
+    cancelBtn.textContent = "Cancel";
+    send.parentNode.appendChild(cancelBtn);
   
     /* ─── populate model dropdowns ───────────────────────────── */
     const makeSelect = (id, labelTxt, models) => {
@@ -43,7 +66,6 @@ document.addEventListener("DOMContentLoaded", () => {
           plannerSel.appendChild(o);
         });
         browserSel = makeSelect("browserModelSelect", "Browser LLM", models);
-        codeSel    = makeSelect("codeModelSelect",    "Code LLM",    models);
       })
       .catch((e) => {
         console.error("model load failed", e);
@@ -58,11 +80,65 @@ document.addEventListener("DOMContentLoaded", () => {
     const wsProto = location.protocol === "https:" ? "wss:" : "ws:";
     const wsURL   = `${wsProto}//${location.hostname}:8000/ws`;
     let ws;
+    let streaming = false;                        // inside a run of stream text
+    let taskState = [];                           // [{description, status}] by step id
+
+    const line = (text) => {
+      chat.append((streaming ? "\n" : "") + text + "\n");
+      streaming = false;
+    };
+
+    const renderTasks = () => {
+      tasks.replaceChildren(...taskState.map((t, i) => {
+        const p = document.createElement("p");
+        p.className = `task status-${t.status}`;
+        p.textContent = `${i + 1}. [${t.status}] ${t.description}`;
+        return p;
+      }));
+    };
+
+    const onEvent = (ev) => {
+      switch (ev.type) {
+        case "batch":
+          ev.events.forEach(onEvent);
+          break;
+        case "stream":
+          chat.append(ev.text);
+          streaming = true;
+          break;
+        case "log":
+          line(`[${ev.source}]\n${ev.lines.join("\n")}`);
+          break;
+        case "workflow":                          // started / resumed / finished
+          if (ev.state === "finished") sessionStorage.removeItem("workflowId");
+          else sessionStorage.setItem("workflowId", ev.id);
+          line(ev.text);
+          break;
+        case "tasks":
+          if (ev.reset) taskState = [];
+          ev.changed.forEach((t) => { taskState[t.id] = {description: t.description, status: t.status}; });
+          taskState.length = ev.total;
+          renderTasks();
+          break;
+        default:                                  // "message"
+          line(ev.text);
+      }
+    };
+
+    const onMessage = ({data}) => {
+      let ev;
+      try { ev = JSON.parse(data); } catch { ev = null; }
+      onEvent(ev && ev.type ? ev : {type: "message", text: data});   // plain text: older server
+    };
   
     const connect = () => {
       ws = new WebSocket(wsURL);
-      ws.onopen    = () => chat.append("✓ connected\n");
-      ws.onmessage = ({data}) => chat.append(data + "\n");
+      ws.onopen    = () => {
+        chat.append("✓ connected\n");
+        const unfinished = sessionStorage.getItem("workflowId");
+        if (unfinished) ws.send(JSON.stringify({type: "resume", workflow_id: unfinished}));
+      };
+      ws.onmessage = onMessage;
       ws.onclose   = () => setTimeout(connect, 3000);
     };
     connect();
@@ -74,13 +150,16 @@ document.addEventListener("DOMContentLoaded", () => {
         query:         inp.value.trim(),
         planner_model: plannerSel.value,
         browser_model: browserSel ? browserSel.value : plannerSel.value,
-        code_model:    codeSel    ? codeSel.value    : plannerSel.value,
+        bypass_cache:  bypassBox.checked,
       };
       ws.send(JSON.stringify(payload));
       inp.value = "";
     };
   
     send.onclick = push;
+    cancelBtn.onclick = () => {
+      if (ws && ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({type: "cancel"}));
+    };
     inp.addEventListener("keypress", (e) => {
       if (e.key === "Enter" && !e.shiftKey) { e.preventDefault(); push(); }
     });
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+bench_plan_parser.py
+────────────────────
+Microbenchmark: incremental plan parser vs. the old regex + repair_json
+path, over the plan corpus in corpus/plans.jsonl (real-looking and
+deliberately broken planner outputs).
+
+    python benchmarks/bench_plan_parser.py [--rounds 200] [--chunk 8] [--tok-s 30]
+
+For every corpus entry it reports the mean time per parse for
+  legacy   – strip fences, repair_json(whole), json.loads (old parse_plan)
+  legacy/s – the old planner stream: `--chunk`-sized pieces collected,
+             then legacy on the joined text
+  full     – parse_plan_text() on the complete string
+  stream   – PlanStreamParser fed `--chunk`-sized pieces, as the planner
+             stream does, plus close()
+and how many tasks each one recovered.
+
+A second table gives what the agent actually waits for: the time from the
+first streamed token until the first task can start, with one `--chunk`
+piece arriving every 1/`--tok-s` seconds. The old stream had to wait for
+the whole answer; the incremental parser hands out step 1 once its `}`
+arrives.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from app.plan_parser import PlanStreamParser, parse_plan_text, repair_json  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus", "plans.jsonl")
+
+
+# ───────────────────────────────────────────────── contenders
+def legacy_parse(text: str) -> list:
+    """The pre-incremental parse_plan: fence regex, repair, loads, fallback loads."""
+    cleaned = re.sub(r'^```json\s*|\s*```$', '', text, flags=re.MULTILINE | re.DOTALL).strip()
+    try:
+        plan = json.loads(repair_json(cleaned))
+    except Exception:
+        plan = json.loads(cleaned)
+    if isinstance(plan, dict):
+        plan = [plan]
+    return [t for t in plan if isinstance(t, dict) and "tool" in t]
+
+def make_legacy_stream_parse(chunk: int):
+    def legacy_stream_parse(text: str) -> list:
+        pieces = []
+        for i in range(0, len(text), chunk):
+            pieces.append(text[i:i + chunk])
+        return legacy_parse("".join(pieces))
+    return legacy_stream_parse
+
+def full_parse(text: str) -> list:
+    return parse_plan_text(text)
+
+def make_stream_parse(chunk: int):
+    def stream_parse(text: str) -> list:
+        parser = PlanStreamParser()
+        tasks = []
+        for i in range(0, len(text), chunk):
+            tasks.extend(parser.feed(text[i:i + chunk]))
+        return tasks + parser.close()
+    return stream_parse
+
+
+def first_task_ms(text: str, chunk: int, tok_s: float) -> tuple[float | None, float | None]:
+    """(legacy/s, stream): ms from the first piece until the first task is available."""
+    pieces = [text[i:i + chunk] for i in range(0, len(text), chunk)]
+    gap = 1000.0 / tok_s
+    start = time.perf_counter()
+    try:
+        legacy = (len(pieces) - 1) * gap + (time.perf_counter() - start) * 1e3 if legacy_parse(text) else None
+    except Exception:
+        legacy = None
+    parser = PlanStreamParser()
+    for k, piece in enumerate(pieces):
+        start = time.perf_counter()
+        try:
+            tasks = parser.feed(piece)
+        except Exception:
+            return legacy, None
+        if tasks:
+            return legacy, k * gap + (time.perf_counter() - start) * 1e3
+    start = time.perf_counter()
+    try:
+        tasks = parser.close()
+    except Exception:
+        tasks = []
+    return legacy, (len(pieces) - 1) * gap + (time.perf_counter() - start) * 1e3 if tasks else None
+
+
+# ───────────────────────────────────────────────── runner
+def _time(fn, text: str, rounds: int):
+    try:
+        n_tasks = len(fn(text))
+    except Exception:
+        return None, "ERR"
+    start = time.perf_counter()
+    for _ in range(rounds):
+        try:
+            fn(text)
+        except Exception:
+            pass
+    return (time.perf_counter() - start) / rounds * 1e6, n_tasks
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rounds", type=int, default=200)
+    ap.add_argument("--chunk", type=int, default=8, help="stream chunk size in characters")
+    ap.add_argument("--tok-s", type=float, default=30, help="streamed chunks per second (first-task table)")
+    args = ap.parse_args()
+
+    with open(CORPUS, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    contenders = [
+        ("legacy", legacy_parse),
+        ("legacy/s", make_legacy_stream_parse(args.chunk)),
+        ("full", full_parse),
+        ("stream", make_stream_parse(args.chunk)),
+    ]
+    totals = {name: 0.0 for name, _ in contenders}
+
+    print(f"{'entry':<24}{'chars':>7}  " + "".join(f"{n + ' µs':>12}{'tasks':>7}" for n, _ in contenders))
+    for entry in corpus:
+        row = f"{entry['name'] + ('*' if entry['broken'] else ''):<24}{len(entry['text']):>7}  "
+        for name, fn in contenders:
+            us, n_tasks = _time(fn, entry["text"], args.rounds)
+            if us is not None:
+                totals[name] += us
+            row += f"{('%.1f' % us) if us is not None else '-':>12}{n_tasks:>7}"
+        print(row)
+
+    print("-" * 80)
+    print(f"{'total (µs / corpus pass)':<33}" + "".join(f"{totals[n]:>12.1f}{'':>7}" for n, _ in contenders))
+    print("* = deliberately malformed planner output")
+
+    print()
+    print(f"time to first task at {args.tok_s:g} chunks/s of {args.chunk} chars")
+    print(f"{'entry':<24}{'chunks':>7}{'legacy/s ms':>14}{'stream ms':>12}{'saved':>8}")
+    for entry in corpus:
+        legacy, stream = first_task_ms(entry["text"], args.chunk, args.tok_s)
+        saved = f"{max(0.0, 1 - stream / legacy):.0%}" if legacy and stream is not None else "-"
+        print(f"{entry['name'] + ('*' if entry['broken'] else ''):<24}"
+              f"{-(-len(entry['text']) // args.chunk):>7}"
+              f"{('%.0f' % legacy) if legacy is not None else '-':>14}"
+              f"{('%.0f' % stream) if stream is not None else '-':>12}{saved:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+bench_startup.py
+────────────────
+Start-up benchmark: how long until the backend can serve a request.
+
+    python benchmarks/bench_startup.py [--runs 5] [--serve] [--top 15]
+
+  import   – wall time of `import app.main` in a fresh interpreter
+             (what uvicorn pays on every start and every --reload)
+  top      – slowest modules by cumulative import time (-X importtime)
+  serve    – with --serve: launch uvicorn and time until GET /api/health
+             answers (200 or 503 – the server is up either way)
+
+Nothing here needs a running Ollama; model readiness is reported by
+/api/health separately and must not delay the numbers above.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _env() -> dict:
+    # keep the run free of side effects and warm-ups that are not under test
+    return {**os.environ, "PYTHONDONTWRITEBYTECODE": "1", "SANDBOX_POOL": "0", "BROWSER_POOL_SIZE": "0"}
+
+
+# ───────────────────────────────────────────────── import
+def time_import(runs: int) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import app.main"], cwd=BASE_DIR, env=_env(),
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+def top_imports(n: int) -> list[tuple[float, str]]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                          cwd=BASE_DIR, env=_env(), capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(.+)$", line)
+        if m:
+            rows.append((int(m.group(1)) / 1e6, m.group(2)))
+    # a package's cumulative time includes its children; keep the outermost ones
+    rows.sort(reverse=True)
+    return rows[:n]
+
+
+# ───────────────────────────────────────────────── serve
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def time_serve(timeout: float = 120.0) -> float | None:
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        cwd=BASE_DIR, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1)
+                return time.perf_counter() - start
+            except urllib.error.HTTPError:          # 503 "starting" still counts as up
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.05)
+        return None
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--serve", action="store_true", help="also time uvicorn start → first /api/health answer")
+    args = ap.parse_args()
+
+    times = time_import(args.runs)
+    print(f"import app.main   mean {statistics.mean(times) * 1000:8.1f} ms   "
+          f"min {min(times) * 1000:8.1f} ms   max {max(times) * 1000:8.1f} ms   ({args.runs} runs)")
+
+    print(f"\nslowest imports (cumulative):")
+    for seconds, name in top_imports(args.top):
+        print(f"  {seconds * 1000:8.1f} ms  {name.strip()}")
+
+    if args.serve:
+        ready = time_serve()
+        print(f"\nuvicorn → /api/health answering: "
+              + (f"{ready * 1000:.0f} ms" if ready is not None else "timed out"))
+
+
+if __name__ == "__main__":
+    main()
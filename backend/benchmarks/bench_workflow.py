@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+bench_workflow.py
+─────────────────
+End-to-end agent-loop benchmark, fully offline: `handle_agent_workflow`
+is driven through a fake WebSocket against mock_ollama.py, replaying the
+recorded plans in corpus/workflows.jsonl (shell, code and browser steps;
+the browser tool is replaced by a stub with a fixed latency).
+
+    python benchmarks/bench_workflow.py [--concurrency 1,2,4,8] [--runs 16]
+                                        [--first-token-ms 80] [--token-ms 5]
+                                        [--browser-ms 500] [--json out.json]
+                                        [--baseline old.json --tolerance 0.2]
+                                        [--replan off,on_failure,every_step]
+
+For every concurrency level, `--runs` workflows (corpus entries round
+robin) are run with at most that many in flight; the report shows
+p50 / p95 / max workflow latency, workflows per second, steps started
+and LLM calls per workflow, and failures. With --replan every level runs
+once per re-planning mode (SessionContext.replan), so the modes can be
+compared on the same corpus.
+With --baseline the run fails (exit 1) when p95 grows or throughput drops
+by more than --tolerance against a previous --json result.
+
+Shell and code steps really run (sandbox pool unless --no-sandbox); LLM
+and tool result caches are off unless --llm-cache is given, so repeated
+queries measure the loop rather than the cache. Workflow journals are
+written (to a temporary directory), as in production.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_ollama import MockOllama, load_corpus  # noqa: E402
+
+
+# ───────────────────────────────────────────────── fakes
+class FakeWebSocket:
+    """Collects what the agent would send to the browser."""
+
+    def __init__(self):
+        self.messages: list[str] = []
+
+    async def send_text(self, text: str):
+        self.messages.append(text)
+
+    async def send_json(self, data):
+        self.messages.append(json.dumps(data))
+
+    @property
+    def succeeded(self) -> bool:
+        return any("Workflow completed successfully" in m for m in self.messages)
+
+    @property
+    def steps_started(self) -> int:
+        return sum("Agent: Starting Step" in m for m in self.messages)
+
+
+def stub_browser(latency: float):
+    async def browse_website(instructions: str, websocket, **options) -> str:
+        await asyncio.sleep(latency)
+        return "Browser result: Python 3.13.0 is the latest stable release."
+    return browse_website
+
+
+# ───────────────────────────────────────────────── runner
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+async def run_level(agent, corpus: list[dict], concurrency: int, runs: int, model: str,
+                    replan: str | None = None, llm_calls=lambda: 0) -> dict:
+    from app.session import SessionContext   # imported once the env points at the mock
+    gate = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    failures: list[str] = []
+    steps: list[int] = []
+    calls_before = llm_calls()
+
+    async def one(i: int):
+        entry = corpus[i % len(corpus)]
+        async with gate:
+            ws = FakeWebSocket()
+            start = time.perf_counter()
+            ctx = SessionContext(planner_model=model, client=f"bench-{i % concurrency}")
+            if replan:
+                ctx.replan = replan
+            await agent.handle_agent_workflow(entry["query"], ctx, ws)
+            latencies.append(time.perf_counter() - start)
+            steps.append(ws.steps_started)
+            if not ws.succeeded:
+                failures.append(entry["name"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(runs)))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "replan": replan,
+        "runs": runs,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": max(latencies),
+        "throughput": runs / wall,
+        "steps": sum(steps) / runs,
+        "llm_calls": (llm_calls() - calls_before) / runs,
+        "failures": failures,
+    }
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["concurrency"], r.get("replan")): r for r in json.load(f)["levels"]}
+    problems = []
+    for r in results:
+        old = baseline.get((r["concurrency"], r.get("replan")))
+        if not old:
+            continue
+        level = f"c={r['concurrency']}" + (f" {r['replan']}" if r.get("replan") else "")
+        if r["p95"] > old["p95"] * (1 + tolerance):
+            problems.append(f"{level}: p95 {old['p95']:.3f}s → {r['p95']:.3f}s")
+        if r["throughput"] < old["throughput"] * (1 - tolerance):
+            problems.append(f"{level}: throughput {old['throughput']:.2f} → {r['throughput']:.2f} wf/s")
+    return problems
+
+
+async def bench(args, server: MockOllama) -> list[dict]:
+    # import after the environment points at the mock
+    from app import agent
+    from app.tools.sandbox_pool import SANDBOX_ENABLED, prewarm
+
+    agent.browse_website_impl = stub_browser(args.browser_ms / 1000)
+    if SANDBOX_ENABLED:
+        await prewarm()
+
+    corpus = load_corpus(args.corpus)
+    if args.only:
+        corpus = [e for e in corpus if e["name"] in args.only.split(",")]
+    # the agent logs every step to stdout; keep the table readable
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        await run_level(agent, corpus, 1, len(corpus), args.model)   # warm-up, not reported
+
+    def llm_calls() -> int:
+        return server.requests.get("/api/chat", 0)
+
+    results = []
+    for mode in args.replan.split(",") if args.replan else [None]:
+        for c in [int(x) for x in args.concurrency.split(",")]:
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with quiet:
+                results.append(await run_level(agent, corpus, c, args.runs, args.model, mode, llm_calls))
+            r = results[-1]
+            print(f"{mode or 'default':>12}{c:>6}{r['runs']:>6}{r['p50'] * 1000:>10.0f}{r['p95'] * 1000:>10.0f}"
+                  f"{r['max'] * 1000:>10.0f}{r['throughput']:>10.2f}{r['steps']:>8.1f}{r['llm_calls']:>8.1f}"
+                  f"{len(r['failures']):>8}")
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", default="1,2,4,8", help="comma-separated levels")
+    ap.add_argument("--runs", type=int, default=16, help="workflows per level")
+    ap.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "corpus", "workflows.jsonl"))
+    ap.add_argument("--only", help="comma-separated corpus entry names")
+    ap.add_argument("--model", default="mock-planner")
+    ap.add_argument("--first-token-ms", type=float, default=80)
+    ap.add_argument("--token-ms", type=float, default=5)
+    ap.add_argument("--chunk-chars", type=int, default=12)
+    ap.add_argument("--browser-ms", type=float, default=500, help="stub browser latency")
+    ap.add_argument("--no-sandbox", action="store_true", help="run code steps as plain subprocesses")
+    ap.add_argument("--llm-cache", action="store_true", help="keep the LLM response cache on")
+    ap.add_argument("--replan", help="comma-separated re-planning modes to compare (off, on_failure, every_step)")
+    ap.add_argument("--verbose", action="store_true", help="show the agent's own logging")
+    ap.add_argument("--json", help="write the results here")
+    ap.add_argument("--baseline", help="earlier --json output to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args()
+
+    server = MockOllama(load_corpus(args.corpus), first_token_ms=args.first_token_ms,
+                        token_ms=args.token_ms, chunk_chars=args.chunk_chars).start()
+    os.environ.update({
+        "OLLAMA_ENDPOINT": server.url,
+        "PLANNING_TOOLING_MODEL": args.model,
+        "LLM_CACHE": "1" if args.llm_cache else "0",
+        "TOOL_CACHE": "0",
+        "JOURNAL_DIR": tempfile.mkdtemp(prefix="bench-journal-"),   # journaling on, outside tasks/
+        "SANDBOX_POOL": "0" if args.no_sandbox else os.getenv("SANDBOX_POOL", "1"),
+    })
+    os.chdir(BASE_DIR)   # sandbox forks import `app` relative to the working directory
+
+    print(f"mock Ollama {server.url}: first token {args.first_token_ms:.0f} ms, "
+          f"{args.token_ms:.0f} ms / {args.chunk_chars}-char chunk; browser stub {args.browser_ms:.0f} ms\n")
+    print(f"{'replan':>12}{'conc':>6}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'wf/s':>10}"
+          f"{'steps':>8}{'llm':>8}{'failed':>8}")
+    try:
+        results = asyncio.run(bench(args, server))
+    finally:
+        server.stop()
+
+    failed = sorted({name for r in results for name in r["failures"]})
+    if failed:
+        print(f"\nworkflows that did not complete: {', '.join(failed)}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": results}, f, indent=2)
+    if args.baseline:
+        problems = compare(results, args.baseline, args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            sys.exit(1)
+        print(f"\nno regression beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+mock_ollama.py
+──────────────
+Local stand-in for the Ollama HTTP API with scripted answers and
+configurable latency, so workflows can be benchmarked without a GPU.
+
+    python benchmarks/mock_ollama.py [--port 11434] [--first-token-ms 80] …
+
+or, in-process (what bench_workflow.py does):
+
+    server = MockOllama(corpus, first_token_ms=80, token_ms=5).start()
+    os.environ["OLLAMA_ENDPOINT"] = server.url
+    …
+    server.stop()
+
+Scripted answers (from the workflow corpus, see corpus/workflows.jsonl)
+  planning prompt    "User request: '<query>'"  → the entry's `plan` as JSON
+  review prompt      "**Task:** <description>"  → the entry's correction for
+                                                  that step, else "null"
+  replan prompt      "Original request: '<query>'"
+                                               → after "**Failed step:** <description>"
+                                                  the entry's `replan` for that step,
+                                                  otherwise "KEEP"
+  anything else                                  → DEFAULT_ANSWER
+
+Endpoints: /api/chat (streamed or not), /api/generate, /api/show,
+/api/tags, /api/ps, /api/pull, /api/embed. Every model "exists".
+
+Latency: a response waits `first_token_ms`, then streams the answer in
+`chunk_chars` pieces `token_ms` apart; a non-streamed answer takes the
+same total time. `load_ms` is added once per model, as a cold load would.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = "OK."
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus", "workflows.jsonl")
+
+_QUERY_RE = re.compile(r"User request: '(.*?)'\n", re.DOTALL)
+_TASK_RE  = re.compile(r"\*\*Task:\*\* (.*)")
+_REPLAN_RE = re.compile(r"Original request: '(.*?)'\n", re.DOTALL)
+_FAILED_RE = re.compile(r"\*\*Failed step:\*\* (.*)")
+
+
+def load_corpus(path: str = CORPUS) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class MockOllama:
+    def __init__(self, corpus: list[dict], *, host: str = "127.0.0.1", port: int = 0,
+                 first_token_ms: float = 80, token_ms: float = 5, chunk_chars: int = 12,
+                 load_ms: float = 0):
+        self.plans = {entry["query"]: entry for entry in corpus}
+        self.corrections = {
+            desc: fix for entry in corpus for desc, fix in entry.get("corrections", {}).items()
+        }
+        self.first_token = first_token_ms / 1000
+        self.token_delay = token_ms / 1000
+        self.chunk_chars = max(1, chunk_chars)
+        self.load_seconds = load_ms / 1000
+        self.loaded: set[str] = set()
+        self.requests: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # ─── scripted answers ───────────────────────────────────────
+    def answer(self, messages: list[dict]) -> str:
+        prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        m = _QUERY_RE.search(prompt)
+        if m and m.group(1) in self.plans:
+            return json.dumps(self.plans[m.group(1)]["plan"])
+        m = _REPLAN_RE.search(prompt)
+        if m:
+            failed = _FAILED_RE.search(prompt)
+            revisions = self.plans.get(m.group(1), {}).get("replan", {})
+            if failed and failed.group(1).strip() in revisions:
+                return json.dumps(revisions[failed.group(1).strip()])
+            return "KEEP"
+        m = _TASK_RE.search(prompt)
+        if m:
+            fix = self.corrections.get(m.group(1).strip())
+            return json.dumps(fix) if fix else "null"
+        return DEFAULT_ANSWER
+
+    def _load_delay(self, model: str) -> float:
+        with self._lock:
+            if model in self.loaded:
+                return 0.0
+            self.loaded.add(model)
+        return self.load_seconds
+
+    def _count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    # ─── HTTP ───────────────────────────────────────────────────
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _body(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    return json.loads(raw or b"{}")
+                except ValueError:
+                    return {}
+
+            def _json(self, payload: dict, status: int = 200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, parts):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()                # HTTP/1.0: the body ends when we close
+                for part in parts:
+                    self.wfile.write((json.dumps(part) + "\n").encode())
+                    self.wfile.flush()
+
+            def do_GET(self):
+                mock._count(self.path)
+                if self.path == "/api/tags":
+                    models = [{"model": m, "name": m, "size": 0} for m in sorted(mock.loaded)]
+                    return self._json({"models": models})
+                if self.path == "/api/ps":
+                    models = [{"model": m, "name": m, "size_vram": 0} for m in sorted(mock.loaded)]
+                    return self._json({"models": models})
+                self._json({"error": "not found"}, 404)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.end_headers()
+
+            def do_POST(self):
+                mock._count(self.path)
+                body = self._body()
+                model = body.get("model") or body.get("name") or ""
+                if self.path == "/api/chat":
+                    return self._chat(model, body)
+                if self.path == "/api/generate":
+                    time.sleep(mock._load_delay(model))
+                    return self._json({"model": model, "response": "", "done": True})
+                if self.path == "/api/show":
+                    return self._json({"modelfile": "", "details": {"family": "mock"}, "model_info": {}})
+                if self.path == "/api/pull":
+                    if body.get("stream", True):
+                        return self._stream([{"status": "success"}])
+                    return self._json({"status": "success"})
+                if self.path == "/api/embed":
+                    texts = body.get("input") or [""]
+                    texts = [texts] if isinstance(texts, str) else texts
+                    return self._json({"model": model, "embeddings": [_embed(t) for t in texts]})
+                self._json({"error": "not found"}, 404)
+
+            def _chat(self, model: str, body: dict):
+                load = mock._load_delay(model)
+                text = mock.answer(body.get("messages") or [])
+                chunks = [text[i:i + mock.chunk_chars] for i in range(0, len(text), mock.chunk_chars)]
+                started = time.perf_counter()
+                time.sleep(load + mock.first_token)
+
+                def final(content: str) -> dict:
+                    return {
+                        "model": model, "done": True, "done_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                        "load_duration": int(load * 1e9),
+                        "prompt_eval_count": sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4,
+                        "eval_count": len(chunks),
+                        "eval_duration": int(max(len(chunks) * mock.token_delay, 1e-6) * 1e9),
+                        "total_duration": int((time.perf_counter() - started) * 1e9),
+                    }
+
+                if not body.get("stream", True):
+                    time.sleep(len(chunks) * mock.token_delay)
+                    return self._json(final(text))
+
+                def parts():
+                    for i, chunk in enumerate(chunks):
+                        if i:
+                            time.sleep(mock.token_delay)
+                        yield {"model": model, "done": False,
+                               "message": {"role": "assistant", "content": chunk}}
+                    yield final("")
+                try:
+                    self._stream(parts())
+                except (BrokenPipeError, ConnectionResetError):
+                    pass                           # client cancelled the stream
+
+        return Handler
+
+
+def _embed(text: str, dims: int = 16) -> list[float]:
+    """Deterministic bag-of-characters vector – enough for the semantic cache."""
+    vec = [0.0] * dims
+    for ch in text:
+        vec[ord(ch) % dims] += 1.0
+    return vec
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--corpus", default=CORPUS)
+    ap.add_argument("--first-token-ms", type=float, default=80)
+    ap.add_argument("--token-ms", type=float, default=5)
+    ap.add_argument("--chunk-chars", type=int, default=12)
+    ap.add_argument("--load-ms", type=float, default=0)
+    args = ap.parse_args()
+
+    server = MockOllama(load_corpus(args.corpus), host=args.host, port=args.port,
+                        first_token_ms=args.first_token_ms, token_ms=args.token_ms,
+                        chunk_chars=args.chunk_chars, load_ms=args.load_ms)
+    print(f"mock Ollama on {server.url} (Ctrl-C to stop)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ run_browser_task.py
 Executes Browser-Use’s Agent in isolation. Designed to be called
 by browseruse_integration.py in a separate process.
 
+One-shot mode
+-------------
 Input (argv[1]): JSON
     {
       "instructions": "<fully-formed prompt>",
@@ -15,6 +17,16 @@ Stdout: exactly one JSON object
     {"result": "..."} on success
     {"error":  "..."} on failure
 Exit code 0 iff "result" key is present.
+
+Worker mode  (argv: --worker <fd>)
+-----------
+Long-lived process used by app/tools/browser_pool.py. Imports stay loaded
+and one Chromium stays up; every task gets a fresh BrowserContext.
+<fd> is one end of a Unix socketpair carrying newline-delimited JSON:
+    → {"ready": true, "pid": 123}                       once, at start-up
+    ← {"id": 1, "instructions": "...", "model": "..."}  a task
+    → {"id": 1, "result": "..."} | {"id": 1, "error": "...", "recycle": bool}
+    ← {"op": "shutdown"}                                 or EOF → exit
 """
 
 from __future__ import annotations
@@ -22,6 +34,7 @@ import asyncio
 import json
 import logging
 import os
+import socket
 import sys
 import traceback
 from dotenv import load_dotenv
@@ -51,16 +64,21 @@ except ImportError as e:
     print(json.dumps({"error": str(e)}))
     sys.exit(1)
 
+DEFAULT_MODEL = os.getenv("BROWSER_AGENT_INTERNAL_MODEL", "qwen2.5:7b")
+MAX_MESSAGE = 16 * 1024 * 1024   # worker protocol line limit
+
+def _new_browser() -> Browser:
+    return Browser(config=BrowserConfig(headless=False, disable_security=True))
+
 # ───────────────────────────────────────────────── async core
-async def _run(instructions: str, model: str) -> dict:
+async def _run_task(browser: Browser, instructions: str, model: str) -> dict:
+    """Runs one task in a fresh, isolated context on `browser`."""
     # LLM
     try:
         llm = ChatOllama(model=model, base_url=OLLAMA, temperature=0.0)
     except Exception as e:
         return {"error": f"Init LLM '{model}' failed: {e}"}
 
-    # browser
-    browser = Browser(config=BrowserConfig(headless=False, disable_security=True))
     ctx = await browser.new_context(
         config=BrowserContextConfig(
             browser_window_size=BrowserContextWindowSize(width=1280, height=1024)
@@ -79,27 +97,83 @@ async def _run(instructions: str, model: str) -> dict:
         return {"error": "Browser task timed out inside subprocess."}
     except Exception as e:
         traceback.print_exc()
-        return {"error": f"Unexpected error: {e}"}
+        # the shared browser may be wedged – ask the pool for a fresh worker
+        return {"error": f"Unexpected error: {e}", "recycle": True}
     finally:
         try:
             await ctx.close()
+        except Exception:
+            pass
+
+async def _run(instructions: str, model: str) -> dict:
+    """One-shot mode: private browser for a single task."""
+    browser = _new_browser()
+    try:
+        return await _run_task(browser, instructions, model)
+    finally:
+        try:
             await browser.close()
         except Exception:
             pass
 
+# ───────────────────────────────────────────────── worker mode
+async def _serve(fd: int):
+    sock = socket.socket(fileno=fd)
+    reader, writer = await asyncio.open_unix_connection(sock=sock, limit=MAX_MESSAGE)
+
+    async def send(msg: dict):
+        writer.write((json.dumps(msg) + "\n").encode())
+        await writer.drain()
+
+    browser = _new_browser()
+    try:
+        # launch Chromium now so the first task does not pay for it
+        await browser.get_playwright_browser()
+    except Exception as e:
+        logging.error("Browser warm-up failed: %s", e)
+    await send({"ready": True, "pid": os.getpid()})
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break                        # parent went away
+            try:
+                req = json.loads(line)
+            except json.JSONDecodeError as e:
+                await send({"error": f"Bad request: {e}"})
+                continue
+            if req.get("op") == "shutdown":
+                break
+            logging.info("task %s started", req.get("id"))
+            res = await _run_task(
+                browser, req.get("instructions", ""), req.get("model") or DEFAULT_MODEL
+            )
+            res["id"] = req.get("id")
+            await send(res)
+            logging.info("task %s finished", req.get("id"))
+    finally:
+        try:
+            await browser.close()
+        except Exception:
+            pass
+        writer.close()
+
 # ───────────────────────────────────────────────── CLI glue
 def main():
     if len(sys.argv) < 2:
         print(json.dumps({"error": "no input"}))
         sys.exit(1)
 
+    if sys.argv[1] == "--worker":
+        asyncio.run(_serve(int(sys.argv[2])))
+        return
+
     # parse argv
     try:
         data = json.loads(sys.argv[1])
         instructions = data["instructions"]
-        model = data.get("model") or os.getenv(
-            "BROWSER_AGENT_INTERNAL_MODEL", "qwen2.5:7b"
-        )
+        model = data.get("model") or DEFAULT_MODEL
     except Exception as e:
         print(json.dumps({"error": f"Bad input: {e}"}))
         sys.exit(1)
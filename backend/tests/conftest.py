@@ -0,0 +1,55 @@
+import pytest
+
+
+class FakeWebSocket:
+    """Collects what the agent sends to the client."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+@pytest.fixture
+def websocket():
+    return FakeWebSocket()
+
+
+@pytest.fixture
+def mock_ollama(monkeypatch, tmp_path):
+    """benchmarks/mock_ollama.py serving llm_handler, with caches under tmp_path."""
+    import asyncio
+    import os
+    import sys
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks"))
+    from mock_ollama import MockOllama, load_corpus
+    from app import llm_handler
+    from app.cache import SQLiteLRUCache, SQLiteVectorIndex
+
+    server = MockOllama(load_corpus(), first_token_ms=20, token_ms=1).start()
+    monkeypatch.setattr(llm_handler, "OLLAMA", server.url)
+    monkeypatch.setattr(llm_handler, "_async_client", None)
+    monkeypatch.setattr(llm_handler, "_async_transport", None)
+    monkeypatch.setattr(llm_handler, "_llm_cache", SQLiteLRUCache(str(tmp_path / "llm.sqlite"), default_ttl=60))
+    monkeypatch.setattr(llm_handler, "_llm_vectors", SQLiteVectorIndex(str(tmp_path / "vectors.sqlite")))
+    monkeypatch.setattr(llm_handler, "_model_state", {})
+    monkeypatch.setattr(llm_handler, "_pulls", {})
+    monkeypatch.setattr(llm_handler, "RESIDENCY", llm_handler.ModelResidency())
+    yield server
+    asyncio.run(llm_handler.aclose())
+    server.stop()
+
+
+@pytest.fixture
+def journal_dir(monkeypatch, tmp_path):
+    """Workflow journals go to tmp_path instead of tasks/journal."""
+    from app import journal
+
+    path = tmp_path / "journal"
+    monkeypatch.setattr(journal, "JOURNAL_DIR", str(path))
+    return path
@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+from app import admission
+from app.admission import FairSemaphore, QueueFull, current_session
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """A FairSemaphore factory that keeps test instances out of the global stats."""
+    monkeypatch.setattr(admission, "SEMAPHORES", [])
+
+    def make(slots=1, max_queue=None):
+        return FairSemaphore("test", slots, max_queue)
+    return make
+
+
+async def _hold(sem, session, log, label, release):
+    async with sem.slot(session):
+        log.append(label)
+        await release.wait()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_sessions_are_served_round_robin(gate):
+    async def run():
+        sem, log, go = gate(1), [], asyncio.Event()
+        first = asyncio.create_task(_hold(sem, "a", log, "a0", go))
+        await _settle()
+        # "a" queues three more before "b" and "c" ask for one each
+        tasks = [asyncio.create_task(_hold(sem, s, log, label, go))
+                 for s, label in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1")]]
+        await _settle()
+        go.set()
+        await asyncio.gather(first, *tasks)
+        return log
+    assert asyncio.run(run()) == ["a0", "a1", "b1", "c1", "a2", "a3"]
+
+
+def test_free_slots_are_taken_without_queuing(gate):
+    async def run():
+        sem = gate(2)
+        await sem.acquire("a")
+        await sem.acquire("a")
+        return sem.stats()
+    assert asyncio.run(run()) == {"slots": 2, "active": 2, "queued": 0, "max_queue": None,
+                                  "sessions_waiting": 0}
+
+
+def test_full_queue_rejects_new_waiters(gate):
+    async def run():
+        sem = gate(1, max_queue=1)
+        await sem.acquire("a")
+        waiting = asyncio.create_task(sem.acquire("b"))
+        await _settle()
+        with pytest.raises(QueueFull) as exc:
+            await sem.acquire("c")
+        sem.release()
+        await waiting
+        return exc.value, sem
+    err, sem = asyncio.run(run())
+    assert err.queued == 1 and "test queue is full" in str(err)
+    assert sem.active == 1 and sem.queued == 0
+
+
+def test_cancelled_waiter_leaves_the_queue(gate):
+    async def run():
+        sem = gate(1)
+        await sem.acquire("a")
+        doomed = asyncio.create_task(sem.acquire("b"))
+        after = asyncio.create_task(sem.acquire("c"))
+        await _settle()
+        doomed.cancel()
+        await _settle()
+        assert sem.queued == 1
+        sem.release()
+        await after
+        return sem
+    sem = asyncio.run(run())
+    assert sem.active == 1 and sem.queued == 0
+
+
+def test_waiters_hear_their_position(gate):
+    async def run():
+        sem, updates = gate(1), {"b": [], "c": []}
+
+        def listener(name):
+            async def on_position(position, total):
+                updates[name].append((position, total))
+            return on_position
+
+        await sem.acquire("a")
+        b = asyncio.create_task(sem.acquire("b", listener("b")))
+        await _settle()
+        c = asyncio.create_task(sem.acquire("c", listener("c")))
+        await _settle()
+        sem.release()
+        await b
+        await _settle()
+        sem.release()
+        await c
+        return updates
+    updates = asyncio.run(run())
+    assert updates["b"] == [(1, 1)]
+    assert updates["c"] == [(2, 2), (1, 1)]
+
+
+def test_session_comes_from_the_context(gate):
+    async def run():
+        sem = gate(1)
+        await sem.acquire()
+        current_session.set("tab-1")
+        waiting = asyncio.create_task(sem.acquire())
+        await _settle()
+        sessions = list(sem._queues)
+        sem.release()
+        await waiting
+        return sessions
+    assert asyncio.run(run()) == ["tab-1"]
+
+
+def test_growing_the_gate_admits_waiters(gate):
+    async def run():
+        sem = gate(1)
+        await sem.acquire("a")
+        waiting = asyncio.create_task(sem.acquire("b"))
+        await _settle()
+        sem.resize(2)
+        await asyncio.wait_for(waiting, 1)
+        return sem.active
+    assert asyncio.run(run()) == 2
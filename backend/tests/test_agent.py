@@ -0,0 +1,189 @@
+import asyncio
+import json
+
+from app import agent
+from app.session import SessionContext
+from app.step_results import StepResultStore
+from app.tools.tool_result import ToolResult
+
+
+def _record_calls(monkeypatch, answer):
+    calls = []
+
+    def astream_prompt(model, prompt, system=None, **kwargs):
+        calls.append(kwargs)
+
+        async def tokens():
+            yield answer
+        return tokens()
+
+    async def asimple_prompt(model, prompt, system=None, **kwargs):
+        calls.append(kwargs)
+        return answer
+
+    monkeypatch.setattr(agent, "astream_prompt", astream_prompt)
+    monkeypatch.setattr(agent, "asimple_prompt", asimple_prompt)
+    return calls
+
+
+def test_planning_output_uses_the_session_cache_setting(monkeypatch, websocket):
+    calls = _record_calls(monkeypatch, "[]")
+    asyncio.run(agent.stream_planner_output("plan", websocket, use_cache=True, similar="q"))
+    assert calls == [{"cache": True, "similar": "q"}]
+
+
+def test_corrections_bypass_the_llm_cache(monkeypatch, websocket):
+    calls = _record_calls(monkeypatch, '{"tool": "shell_terminal", "command": ["ls"]}')
+    ctx = SessionContext(use_cache=True, max_retries=2)
+    task = {"tool": "shell_terminal", "command": ["lss"]}
+    fixed = asyncio.run(agent.review_and_resolve(task, ToolResult.error("not_found", "Error: not found"),
+                                                 0, websocket, ctx))
+    assert fixed["command"] == ["ls"]
+    assert [c["cache"] for c in calls] == [False]
+
+
+def test_plan_revisions_bypass_the_llm_cache(monkeypatch, websocket):
+    calls = _record_calls(monkeypatch, "KEEP")
+    ctx = SessionContext(use_cache=True)
+    tasks = [{"description": "list", "original_task": {"tool": "shell_terminal", "command": ["ls"]},
+              "result": None}]
+    revised = asyncio.run(agent.revise_plan("q", tasks, [0], None, StepResultStore(), websocket, ctx))
+    assert revised is None
+    assert [c["cache"] for c in calls] == [False]
+
+
+def test_streamed_tokens_reach_the_client_in_batches(monkeypatch, websocket):
+    monkeypatch.setattr(agent, "STREAM_FLUSH_SECONDS", 0.05)
+
+    def astream_prompt(model, prompt, system=None, **kwargs):
+        async def tokens():
+            for i in range(40):
+                await asyncio.sleep(0.005)
+                yield f"t{i} "
+        return tokens()
+    monkeypatch.setattr(agent, "astream_prompt", astream_prompt)
+    seen = []
+    text = asyncio.run(agent.stream_planner_output("p", websocket, seen.append, use_cache=False))
+    frames = [f for f in websocket.sent if f.startswith("Agent Stream:")]
+    assert text == "".join(f"t{i} " for i in range(40)) and len(seen) == 40
+    assert 1 < len(frames) < 40
+    assert "".join(f.removeprefix("Agent Stream:") for f in frames) == text
+
+
+def test_each_step_names_the_model_it_will_load():
+    ctx = SessionContext(planner_model="planner", browser_model="browser")
+    assert agent.model_for_step({"tool": "browser"}, ctx) == "browser"
+    assert agent.model_for_step({"tool": "shell_terminal"}, ctx) == "planner"
+    assert agent.model_for_step({"tool": "code_interpreter"}, ctx) == "planner"
+    assert agent.model_for_step({"tool": "unknown"}, ctx) is None
+
+
+def test_browser_steps_get_earlier_results_as_context(monkeypatch, websocket):
+    seen = {}
+
+    async def browse_website(instructions, websocket, **options):
+        seen.update(options)
+        return ToolResult.from_text("done")
+    monkeypatch.setattr(agent, "browse_website_impl", browse_website)
+    ctx = SessionContext(browser_model="browser")
+    asyncio.run(agent._dispatch_tool({"tool": "browser", "input": "summarise"}, 1, websocket, ctx,
+                                     "Step 1 [shell_terminal, done] list:\na.txt"))
+    assert seen == {"browser_model": "browser", "context_hint": "Step 1 [shell_terminal, done] list:\na.txt"}
+
+
+def test_corrections_see_earlier_results(monkeypatch, websocket):
+    prompts = []
+
+    def astream_prompt(model, prompt, system=None, **kwargs):
+        prompts.append(prompt)
+
+        async def tokens():
+            yield '{"tool": "shell_terminal", "command": ["cat", "a.txt"]}'
+        return tokens()
+    monkeypatch.setattr(agent, "astream_prompt", astream_prompt)
+    task = {"tool": "shell_terminal", "command": ["cat", "missing.txt"]}
+    asyncio.run(agent.review_and_resolve(task, ToolResult.error("not_found", "No such file"), 0,
+                                         websocket, SessionContext(max_retries=2), context="files: a.txt"))
+    assert "**Results of earlier steps:**\n```\nfiles: a.txt\n```" in prompts[0]
+
+
+def _revision_tasks():
+    return [
+        {"description": "Announce", "original_task": {"tool": "shell_terminal", "command": ["echo", "go"]},
+         "result": "Exit Code: 0\ngo", "status": "done"},
+        {"description": "Load the figures",
+         "original_task": {"tool": "code_interpreter", "code": "open('sales.csv')"},
+         "result": "Exit Code: 1\nFileNotFoundError: sales.csv", "status": "error"},
+        {"description": "Report", "original_task": {"tool": "shell_terminal", "command": ["echo", "done"]},
+         "result": None, "status": "pending"},
+    ]
+
+
+def _revise(monkeypatch, websocket, answer):
+    prompts = []
+
+    async def asimple_prompt(model, prompt, system=None, **kwargs):
+        prompts.append(prompt)
+        return answer
+    monkeypatch.setattr(agent, "asimple_prompt", asimple_prompt)
+    store = StepResultStore()
+    tasks = _revision_tasks()
+    for i in (0, 1):
+        store.record(i, tasks[i]["original_task"], tasks[i]["result"], tasks[i]["status"])
+    revised = asyncio.run(agent.revise_plan("Total the sales", tasks, [2], 1, store, websocket, SessionContext()))
+    return revised, prompts
+
+
+def test_revision_replaces_the_remaining_steps(monkeypatch, websocket):
+    revised, prompts = _revise(monkeypatch, websocket,
+                               '```json\n[{"tool": "code_interpreter", "description": "Use given figures", '
+                               '"code": "print(1)"}]\n```')
+    assert revised == [{"tool": "code_interpreter", "description": "Use given figures", "code": "print(1)"}]
+    prompt = prompts[0]
+    assert "**Failed step:** Load the figures" in prompt and "FileNotFoundError" in prompt
+    assert "Step 1 [shell_terminal, done]" in prompt
+    assert '"done"' in prompt.split("Steps not started yet:")[1]
+
+
+def test_empty_revision_means_nothing_is_left_to_do(monkeypatch, websocket):
+    assert _revise(monkeypatch, websocket, "[]")[0] == []
+
+
+def test_unparseable_revision_keeps_the_plan(monkeypatch, websocket):
+    revised, _ = _revise(monkeypatch, websocket, "Let me think about this")
+    assert revised is None
+    assert any("Could not parse the revised plan" in m for m in websocket.sent)
+
+
+def _run_workflow(query, **settings):
+    from app.events import EventChannel
+
+    async def run():
+        sent = []
+
+        class Socket:
+            async def send_text(self, text):
+                sent.append(text)
+
+            async def send_json(self, data):
+                sent.append(json.dumps(data))
+        channel = EventChannel(Socket())
+        await agent.handle_agent_workflow(query, SessionContext(planner_model="m", **settings), channel)
+        await channel.aclose()
+        return "\n".join(sent)
+    return asyncio.run(run())
+
+
+def test_failed_step_is_recovered_by_replanning(mock_ollama, journal_dir):
+    log = _run_workflow("Total the sales figures and report them", replan="on_failure")
+    assert "Workflow completed successfully" in log
+    journal, = journal_dir.iterdir()
+    records = [json.loads(line) for line in journal.read_text().splitlines()]
+    replan, = [r for r in records if r["type"] == "replan"]
+    assert replan["trigger"] == "failure"
+    assert records[-1]["outcome"] == "ok"
+
+
+def test_without_replanning_the_failure_ends_the_workflow(mock_ollama, journal_dir):
+    log = _run_workflow("Total the sales figures and report them", replan="off")
+    assert "Workflow completed successfully" not in log
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app import batch
+from app.batch import BatchRunner, item_workflow_id, read_items, recorded_outcomes
+
+
+def _jsonl(path, *lines):
+    path.write_text("\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines) + "\n")
+    return str(path)
+
+
+def _records(path):
+    return [json.loads(line) for line in open(path, encoding="utf-8")]
+
+
+def test_read_items(tmp_path):
+    path = _jsonl(tmp_path / "in.jsonl",
+                  "# comment", "",
+                  {"id": "a", "query": "first", "replan": "off"},
+                  '"a bare query"',
+                  "{not json",
+                  {"id": "b"},
+                  {"query": "numbered by line"})
+    items = read_items(path)
+    assert [(i.line, i.key, i.query, i.error is not None) for i in items] == [
+        (3, "a", "first", False), (4, "4", "a bare query", False), (5, "5", "", True),
+        (6, "6", "", True), (7, "7", "numbered by line", False)]
+    assert items[0].request["replan"] == "off"
+    assert items[2].error.startswith("invalid JSON") and items[3].error == "no query"
+
+
+def test_duplicate_ids_are_rejected_not_merged(tmp_path):
+    path = _jsonl(tmp_path / "in.jsonl", {"id": "x", "query": "one"}, {"id": "x", "query": "two"},
+                  {"query": "three"}, {"id": "3", "query": "four"})
+    items = read_items(path)
+    assert [(i.key, i.error) for i in items] == [
+        ("x", None), ("x@2", "duplicate id 'x' (first used on line 1)"),
+        ("3", None), ("3@4", "duplicate id '3' (first used on line 3)")]
+
+
+def test_recorded_outcomes_last_record_wins(tmp_path):
+    path = _jsonl(tmp_path / "out.jsonl", {"id": "a", "outcome": "rejected"}, "garbage",
+                  {"no_id": True}, {"id": "a", "outcome": "ok"}, {"id": 2, "outcome": "error"})
+    assert recorded_outcomes(path) == {"a": "ok", "2": "error"}
+    assert recorded_outcomes(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_workflow_ids_are_stable_per_output_and_item(tmp_path):
+    one, two = read_items(_jsonl(tmp_path / "in.jsonl", {"id": "a", "query": "q"}, {"id": "b", "query": "q"}))
+    out = str(tmp_path / "out.jsonl")
+    assert item_workflow_id(out, one) == item_workflow_id(out, one)
+    assert item_workflow_id(out, one) != item_workflow_id(out, two)
+    assert item_workflow_id(out, one) != item_workflow_id(str(tmp_path / "other.jsonl"), one)
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    """admitted_workflow stand-in: ends "ok" after a short delay, tracking how many run at once."""
+    stats = {"running": 0, "peak": 0, "queries": []}
+
+    async def admitted_workflow(sink, ctx, query, resume=None, workflow_id=None):
+        stats["running"] += 1
+        stats["peak"] = max(stats["peak"], stats["running"])
+        stats["queries"].append(query)
+        await sink.send_event({"type": "workflow", "id": workflow_id, "state": "started"})
+        await asyncio.sleep(0.02)
+        await sink.send_text("**Agent: Workflow completed successfully.**")
+        await sink.send_event({"type": "workflow", "id": workflow_id, "state": "finished", "outcome": "ok"})
+        stats["running"] -= 1
+    monkeypatch.setattr(batch, "admitted_workflow", admitted_workflow)
+    return stats
+
+
+def test_concurrency_is_bounded_and_a_rerun_skips_finished_items(tmp_path, journal_dir, scripted):
+    src = _jsonl(tmp_path / "in.jsonl", *[{"query": f"q{i}"} for i in range(6)], "{broken")
+    out = str(tmp_path / "out.jsonl")
+    progress = asyncio.run(BatchRunner(src, out, concurrency=2).run())
+    assert scripted["peak"] == 2
+    assert progress["outcomes"] == {"ok": 6, "invalid": 1} and progress["state"] == "finished"
+    records = _records(out)
+    assert {r["query"] for r in records if r["outcome"] == "ok"} == {f"q{i}" for i in range(6)}
+    assert all(r["total_s"] >= r["run_s"] > 0 for r in records if r["outcome"] == "ok")
+
+    again = asyncio.run(BatchRunner(src, out, concurrency=2).run())
+    assert again["skipped"] == 7 and again["outcomes"] == {} and len(scripted["queries"]) == 6
+
+
+def test_item_finished_before_a_stop_is_recorded_from_its_journal(tmp_path, journal_dir, scripted):
+    src = _jsonl(tmp_path / "in.jsonl", {"id": "done", "query": "q"})
+    out = str(tmp_path / "out.jsonl")
+    item, = read_items(src)
+    journal_dir.mkdir()
+    (journal_dir / f"{item_workflow_id(out, item)}.jsonl").write_text(
+        json.dumps({"t": 1.0, "type": "start", "query": "q"}) + "\n"
+        + json.dumps({"t": 2.0, "type": "end", "outcome": "ok"}) + "\n")
+    asyncio.run(BatchRunner(src, out).run())
+    record, = _records(out)
+    assert record["outcome"] == "ok" and record["resumed"] and scripted["queries"] == []
+
+
+def test_real_workflows_run_headless(tmp_path, journal_dir, mock_ollama):
+    src = _jsonl(tmp_path / "in.jsonl", {"id": "shell", "query": "Show where the agent is running"})
+    out = str(tmp_path / "out.jsonl")
+    asyncio.run(BatchRunner(src, out, defaults={"planner_model": "m"}).run())
+    record, = _records(out)
+    assert record["outcome"] == "ok" and not record["resumed"]
+    assert [s["status"] for s in record["steps"]] == ["done", "done"]
+    assert "hello" in record["steps"][0]["result"]
+
+
+class _Finished:
+    def __init__(self, batch_id, finished):
+        self.id, self.finished = batch_id, finished
+        self.task = type("Done", (), {"done": lambda self: True})()
+
+
+def test_finished_batches_are_forgotten_after_retention(monkeypatch):
+    now = time.time()
+    batches = {b.id: b for b in [_Finished("old", now - 7200), _Finished("new1", now - 10),
+                                 _Finished("new2", now - 20), _Finished("new3", now - 30)]}
+    monkeypatch.setattr(batch, "BATCHES", batches)
+    monkeypatch.setattr(batch, "BATCH_MAX_FINISHED", 2)
+    batch._prune_batches()
+    assert sorted(batches) == ["new1", "new2"]
@@ -0,0 +1,88 @@
+import json
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+sys.path.insert(0, BENCH_DIR)
+
+from bench_workflow import compare  # noqa: E402
+from mock_ollama import DEFAULT_ANSWER, MockOllama, load_corpus  # noqa: E402
+
+CORPUS = load_corpus()
+
+
+def _user(text):
+    return [{"role": "user", "content": text}]
+
+
+def _entry(name):
+    return next(e for e in CORPUS if e["name"] == name)
+
+
+def test_mock_scripts_plans_corrections_and_replans():
+    mock = MockOllama(CORPUS)
+    shell = _entry("shell_only")
+    assert json.loads(mock.answer(_user(f"User request: '{shell['query']}'\n"))) == shell["plan"]
+    repair = _entry("repair")
+    fix = repair["corrections"]["Divide the numbers"]
+    assert json.loads(mock.answer(_user("**Task:** Divide the numbers\n…"))) == fix
+    assert mock.answer(_user("**Task:** Something unknown")) == "null"
+    replan = _entry("replan")
+    prompt = f"Original request: '{replan['query']}'\n**Failed step:** Load the sales figures\n"
+    assert json.loads(mock.answer(_user(prompt))) == replan["replan"]["Load the sales figures"]
+    assert mock.answer(_user(f"Original request: '{replan['query']}'\n")) == "KEEP"
+    assert mock.answer(_user("hello")) == DEFAULT_ANSWER
+
+
+@pytest.fixture
+def server():
+    mock = MockOllama(CORPUS, first_token_ms=1, token_ms=0).start()
+    yield mock
+    mock.stop()
+
+
+def test_streamed_and_plain_chat_carry_the_same_answer(server):
+    body = {"model": "m", "messages": _user(f"User request: '{_entry('shell_only')['query']}'\n")}
+    plain = httpx.post(f"{server.url}/api/chat", json={**body, "stream": False}).json()
+    with httpx.stream("POST", f"{server.url}/api/chat", json=body) as resp:
+        parts = [json.loads(line) for line in resp.iter_lines() if line]
+    assert len(parts) > 2 and parts[-1]["done"]
+    assert "".join(p["message"]["content"] for p in parts) == plain["message"]["content"]
+
+
+def test_models_become_resident_on_first_use(server):
+    assert httpx.get(f"{server.url}/api/ps").json() == {"models": []}
+    httpx.post(f"{server.url}/api/generate", json={"model": "coder", "prompt": ""})
+    assert [m["name"] for m in httpx.get(f"{server.url}/api/ps").json()["models"]] == ["coder"]
+    assert server.requests == {"/api/ps": 2, "/api/generate": 1}
+
+
+def test_compare_flags_slower_p95_and_lower_throughput(tmp_path):
+    baseline = tmp_path / "old.json"
+    baseline.write_text(json.dumps({"levels": [
+        {"concurrency": 1, "replan": None, "p95": 1.0, "throughput": 10.0},
+        {"concurrency": 2, "replan": None, "p95": 1.0, "throughput": 10.0},
+    ]}))
+    results = [
+        {"concurrency": 1, "replan": None, "p95": 1.1, "throughput": 9.0},
+        {"concurrency": 2, "replan": None, "p95": 1.5, "throughput": 5.0},
+        {"concurrency": 4, "replan": None, "p95": 9.0, "throughput": 1.0},   # no baseline
+    ]
+    problems = compare(results, str(baseline), tolerance=0.2)
+    assert len(problems) == 2 and all(p.startswith("c=2:") for p in problems)
+
+
+def test_whole_corpus_replays_offline(tmp_path):
+    out = tmp_path / "bench.json"
+    subprocess.run(
+        [sys.executable, os.path.join(BENCH_DIR, "bench_workflow.py"), "--concurrency", "2",
+         "--runs", str(len(CORPUS)), "--first-token-ms", "1", "--token-ms", "0",
+         "--browser-ms", "5", "--no-sandbox", "--json", str(out)],
+        capture_output=True, check=True, timeout=120,
+    )
+    level, = json.loads(out.read_text())["levels"]
+    assert level["failures"] == [] and level["runs"] == len(CORPUS)
@@ -0,0 +1,144 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+
+from app.tools.browser_pool import BrowserPool, BrowserWorker
+
+
+def test_importing_the_browser_tool_writes_nothing_to_stdout():
+    out = subprocess.run([sys.executable, "-c", "import app.tools.browseruse_integration"],
+                         capture_output=True, text=True, check=True)
+    assert out.stdout == ""
+
+
+class _FakeProc:
+    pid = 4242
+
+    def __init__(self, lines):
+        self.stdout = self._lines(lines)
+
+    @staticmethod
+    async def _lines(lines):
+        for line in lines:
+            yield line
+
+
+def test_worker_log_lines_reach_the_current_task_only(capsys):
+    received = []
+
+    async def on_line(stream, line):
+        received.append((stream, line))
+
+    async def run():
+        worker = BrowserWorker()
+        worker.proc = _FakeProc([b"navigating\n", b"\xff done\r\n"])
+        worker.on_line = on_line
+        await worker._pump_logs()
+    asyncio.run(run())
+    assert received == [("stderr", "navigating"), ("stderr", "� done")]
+    assert capsys.readouterr().out == ""
+
+
+class _FakeWorker:
+    """Stands in for a worker process; answers each request after `delay` seconds."""
+
+    started = []
+    delay = 0.0
+    reply = {}
+
+    def __init__(self):
+        self.proc = type("Proc", (), {"returncode": None, "pid": 1000 + len(self.started)})()
+        self.tasks_done = 0
+        self.on_line = None
+        self.killed = False
+        self.stopped = False
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    async def start(self):
+        self.started.append(self)
+
+    async def request(self, payload):
+        await asyncio.sleep(self.delay)
+        return {"result": payload["instructions"], **self.reply}
+
+    def rss_mb(self):
+        return 100.0
+
+    def kill(self):
+        self.killed = True
+        self.proc.returncode = -9
+
+    async def stop(self, grace=10.0):
+        self.stopped = True
+        self.kill()
+
+
+@pytest.fixture
+def fake_workers(monkeypatch):
+    from app.tools import browser_pool
+
+    monkeypatch.setattr(_FakeWorker, "started", [])
+    monkeypatch.setattr(_FakeWorker, "delay", 0.0)
+    monkeypatch.setattr(_FakeWorker, "reply", {})
+    monkeypatch.setattr(browser_pool, "BrowserWorker", _FakeWorker)
+    monkeypatch.setattr(browser_pool, "BROWSER_WORKER_MAX_TASKS", 3)
+    return _FakeWorker.started
+
+
+async def _settle(pool):
+    while pool._bg:
+        await asyncio.gather(*pool._bg)
+
+
+def test_tasks_reuse_the_warm_worker(fake_workers):
+    async def run():
+        pool = BrowserPool(1)
+        results = [await pool.run(f"task {i}", "m", timeout=5) for i in range(2)]
+        return results
+    assert asyncio.run(run()) == [{"result": "task 0"}, {"result": "task 1"}]
+    assert len(fake_workers) == 1
+
+
+def test_worker_is_recycled_after_max_tasks(fake_workers):
+    async def run():
+        pool = BrowserPool(1)
+        for i in range(4):
+            await pool.run(f"task {i}", "m", timeout=5)
+            await _settle(pool)
+        return pool
+    pool = asyncio.run(run())
+    first, second = fake_workers
+    assert first.stopped and first.tasks_done == 3
+    assert second.tasks_done == 1 and not second.stopped
+    assert pool._live == 1
+
+
+def test_worker_asking_to_be_recycled_is_replaced(fake_workers, monkeypatch):
+    monkeypatch.setattr(_FakeWorker, "reply", {"recycle": True})
+
+    async def run():
+        pool = BrowserPool(1)
+        res = await pool.run("task", "m", timeout=5)
+        await _settle(pool)
+        return res
+    assert asyncio.run(run()) == {"result": "task"}
+    assert fake_workers[0].stopped and len(fake_workers) == 2
+
+
+def test_timeout_kills_the_worker_and_starts_a_replacement(fake_workers, monkeypatch):
+    monkeypatch.setattr(_FakeWorker, "delay", 1.0)
+
+    async def run():
+        pool = BrowserPool(1)
+        res = await pool.run("slow", "m", timeout=0.05)
+        await _settle(pool)
+        return res, pool
+    res, pool = asyncio.run(run())
+    assert res["timeout"] and "exceeded" in res["error"]
+    assert fake_workers[0].killed and len(fake_workers) == 2
+    assert pool._live == 1 and pool._idle.qsize() == 1
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import llm_handler, main
+
+
+class _Workflows:
+    """Stands in for admitted_workflow: runs until cancelled and records why."""
+
+    def __init__(self):
+        self.started = []
+        self.cancelled = []
+        self.running = threading.Event()
+
+    async def __call__(self, channel, ctx, query, resume=None):
+        self.started.append(query)
+        self.running.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled.append((query, ctx.cancel_reason))
+            raise
+
+    def wait_for(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert predicate()
+
+
+@pytest.fixture
+def workflows(monkeypatch):
+    fake = _Workflows()
+    monkeypatch.setattr(main, "admitted_workflow", fake)
+    return fake
+
+
+def test_cancel_message_stops_the_running_workflow(workflows):
+    with TestClient(main.app).websocket_connect("/ws") as ws:
+        ws.send_text(json.dumps({"query": "long task"}))
+        workflows.running.wait(5)
+        ws.send_text(json.dumps({"type": "cancel"}))
+        workflows.wait_for(lambda: workflows.cancelled)
+    assert workflows.cancelled == [("long task", "cancelled by user")]
+
+
+def test_new_query_supersedes_the_running_one(workflows):
+    with TestClient(main.app).websocket_connect("/ws") as ws:
+        ws.send_text(json.dumps({"query": "first"}))
+        workflows.running.wait(5)
+        ws.send_text(json.dumps({"query": "second"}))
+        workflows.wait_for(lambda: len(workflows.started) == 2)
+        assert workflows.cancelled == [("first", "superseded by a new request")]
+
+
+def test_closing_the_socket_cancels_the_workflow(workflows):
+    with TestClient(main.app).websocket_connect("/ws") as ws:
+        ws.send_text(json.dumps({"query": "left behind"}))
+        workflows.running.wait(5)
+    workflows.wait_for(lambda: workflows.cancelled)
+    query, reason = workflows.cancelled[0]
+    assert query == "left behind" and reason in ("client disconnected", "connection closed")
+
+
+def test_cancelling_a_generation_frees_the_llm_slot_at_once(mock_ollama):
+    mock_ollama.first_token = 5.0
+
+    async def run():
+        call = asyncio.create_task(llm_handler.asimple_prompt("m", "slow", cache=False))
+        while llm_handler.LLM_GATE.active == 0:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)                 # request is in flight
+        started = time.monotonic()
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        return time.monotonic() - started, llm_handler.LLM_GATE.active
+    elapsed, active = asyncio.run(run())
+    assert elapsed < 1 and active == 0
@@ -0,0 +1,81 @@
+import asyncio
+
+from app.dag_scheduler import PlanGraph, ToolLimiter
+
+
+def _graph(*tasks):
+    graph = PlanGraph()
+    for task in tasks:
+        graph.add(task)
+    return graph
+
+
+def test_steps_without_edges_run_in_order():
+    graph = _graph({"tool": "a"}, {"tool": "b"}, {"tool": "c"})
+    assert graph.ready(["pending"] * 3, []) == [0]
+    assert graph.ready(["done", "pending", "pending"], [0]) == [1]
+
+
+def test_explicit_edges_let_independent_steps_start_together():
+    graph = _graph({"id": "fetch", "tool": "browser", "depends_on": []},
+                   {"id": "calc", "tool": "code_interpreter", "depends_on": []},
+                   {"tool": "shell_terminal", "depends_on": ["fetch", "calc"]})
+    assert graph.ready(["pending"] * 3, []) == [0, 1]
+    assert graph.ready(["done", "running", "pending"], [0, 1]) == []
+    assert graph.ready(["done", "done", "pending"], [0, 1]) == [2]
+    assert graph.depends_on(2) == {0, 1}
+
+
+def test_steps_can_be_named_by_one_based_number():
+    graph = _graph({"tool": "a", "depends_on": []}, {"tool": "b", "depends_on": []},
+                   {"tool": "c", "depends_on": [1]})
+    assert graph.depends_on(2) == {0}
+
+
+def test_forward_reference_waits_until_planning_closes():
+    graph = _graph({"tool": "a", "depends_on": ["later"]})
+    assert graph.ready(["pending"], []) == []
+    graph.add({"id": "later", "tool": "b", "depends_on": []})
+    assert graph.ready(["pending", "pending"], []) == [1]
+    assert graph.depends_on(0) == {1}
+
+
+def test_unknown_dependency_is_dropped_on_close():
+    graph = _graph({"tool": "a", "depends_on": ["ghost"]})
+    assert graph.ready(["pending"], []) == []
+    graph.close()
+    assert graph.ready(["pending"], []) == [0]
+
+
+def test_a_failed_dependency_blocks_its_dependents():
+    graph = _graph({"tool": "a"}, {"tool": "b"})
+    assert graph.ready(["error", "pending"], [0]) == []
+
+
+def test_revision_retires_steps_and_starts_fresh_at_its_base():
+    graph = _graph({"tool": "a"}, {"tool": "b"}, {"tool": "c"})
+    graph.retire([1, 2])
+    base = len(graph)
+    graph.add({"tool": "d"}, base=base)           # no implicit edge back to retired step 3
+    graph.add({"tool": "e"}, base=base)
+    statuses = ["done", "pending", "pending", "pending", "pending"]
+    assert graph.ready(statuses, [0]) == [3]
+    assert graph.depends_on(4) == {3}
+
+
+def test_tool_limiter_caps_each_tool_separately():
+    limiter = ToolLimiter({"browser": 1}, default=2)
+    running = {"browser": 0, "shell_terminal": 0}
+    peak = dict(running)
+
+    async def step(tool):
+        async with limiter.slot(tool):
+            running[tool] += 1
+            peak[tool] = max(peak[tool], running[tool])
+            await asyncio.sleep(0.01)
+            running[tool] -= 1
+
+    async def run():
+        await asyncio.gather(*(step(t) for t in ["browser"] * 3 + ["shell_terminal"] * 4))
+    asyncio.run(run())
+    assert peak == {"browser": 1, "shell_terminal": 2}
@@ -0,0 +1,98 @@
+import asyncio
+import sys
+
+import pytest
+
+from app.tools import dependencies
+from app.tools.dependencies import DependencyResolver, scan_imports
+
+
+def test_scan_separates_required_and_guarded_imports():
+    code = (
+        "import os, numpy.linalg as la\n"
+        "from pandas import DataFrame\n"
+        "from . import sibling\n"
+        "try:\n"
+        "    import ujson as json\n"
+        "except ImportError:\n"
+        "    import json\n"
+    )
+    required, optional = scan_imports(code)
+    assert required == {"os", "numpy", "pandas", "json"}
+    assert optional == {"ujson"}
+
+
+def test_scan_falls_back_to_regex_for_code_that_does_not_parse():
+    required, _ = scan_imports("import requests\nprint('unterminated)\n")
+    assert required == {"requests"}
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    monkeypatch.setattr(dependencies, "PIP_INSTALL_ANY", False)
+    monkeypatch.setattr(dependencies, "PIP_WHEELHOUSE", "")
+    monkeypatch.setattr(dependencies, "_importable", lambda module: False)   # only the index counts
+    resolver = DependencyResolver()
+    resolver.index = {"os", "json"}
+    return resolver
+
+
+def test_only_allowlisted_modules_are_installed(resolver):
+    missing = asyncio.run(resolver.missing(["yaml", "numpyy", "my_helpers", "requests"]))
+    assert missing == ["requests", "yaml"]
+
+
+def test_stdlib_module_missing_from_the_image_is_never_installed(resolver):
+    assert not resolver.installable("tkinter")
+    assert asyncio.run(resolver.missing(["tkinter"])) == []
+    assert "tkinter" not in resolver.index
+
+
+def test_index_misses_are_confirmed_with_find_spec(resolver, monkeypatch):
+    monkeypatch.setattr(dependencies, "_importable", lambda module: module == "requests")
+    assert asyncio.run(resolver.missing(["requests", "yaml"])) == ["yaml"]
+    assert "requests" in resolver.index
+
+
+def test_stdlib_names_are_not_assumed_present():
+    index = dependencies._installed_modules()
+    assert "sys" in index and "json" in index
+    assert "winreg" not in index or sys.platform == "win32"     # stdlib, but not on this system
+
+
+def test_wheelhouse_entries_are_installable(resolver, monkeypatch, tmp_path):
+    (tmp_path / "acme_tools-1.2.0-py3-none-any.whl").write_bytes(b"")
+    monkeypatch.setattr(dependencies, "PIP_WHEELHOUSE", str(tmp_path))
+    assert resolver.installable("acme_tools")
+    assert not resolver.installable("acme_other")
+
+
+def test_install_any_is_opt_in(resolver, monkeypatch):
+    assert not resolver.installable("some_pypi_name")
+    monkeypatch.setattr(dependencies, "PIP_INSTALL_ANY", True)
+    assert resolver.installable("some_pypi_name")
+
+
+def test_pip_install_refuses_without_running_pip(resolver, monkeypatch, websocket):
+    async def no_pip(*args):
+        raise AssertionError("pip must not run")
+    monkeypatch.setattr(resolver, "_pip", no_pip)
+    monkeypatch.setattr(dependencies, "RESOLVER", resolver)
+    assert asyncio.run(dependencies.pip_install("tkinter", websocket)) is False
+    assert asyncio.run(dependencies.pip_install("not_a_real_module_xyz.sub", websocket)) is False
+
+
+def test_concurrent_installs_of_one_module_share_a_pip_run(resolver, monkeypatch, websocket):
+    runs = []
+
+    async def fake_pip(modules, websocket):
+        runs.append(list(modules))
+        await asyncio.sleep(0.01)
+        return set(modules)
+    monkeypatch.setattr(resolver, "_pip", fake_pip)
+
+    async def both():
+        return await asyncio.gather(resolver.install(["yaml"], websocket),
+                                    resolver.install(["yaml"], websocket))
+    assert asyncio.run(both()) == [{"yaml"}, {"yaml"}]
+    assert runs == [["yaml"]]
@@ -0,0 +1,39 @@
+from app.error_classifier import legacy_error_scan, local_fix
+from app.tools.tool_result import ToolResult
+
+
+def _missing(name):
+    return ToolResult.from_process(1, "", f"ModuleNotFoundError: No module named '{name}'")
+
+
+def test_missing_module_installs_top_level_package_and_reruns_step():
+    task = {"tool": "shell_terminal", "command": "python -c 'import yaml.constructor'"}
+    fix = local_fix(task, _missing("yaml.constructor"))
+    assert fix.rule == "missing_module"
+    assert fix.install == "yaml"
+    assert fix.task == task and fix.task is not task
+
+
+def test_command_outside_whitelist_is_left_to_the_reviewer():
+    for command in ("rm -rf /", "curl http://example.com/x.sh", "sudo ls"):
+        task = {"tool": "shell_terminal", "command": command}
+        result = ToolResult.error("not_allowed", f"Error: Command '{command.split()[0]}' not allowed.")
+        assert local_fix(task, result) is None
+
+
+def test_code_interpreter_failures_have_no_local_fix():
+    task = {"tool": "code_interpreter", "code": "import yaml"}
+    assert local_fix(task, _missing("yaml")) is None
+
+
+def test_other_error_kinds_have_no_local_fix():
+    task = {"tool": "shell_terminal", "command": "cat missing.txt"}
+    result = ToolResult.from_process(1, "", "cat: missing.txt: No such file or directory")
+    assert result.error_kind == "nonzero_exit"
+    assert local_fix(task, result) is None
+
+
+def test_legacy_scan_flags_successful_output_that_mentions_errors():
+    result = ToolResult.from_process(0, "0 failed, 12 passed", "")
+    assert result.ok
+    assert legacy_error_scan(result.text)
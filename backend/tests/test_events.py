@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+from app.events import EventChannel, coalesce, event_from_text, send_event
+
+
+def _frames(websocket):
+    return [json.loads(f) for f in websocket.sent]
+
+
+def _events(websocket):
+    out = []
+    for frame in _frames(websocket):
+        out.extend(frame["events"] if frame["type"] == "batch" else [frame])
+    return out
+
+
+def _tasks(*statuses):
+    return [{"description": f"step {i}", "status": s} for i, s in enumerate(statuses)]
+
+
+def test_legacy_text_frames_map_onto_events():
+    assert event_from_text("Agent Stream:[{") == {"type": "stream", "text": "[{"}
+    assert event_from_text("Agent Output (shell):\na\nb") == {"type": "log", "source": "shell", "lines": ["a", "b"]}
+    assert event_from_text('Agent Task Update:[{"description": "x", "status": "done"}]') == \
+        {"type": "tasks", "tasks": [{"description": "x", "status": "done", "id": 0}]}
+    assert event_from_text("Agent Error: boom")["level"] == "error"
+    assert event_from_text("Agent: hi") == {"type": "message", "level": "info", "text": "Agent: hi"}
+
+
+def test_a_burst_goes_out_as_one_merged_frame(websocket):
+    async def run():
+        channel = EventChannel(websocket, window=0.05)
+        await channel.send_text("Agent: Planning")
+        for token in ["[", "{", "}", "]"]:
+            await channel.send_text("Agent Stream:" + token)
+        await channel.send_text("Agent Output (shell):\none")
+        await channel.send_text("Agent Output (shell):\ntwo")
+        await asyncio.sleep(0.15)
+        await channel.aclose()
+    asyncio.run(run())
+    frame, = _frames(websocket)
+    assert frame == {"type": "batch", "events": [
+        {"type": "message", "level": "info", "text": "Agent: Planning"},
+        {"type": "stream", "text": "[{}]"},
+        {"type": "log", "source": "shell", "lines": ["one", "two"]},
+    ]}
+
+
+def test_task_lists_become_deltas_keyed_by_step(websocket):
+    async def run():
+        channel = EventChannel(websocket, window=0)
+        for tasks in [_tasks("pending", "pending"), _tasks("running", "pending"),
+                      _tasks("running", "pending"), _tasks("done")]:
+            await channel.send_event({"type": "tasks", "tasks": tasks})
+            await asyncio.sleep(0.01)
+        await channel.aclose()
+    asyncio.run(run())
+    assert _events(websocket) == [
+        {"type": "tasks", "total": 2, "reset": False, "changed": [
+            {"id": 0, "description": "step 0", "status": "pending"},
+            {"id": 1, "description": "step 1", "status": "pending"}]},
+        {"type": "tasks", "total": 2, "reset": False, "changed": [
+            {"id": 0, "description": "step 0", "status": "running"}]},
+        # the unchanged list sent nothing; a shorter one resets the client's list
+        {"type": "tasks", "total": 1, "reset": True, "changed": [
+            {"id": 0, "description": "step 0", "status": "done"}]},
+    ]
+
+
+def test_task_deltas_in_one_window_fold_per_step():
+    events = [
+        {"type": "tasks", "total": 3, "reset": False, "changed": [{"id": 0, "status": "running"}]},
+        {"type": "message", "text": "Agent: step 1 done"},
+        {"type": "tasks", "total": 3, "reset": False, "changed": [{"id": 0, "status": "done"},
+                                                                  {"id": 2, "status": "running"}]},
+    ]
+    assert coalesce(events) == [
+        {"type": "message", "text": "Agent: step 1 done"},
+        {"type": "tasks", "total": 3, "reset": False, "changed": [{"id": 0, "status": "done"},
+                                                                  {"id": 2, "status": "running"}]},
+    ]
+
+
+def test_lagging_client_gets_log_summaries_but_every_message(websocket):
+    async def run():
+        channel = EventChannel(websocket, window=10, max_pending=5)
+        for i in range(20):
+            await channel.send_text(f"Agent Output (code):\nline {i}")
+            if i % 5 == 0:
+                await channel.send_text(f"Agent: progress {i}")
+        dropped = channel.dropped_lines
+        await channel.aclose()
+        return dropped
+    dropped = asyncio.run(run())
+    events = _events(websocket)
+    assert [e["text"] for e in events if e["type"] == "message"] == [f"Agent: progress {i}" for i in (0, 5, 10, 15)]
+    logs = [e for e in events if e["type"] == "log"]
+    assert sum(e.get("dropped", 0) for e in logs) == dropped > 0
+    assert any(e.get("summary") for e in logs)
+
+
+def test_failed_send_closes_the_channel_without_raising():
+    class Gone:
+        async def send_text(self, text):
+            raise ConnectionResetError("client gone")
+
+    async def run():
+        channel = EventChannel(Gone(), window=0)
+        await channel.send_text("Agent: one")
+        await asyncio.sleep(0.05)
+        await channel.send_text("Agent: two")          # dropped quietly
+        await channel.aclose()
+        return channel.closed
+    assert asyncio.run(run())
+
+
+def test_plain_sockets_still_get_text_frames(websocket):
+    asyncio.run(send_event(websocket, {"type": "tasks", "tasks": _tasks("done")}))
+    asyncio.run(send_event(websocket, {"type": "log", "source": "shell", "lines": ["a"]}))
+    assert websocket.sent == ['Agent Task Update:[{"description": "step 0", "status": "done"}]',
+                              "Agent Output (shell):\na"]
@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+
+from app import jobs
+from app.jobs import EventBuffer, JobManager, sse_stream
+from app.session import SessionContext
+
+
+async def _read(buffer, offset=0, idle=None, limit=None):
+    out = []
+    async for n, event in buffer.follow(offset, idle=idle):
+        out.append((n, event))
+        if limit and len(out) == limit:
+            break
+    return out
+
+
+def test_readers_replay_from_an_offset_then_follow_live():
+    async def run():
+        buffer = EventBuffer()
+        for i in range(3):
+            await buffer.send_text(f"Agent: {i}")
+        reader = asyncio.create_task(_read(buffer, offset=1))
+        await asyncio.sleep(0.01)
+        await buffer.send_text("Agent: 3")
+        buffer.close()
+        return await reader
+    events = asyncio.run(run())
+    assert [(n, e["text"]) for n, e in events] == [(1, "Agent: 1"), (2, "Agent: 2"), (3, "Agent: 3")]
+
+
+def test_reader_behind_the_buffer_gets_a_gap():
+    async def run():
+        buffer = EventBuffer(capacity=2)
+        for i in range(5):
+            await buffer.send_text(f"Agent: {i}")
+        buffer.close()
+        return await _read(buffer)
+    events = asyncio.run(run())
+    assert events[0] == (2, {"type": "gap", "dropped": 3})
+    assert [n for n, _ in events[1:]] == [3, 4]
+
+
+def test_idle_reader_gets_keepalive_ticks():
+    async def run():
+        return await _read(EventBuffer(), idle=0.01, limit=2)
+    assert asyncio.run(run()) == [(None, None), (None, None)]
+
+
+def test_task_lists_are_stored_as_full_resets():
+    async def run():
+        buffer = EventBuffer()
+        await buffer.send_event({"type": "tasks", "tasks": [{"description": "a", "status": "done"},
+                                                            {"description": "b", "status": "running"}]})
+        return buffer
+    buffer = asyncio.run(run())
+    assert buffer.events[0] == {"type": "tasks", "total": 2, "reset": True, "changed": buffer.tasks}
+    assert buffer.tasks[1] == {"id": 1, "description": "b", "status": "running"}
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """JobManager whose workflows are scripted: 'slow' runs until cancelled, 'boom' raises."""
+    async def handle_agent_workflow(query, ctx, ws, resume=None, workflow_id=None):
+        await ws.send_event({"type": "workflow", "id": workflow_id, "state": "started"})
+        if query == "slow":
+            await asyncio.sleep(60)
+        if query == "boom":
+            raise RuntimeError("boom")
+        await ws.send_text(f"Agent: answered {query}")
+        await ws.send_event({"type": "workflow", "id": workflow_id, "state": "finished", "outcome": "ok"})
+    monkeypatch.setattr(jobs, "handle_agent_workflow", handle_agent_workflow)
+    return JobManager()
+
+
+def test_job_runs_detached_and_records_its_outcome(manager):
+    async def run():
+        job = manager.submit("hello", SessionContext(client="script"))
+        assert job.state in ("queued", "running")
+        await job.task
+        return job
+    job = asyncio.run(run())
+    assert (job.state, job.outcome) == ("finished", "ok")
+    assert job.summary()["events"] == 3 and job.events.closed
+
+
+def test_cancelled_and_failed_jobs(manager):
+    async def run():
+        slow = manager.submit("slow", SessionContext())
+        boom = manager.submit("boom", SessionContext())
+        await asyncio.sleep(0.01)
+        assert [j.id for j in manager.running()] == [slow.id]
+        await manager.cancel(slow)
+        await boom.task
+        return slow, boom
+    slow, boom = asyncio.run(run())
+    assert slow.outcome == "cancelled" and slow.ctx.cancel_reason == "cancelled by user"
+    assert boom.finished and boom.events.events[-1]["text"] == "Agent Error: boom"
+
+
+def test_finished_jobs_are_pruned(manager, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_MAX_FINISHED", 2)
+
+    async def run():
+        for i in range(4):
+            await manager.submit(f"q{i}", SessionContext()).task
+        manager.submit("q4", SessionContext())
+        return [j.query for j in manager.jobs.values()]
+    assert asyncio.run(run()) == ["q2", "q3", "q4"]
+
+
+def test_sse_stream_numbers_events_and_ends_with_a_summary(manager):
+    async def run():
+        job = manager.submit("hello", SessionContext())
+        await job.task
+        return job, [chunk async for chunk in sse_stream(job, 1)]
+    job, chunks = asyncio.run(run())
+    assert chunks[0].startswith("id: 1\nevent: message\ndata: ")
+    assert json.loads(chunks[0].split("data: ", 1)[1])["text"] == "Agent: answered hello"
+    assert chunks[-1].startswith("event: end\n") and json.loads(chunks[-1].split("data: ", 1)[1])["outcome"] == "ok"
+    assert len(chunks) == 3
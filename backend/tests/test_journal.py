@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import time
+
+from app import agent, journal
+from app.journal import WorkflowJournal, compact_journals, journal_path, list_journals, load_journal
+from app.session import SessionContext
+
+
+def _write(journal_dir, workflow_id, *entries):
+    journal_dir.mkdir(exist_ok=True)
+    with open(journal_dir / f"{workflow_id}.jsonl", "w", encoding="utf-8") as f:
+        for t, entry in enumerate(entries, 1):
+            f.write(json.dumps({"t": float(t), **entry}) + "\n")
+
+
+ECHO = {"tool": "shell_terminal", "description": "Print a greeting", "command": ["echo", "hello"]}
+PWD = {"tool": "shell_terminal", "description": "Show the working directory", "command": ["pwd"]}
+
+
+def test_records_are_batched_into_one_fsync(journal_dir, monkeypatch):
+    syncs = []
+    monkeypatch.setattr(os, "fsync", lambda fd: syncs.append(fd))
+
+    async def run():
+        j = WorkflowJournal("abcdef12", flush_seconds=0.05)
+        j.record("start", query="q", settings={})
+        for i in range(20):
+            j.record("attempt", idx=i, attempt=1, task=ECHO)
+        await asyncio.sleep(0.15)
+        j.record("end", outcome="ok")
+        await j.aclose()
+    asyncio.run(run())
+    lines = (journal_dir / "abcdef12.jsonl").read_text().splitlines()
+    assert len(lines) == 22 and json.loads(lines[-1])["outcome"] == "ok"
+    assert len(syncs) == 2                                   # one per flush window, not per record
+
+
+def test_disabled_journal_writes_nothing(journal_dir):
+    async def run():
+        j = WorkflowJournal("abcdef12", enabled=False)
+        j.record("start", query="q")
+        await j.aclose()
+    asyncio.run(run())
+    assert not journal_dir.exists()
+
+
+def test_only_our_ids_map_to_files(journal_dir):
+    assert journal_path("abcdef123456") == str(journal_dir / "abcdef123456.jsonl")
+    assert journal_path("../../etc/passwd") is None
+    assert journal_path("") is None
+    assert load_journal("0123456789ab") is None
+
+
+def test_replay_restores_plan_results_and_revisions(journal_dir):
+    _write(journal_dir, "aaaa1111",
+           {"type": "start", "query": "greet", "settings": {"planner_model": "m"}},
+           {"type": "step", "idx": 0, "base": 0, "task": ECHO},
+           {"type": "step", "idx": 1, "base": 0, "task": PWD},
+           {"type": "planned", "steps": 2},
+           {"type": "result", "idx": 0, "status": "done", "task": ECHO, "result": "Exit Code: 0\nhello"},
+           {"type": "replan", "trigger": "failure", "retired": [1]},
+           {"type": "step", "idx": 2, "base": 2, "task": PWD})
+    with open(journal_dir / "aaaa1111.jsonl", "a") as f:
+        f.write('{"t": 9, "type": "res')                    # torn by a crash
+    state = load_journal("aaaa1111")
+    assert (state.query, state.settings, state.outcome) == ("greet", {"planner_model": "m"}, None)
+    assert [t["status"] for t in state.tasks] == ["done", "replaced", "pending"]
+    assert state.tasks[0]["result"] == "Exit Code: 0\nhello"
+    assert not state.planned and state.resumable
+    assert [t["description"] for t in state.done_steps()] == ["Print a greeting"]
+
+
+def test_finished_and_running_workflows_are_not_resumable(journal_dir, monkeypatch):
+    _write(journal_dir, "bbbb2222", {"type": "start", "query": "q"}, {"type": "end", "outcome": "ok"})
+    _write(journal_dir, "cccc3333", {"type": "start", "query": "q"}, {"type": "end", "outcome": "cancelled"})
+    monkeypatch.setattr(journal, "ACTIVE", {"dddd4444"})
+    _write(journal_dir, "dddd4444", {"type": "start", "query": "q"})
+    summaries = {s["workflow_id"]: s for s in list_journals()}
+    assert not summaries["bbbb2222"]["resumable"]
+    assert summaries["cccc3333"]["resumable"]
+    assert summaries["dddd4444"]["running"] and not summaries["dddd4444"]["resumable"]
+
+
+def test_compaction_prunes_old_and_surplus_journals(journal_dir, monkeypatch):
+    monkeypatch.setattr(journal, "ACTIVE", {"active01"})
+    now = time.time()
+    for n, (workflow_id, age_hours) in enumerate([("new00001", 0), ("new00002", 1), ("new00003", 2),
+                                                  ("old00001", 200), ("active01", 300)]):
+        _write(journal_dir, workflow_id, {"type": "start", "query": str(n)})
+        mtime = now - age_hours * 3600
+        os.utime(journal_dir / f"{workflow_id}.jsonl", (mtime, mtime))
+    assert compact_journals(retention_hours=168, max_files=3) == 2
+    assert sorted(p.stem for p in journal_dir.iterdir()) == ["active01", "new00001", "new00002"]
+    assert compact_journals(retention_hours=168, max_files=3) == 0
+
+
+def test_compaction_without_a_directory(journal_dir):
+    assert compact_journals() == 0 and list_journals() == []
+
+
+class _Socket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+def test_resume_continues_at_the_first_unfinished_step(mock_ollama, journal_dir):
+    _write(journal_dir, "eeee5555",
+           {"type": "start", "query": "Show where the agent is running", "settings": {"planner_model": "m"}},
+           {"type": "step", "idx": 0, "base": 0, "task": ECHO},
+           {"type": "step", "idx": 1, "base": 0, "task": PWD},
+           {"type": "planned", "steps": 2},
+           {"type": "result", "idx": 0, "status": "done", "task": ECHO, "result": "Exit Code: 0\nhello"})
+    state = load_journal("eeee5555")
+    ws = _Socket()
+    ctx = SessionContext.from_request(state.settings)
+    asyncio.run(agent.handle_agent_workflow(state.query, ctx, ws, resume=state))
+
+    log = "\n".join(ws.sent)
+    assert "Workflow completed successfully" in log
+    assert "/api/chat" not in mock_ollama.requests             # not planned again
+    assert sum("Starting Step" in m for m in ws.sent) == 1
+    resumed = load_journal("eeee5555")
+    assert resumed.outcome == "ok" and [t["status"] for t in resumed.tasks] == ["done", "done"]
+
+
+def test_every_workflow_leaves_a_complete_journal(mock_ollama, journal_dir):
+    ws = _Socket()
+    asyncio.run(agent.handle_agent_workflow("Show where the agent is running",
+                                            SessionContext(planner_model="m"), ws))
+    path, = journal_dir.iterdir()
+    kinds = [json.loads(line)["type"] for line in path.read_text().splitlines()]
+    assert kinds[0] == "start" and kinds.count("step") == 2 and "planned" in kinds
+    assert kinds.count("result") == 2 and kinds[-1] == "end"
+    assert load_journal(path.stem).outcome == "ok"
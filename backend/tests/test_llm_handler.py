@@ -0,0 +1,259 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import ollama
+import pytest
+
+from app import llm_handler
+
+
+def test_achat_answers_over_the_pooled_client(mock_ollama):
+    answer = asyncio.run(llm_handler.asimple_prompt("m", "hello", cache=False))
+    assert answer == "OK."
+    assert mock_ollama.requests["/api/chat"] == 1
+
+
+def test_concurrent_calls_share_one_client_and_overlap(mock_ollama, monkeypatch):
+    monkeypatch.setattr(llm_handler.LLM_GATE, "slots", 8)
+    mock_ollama.first_token = 0.2
+
+    async def run():
+        clients = set()
+
+        async def one(i):
+            clients.add(id(llm_handler._get_async_client()))
+            return await llm_handler.asimple_prompt("m", f"q{i}", cache=False)
+        await llm_handler.ensure_model("m")
+        start = time.perf_counter()
+        answers = await asyncio.gather(*(one(i) for i in range(6)))
+        return answers, clients, time.perf_counter() - start
+    answers, clients, elapsed = asyncio.run(run())
+    assert answers == ["OK."] * 6 and len(clients) == 1
+    assert elapsed < 6 * 0.2 / 2                 # in parallel, not one after another
+
+
+def test_timeout_returns_none(mock_ollama):
+    mock_ollama.first_token = 1.0
+    answer = asyncio.run(llm_handler.asimple_prompt("m", "slow", cache=False, timeout=0.2))
+    assert answer is None
+
+
+PLAN_PROMPT = "User request: 'Show where the agent is running'\n"
+
+
+def test_stream_yields_tokens_that_join_to_the_answer(mock_ollama):
+    async def run():
+        return [t async for t in llm_handler.astream_prompt("m", PLAN_PROMPT, cache=False)]
+    tokens = asyncio.run(run())
+    assert len(tokens) > 1
+    assert json.loads("".join(tokens))[0]["command"] == ["echo", "hello"]
+
+
+def test_stream_that_times_out_raises_instead_of_truncating(mock_ollama):
+    mock_ollama.token_delay = 0.05
+
+    async def run():
+        tokens = []
+        with pytest.raises(RuntimeError):
+            async for token in llm_handler.astream_prompt("m", PLAN_PROMPT, cache=False, timeout=0.3):
+                tokens.append(token)
+        return tokens
+    assert asyncio.run(run())                     # some tokens arrived before the deadline
+
+
+def _msgs(prompt, system="You are a planner."):
+    return [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+
+
+def test_repeated_prompt_is_answered_from_the_cache(mock_ollama):
+    async def run():
+        first = await llm_handler.achat("m", _msgs(PLAN_PROMPT))
+        second = await llm_handler.achat("m", _msgs(PLAN_PROMPT))
+        return first, second
+    first, second = asyncio.run(run())
+    assert first == second and json.loads(first)
+    assert mock_ollama.requests["/api/chat"] == 1
+
+
+def test_cache_false_goes_to_the_model(mock_ollama):
+    async def run():
+        await llm_handler.achat("m", _msgs("hello"))
+        await llm_handler.achat("m", _msgs("hello"), cache=False)
+    asyncio.run(run())
+    assert mock_ollama.requests["/api/chat"] == 2
+
+
+def test_key_covers_model_system_prompt_and_prompt():
+    key = llm_handler.llm_cache_key("m", _msgs("q"))
+    assert key == llm_handler.llm_cache_key("m", _msgs("q"))
+    assert key != llm_handler.llm_cache_key("other", _msgs("q"))
+    assert key != llm_handler.llm_cache_key("m", _msgs("q", system="Different."))
+    assert key != llm_handler.llm_cache_key("m", _msgs("q2"))
+
+
+def test_completed_stream_is_stored_and_replayed_in_one_piece(mock_ollama):
+    async def run():
+        streamed = [t async for t in llm_handler.astream_prompt("m", PLAN_PROMPT)]
+        replayed = [t async for t in llm_handler.astream_prompt("m", PLAN_PROMPT)]
+        return streamed, replayed
+    streamed, replayed = asyncio.run(run())
+    assert replayed == ["".join(streamed)]
+    assert mock_ollama.requests["/api/chat"] == 1
+
+
+def test_near_duplicate_query_hits_the_semantic_tier(mock_ollama, monkeypatch):
+    vectors = {"list files here": [1.0, 0.0, 0.1], "list the files here": [1.0, 0.0, 0.12],
+               "what is the weather": [0.0, 1.0, 0.0]}
+
+    async def embed(text):
+        return vectors[text]
+    monkeypatch.setattr(llm_handler, "LLM_CACHE_SEMANTIC", True)
+    monkeypatch.setattr(llm_handler, "_embed", embed)
+
+    def prompt(query):
+        return _msgs(f"User request: '{query}'\nPlan it.")
+
+    async def run():
+        for query in vectors:
+            await llm_handler.achat("m", prompt(query), similar=query)
+    asyncio.run(run())
+    # the second query reused the first answer; the unrelated one did not
+    assert mock_ollama.requests["/api/chat"] == 2
+
+
+def test_importing_the_handler_sends_nothing_to_ollama(mock_ollama):
+    env = {**os.environ, "OLLAMA_ENDPOINT": mock_ollama.url}
+    subprocess.run([sys.executable, "-c", "import app.llm_handler"], env=env, check=True)
+    assert mock_ollama.requests == {}
+
+
+def test_concurrent_first_uses_share_one_model_check(mock_ollama):
+    async def run():
+        return await asyncio.gather(*(llm_handler.ensure_model("m") for _ in range(5)))
+    assert asyncio.run(run()) == [True] * 5
+    assert mock_ollama.requests["/api/show"] == 1
+    assert llm_handler.model_ready("m")
+
+
+class _PullingClient:
+    """Knows no model locally; pulls stream the given parts (or fail)."""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.pulls = 0
+
+    async def show(self, model):
+        raise ollama.ResponseError("model not found", 404)
+
+    async def pull(self, model, stream=True):
+        self.pulls += 1
+
+        async def parts():
+            for part in self.parts:
+                if isinstance(part, Exception):
+                    raise part
+                yield part
+        return parts()
+
+
+@pytest.fixture
+def pulling(monkeypatch):
+    def install(parts):
+        client = _PullingClient(parts)
+        monkeypatch.setattr(llm_handler, "_get_async_client", lambda: client)
+        monkeypatch.setattr(llm_handler, "_model_state", {})
+        monkeypatch.setattr(llm_handler, "_pulls", {})
+        return client
+    return install
+
+
+def test_missing_model_is_pulled_once_with_progress(pulling):
+    client = pulling([{"status": "pulling manifest"},
+                      {"status": "downloading", "completed": 5, "total": 10},
+                      {"status": "success"}])
+    events = []
+
+    async def listener(event):
+        events.append(dict(event))
+
+    async def run():
+        llm_handler.add_progress_listener(listener)
+        try:
+            return await asyncio.gather(llm_handler.ensure_model("new"), llm_handler.ensure_model("new"))
+        finally:
+            llm_handler.remove_progress_listener(listener)
+    assert asyncio.run(run()) == [True, True]
+    assert client.pulls == 1
+    assert events[0]["state"] == "pulling" and events[-1]["state"] == "ready"
+    assert {"status": "pulling manifest"}.items() <= events[1].items()
+
+
+def test_failed_pull_is_reported_and_retried_on_next_use(pulling):
+    client = pulling([{"status": "pulling manifest"}, RuntimeError("disk full")])
+    assert asyncio.run(llm_handler.ensure_model("new")) is False
+    state = llm_handler.model_status()["new"]
+    assert state["state"] == "error" and "disk full" in state["error"]
+    asyncio.run(llm_handler.ensure_model("new"))
+    assert client.pulls == 2
+
+
+def test_health_is_503_until_the_planner_model_is_ready(monkeypatch):
+    from app import api
+
+    monkeypatch.setattr(llm_handler, "_model_state", {})
+    assert api.health().status_code == 503
+    llm_handler._model_state[api.PLANNING_TOOLING_MODEL] = {"state": "ready"}
+    resp = api.health()
+    assert resp.status_code == 200 and json.loads(resp.body)["status"] == "ready"
+
+
+def test_prepare_preloads_a_model_once(mock_ollama):
+    mock_ollama.load_seconds = 0.1
+    residency = llm_handler.RESIDENCY
+
+    async def run():
+        residency.prepare(["coder", None, "coder"])
+        residency.prepare(["coder"])                 # already on its way
+        await asyncio.gather(*residency._inflight.values())
+        residency.prepare(["coder"])                 # resident now
+        await asyncio.gather(*residency._inflight.values())
+    asyncio.run(run())
+    assert mock_ollama.requests["/api/generate"] == 1
+    assert residency.preloads == 1 and "coder" in residency.resident
+
+
+def test_prepare_skips_models_ollama_lists_as_resident(mock_ollama):
+    mock_ollama.loaded.add("planner")
+
+    async def run():
+        llm_handler.RESIDENCY.prepare(["planner"])
+        await asyncio.gather(*llm_handler.RESIDENCY._inflight.values())
+    asyncio.run(run())
+    assert "/api/generate" not in mock_ollama.requests
+
+
+def test_preload_disabled(mock_ollama, monkeypatch):
+    monkeypatch.setattr(llm_handler, "MODEL_PRELOAD", False)
+
+    async def run():
+        llm_handler.RESIDENCY.prepare(["coder"])
+        return dict(llm_handler.RESIDENCY._inflight)
+    assert asyncio.run(run()) == {}
+
+
+def test_load_times_come_from_ollama_responses(mock_ollama):
+    mock_ollama.load_seconds = 0.2
+
+    async def run():
+        await llm_handler.achat("m", [{"role": "user", "content": "a"}], cache=False)
+        await llm_handler.achat("m", [{"role": "user", "content": "b"}], cache=False)
+        return await llm_handler.RESIDENCY.stats()
+    stats = asyncio.run(run())
+    loads = stats["load_seconds"]["m"]
+    assert loads["count"] == 1                        # the second call found it loaded
+    assert loads["last"] == pytest.approx(0.2, abs=0.01)
+    assert "m" in stats["resident"]
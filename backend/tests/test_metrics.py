@@ -0,0 +1,93 @@
+import subprocess
+import sys
+
+import pytest
+
+from app import metrics
+from app.metrics import Callback, Counter, Gauge, Histogram, span
+
+
+def test_counter_renders_labels_in_prometheus_format():
+    c = Counter("requests_total", "Requests.", ("model", "outcome"))
+    c.inc(model="llama3", outcome="ok")
+    c.inc(2, model="llama3", outcome="ok")
+    c.inc(model='say "hi"\n', outcome="error")
+    assert c.render() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{model="llama3",outcome="ok"} 3',
+        'requests_total{model="say \\"hi\\"\\n",outcome="error"} 1',
+    ]
+
+
+def test_gauge_goes_up_and_down():
+    g = Gauge("inflight", "In flight.")
+    g.inc()
+    g.inc()
+    g.dec()
+    assert g.render()[-1] == "inflight 1"
+    g.set(0.5)
+    assert g.render()[-1] == "inflight 0.5"
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        h.observe(value, stage="plan")
+    assert h.render()[2:] == [
+        'latency_seconds_bucket{stage="plan",le="0.1"} 1',
+        'latency_seconds_bucket{stage="plan",le="1"} 3',
+        'latency_seconds_bucket{stage="plan",le="+Inf"} 4',
+        'latency_seconds_sum{stage="plan"} 4.25',
+        'latency_seconds_count{stage="plan"} 4',
+    ]
+
+
+def test_callback_is_sampled_at_scrape_time_and_survives_errors():
+    source = {"hits": 1}
+    cb = Callback("cache_hits_total", "Hits.", ("event",), lambda: {("hits",): source["hits"]}, kind="counter")
+    source["hits"] = 5
+    assert cb.render()[1:] == ["# TYPE cache_hits_total counter", 'cache_hits_total{event="hits"} 5']
+    broken = Callback("broken", "Broken.", (), lambda: 1 / 0)
+    assert broken.render() == ["# HELP broken Broken.", "# TYPE broken gauge"]
+
+
+def _stage(stage, detail=""):
+    series = metrics.STAGE_SECONDS._series.get((stage, detail))
+    errors = metrics.STAGE_ERRORS._values.get((stage, detail), 0)
+    return (series[-1] if series else 0), errors
+
+
+def test_span_times_the_block_and_counts_errors():
+    with span("test_stage", "ok"):
+        assert metrics.STAGE_INFLIGHT._values[("test_stage",)] == 1
+    assert _stage("test_stage", "ok") == (1, 0)
+    assert metrics.STAGE_INFLIGHT._values[("test_stage",)] == 0
+    with pytest.raises(ValueError):
+        with span("test_stage", "boom"):
+            raise ValueError
+    assert _stage("test_stage", "boom") == (1, 1)
+
+
+def test_render_includes_registered_metrics():
+    with span("test_render"):
+        pass
+    text = metrics.render()
+    assert "# TYPE agent_stage_seconds histogram" in text
+    assert 'agent_stage_seconds_count{stage="test_render",detail=""} 1' in text
+    assert text.endswith("\n")
+
+
+def test_disabled_metrics_are_no_ops():
+    code = (
+        "from app import metrics\n"
+        "c = metrics.counter('x_total', 'X.')\n"
+        "c.inc(); c.observe(1)\n"
+        "with metrics.span('stage'):\n"
+        "    pass\n"
+        "assert c is metrics._NOOP and metrics.span('s') is metrics._NOOP\n"
+        "print(repr(metrics.render()))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], env={"METRICS": "0", "PATH": ""},
+                         capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == repr("\n")
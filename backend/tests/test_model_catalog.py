@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from app import llm_handler
+from app.llm_handler import ModelCatalog
+
+
+class FakeOllama:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.models = [{"model": "llama3:latest", "size": 1, "details": {"family": "llama"}}]
+
+    async def list(self):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("Ollama is down")
+        return {"models": self.models}
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    fake = FakeOllama()
+
+    async def resident(force=False):
+        return {}
+    monkeypatch.setattr(llm_handler, "_get_async_client", lambda: fake)
+    monkeypatch.setattr(llm_handler.RESIDENCY, "refresh", resident)
+    monkeypatch.setattr(llm_handler, "MODELS_RETRY_SECONDS", 0.2)
+    return fake
+
+
+def test_fresh_catalog_is_served_from_cache(ollama):
+    async def run():
+        catalog = ModelCatalog()
+        first = await catalog.get()
+        second = await catalog.get()
+        return first, second
+    (models, etag), second = asyncio.run(run())
+    assert [m["name"] for m in models] == ["llama3:latest"]
+    assert second == (models, etag) and ollama.calls == 1
+
+
+def test_failed_refresh_backs_off(ollama):
+    ollama.fail = True
+
+    async def run():
+        catalog = ModelCatalog()
+        results = [await catalog.get() for _ in range(5)]
+        calls_during_backoff = ollama.calls
+        await asyncio.sleep(0.25)
+        await catalog.get()
+        return catalog, results, calls_during_backoff
+    catalog, results, calls_during_backoff = asyncio.run(run())
+    assert calls_during_backoff == 1
+    assert ollama.calls == 2
+    assert all(models == [] for models, _ in results)
+    assert catalog.error == "Ollama is down"
+
+
+def test_backoff_doubles_after_consecutive_failures(ollama):
+    ollama.fail = True
+
+    async def run():
+        catalog = ModelCatalog()
+        await catalog.get()
+        await asyncio.sleep(0.25)
+        await catalog.get()                 # second failure: next try 0.4 s out
+        await asyncio.sleep(0.25)
+        await catalog.get()
+        return ollama.calls
+    assert asyncio.run(run()) == 2
+
+
+def test_etag_changes_with_the_error_alone(ollama):
+    async def run():
+        catalog = ModelCatalog()
+        _, ok_etag = await catalog.get()
+        ollama.fail = True
+        await catalog.refresh()
+        _, error_etag = await catalog.get()
+        ollama.fail = False
+        catalog.invalidate()
+        await asyncio.sleep(0)
+        await catalog.refresh()
+        return catalog, ok_etag, error_etag
+    catalog, ok_etag, error_etag = asyncio.run(run())
+    assert catalog.models and error_etag != ok_etag
+    assert catalog.error is None and catalog.etag == ok_etag
+
+
+def test_invalidate_ends_the_backoff(ollama):
+    ollama.fail = True
+
+    async def run():
+        catalog = ModelCatalog()
+        await catalog.get()
+        ollama.fail = False
+        catalog.invalidate()
+        return await catalog.get(), catalog.error
+    (models, _), error = asyncio.run(run())
+    assert models and error is None and ollama.calls == 2
+
+
+def test_if_none_match_accepts_lists_weak_tags_and_wildcard():
+    from app.api import _etag_matches
+    assert _etag_matches('"a", W/"b"', '"b"')
+    assert _etag_matches("*", '"b"')
+    assert not _etag_matches('"a"', '"b"')
+    assert not _etag_matches(None, '"b"') and not _etag_matches('"b"', "")
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from app.plan_parser import JSON_REPAIR_AVAILABLE, PlanStreamParser, parse_correction, parse_plan_text
+
+PLAN = [
+    {"tool": "code_interpreter", "description": "braces in strings",
+     "code": "print('{not a brace}')\nrows = [{\"a\": 1}]\nprint(\"]}\\\" [{\")"},
+    {"tool": "browser", "description": "nested", "input": "x", "options": {"a": [1, {"b": {"c": []}}], "d": "}"}},
+    {"tool": "shell_terminal", "description": "escapes \\\\ and \\\"", "command": ["echo", "\\\\}"]},
+]
+TEXT = json.dumps(PLAN, indent=1)
+needs_repair = pytest.mark.skipif(not JSON_REPAIR_AVAILABLE, reason="json_repair not installed")
+
+
+def _stream(text, size):
+    parser = PlanStreamParser()
+    tasks = []
+    for i in range(0, len(text), size):
+        tasks.extend(parser.feed(text[i:i + size]))
+    return tasks + parser.close(), parser
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 16, 64, len(TEXT)])
+def test_every_chunking_yields_the_same_tasks(size):
+    tasks, parser = _stream(TEXT, size)
+    assert tasks == PLAN
+    assert parser.failed == [] and parser.repaired == 0 and parser.pending == ""
+
+
+def test_a_task_is_handed_out_as_soon_as_its_brace_closes():
+    parser = PlanStreamParser()
+    _, first_end = json.JSONDecoder().raw_decode(TEXT, TEXT.index("{"))
+    assert parser.feed(TEXT[:first_end - 1]) == []
+    assert parser.feed(TEXT[first_end - 1:first_end]) == [PLAN[0]]
+
+
+def test_fences_and_chatter_around_the_array_are_skipped():
+    text = "Here is the plan:\n```json\n" + TEXT + "\n```\nLet me know [if] you need more."
+    assert _stream(text, 5)[0] == PLAN
+
+
+def test_wrapper_objects_are_unwrapped():
+    assert parse_plan_text(json.dumps({"steps": PLAN})) == PLAN
+
+
+def test_missing_description_gets_a_default():
+    task = parse_correction('{"tool": "shell_terminal", "command": ["ls"]}', default_description="List files")
+    assert task["description"] == "List files"
+
+
+@needs_repair
+def test_truncated_tail_is_repaired_on_close():
+    text = TEXT[:TEXT.rindex('"command"')] + '"command": ["echo"'
+    tasks, parser = _stream(text, 7)
+    assert tasks[:2] == PLAN[:2]
+    assert tasks[2]["tool"] == "shell_terminal" and tasks[2]["command"] == ["echo"]
+    assert parser.repaired == 1
+
+
+@needs_repair
+@pytest.mark.parametrize("size", [1, 4, 9, 1000])
+def test_task_missing_its_closing_brace_is_not_swallowed(size):
+    text = ('[{"tool": "shell_terminal", "description": "List", "command": ["ls"]},\n'
+            ' {"tool": "shell_terminal", "description": "Echo", "command": ["echo", "hi"]\n'
+            ' {"tool": "code_interpreter", "description": "Py", "code": "print(1)"}]')
+    tasks, _ = _stream(text, size)
+    assert [t["description"] for t in tasks] == ["List", "Echo", "Py"]
+
+
+@needs_repair
+def test_one_bad_task_does_not_lose_its_neighbours():
+    text = ('[{"tool": "browser", "description": "a", "input": "x"},'
+            " {'tool': 'shell_terminal', 'description': 'b', 'command': ['ls'],},"
+            ' {"tool": "browser", "description": "c", "input": "y"}]')
+    tasks = parse_plan_text(text)
+    assert [t["description"] for t in tasks] == ["a", "b", "c"]
+
+
+def test_empty_array_is_an_empty_plan():
+    assert parse_plan_text("[]") == []
+
+
+def test_text_without_json_is_rejected():
+    with pytest.raises(ValueError):
+        parse_plan_text("I cannot help with that.")
+
+
+def test_task_without_tool_is_a_planning_error():
+    with pytest.raises(ValueError):
+        parse_plan_text('[{"description": "no tool"}]')
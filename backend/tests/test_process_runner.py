@@ -0,0 +1,144 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+from app.tools import process_runner
+from app.tools.process_runner import OutputBuffer, WebSocketLineSink, run_process
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # a zombie still answers kill(0); it is dead for our purposes
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().split(")")[-1].split()[0] != "Z"
+
+
+def test_output_and_exit_code():
+    res = asyncio.run(run_process(
+        [sys.executable, "-c", "import sys; print('out'); print('err', file=sys.stderr); sys.exit(3)"],
+        timeout=10,
+    ))
+    assert (res.returncode, res.stdout, res.stderr) == (3, "out\n", "err\n")
+    assert not res.timed_out and not res.truncated
+
+
+def test_stdin_is_passed_through():
+    res = asyncio.run(run_process([sys.executable, "-c", "print(input()[::-1])"],
+                                  timeout=10, stdin_data=b"abc\n"))
+    assert res.stdout == "cba\n"
+
+
+def test_missing_executable_raises_like_subprocess():
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(run_process(["/nonexistent/tool"], timeout=5))
+
+
+def test_lines_are_streamed_while_the_process_runs():
+    seen = []
+
+    async def on_line(stream, line):
+        seen.append((time.monotonic(), stream, line))
+
+    code = "import sys, time\nprint('first', flush=True)\ntime.sleep(0.5)\nprint('second')"
+    start = time.monotonic()
+    res = asyncio.run(run_process([sys.executable, "-c", code], timeout=10, on_line=on_line))
+    end = start + res.duration
+    assert [(s, l) for _, s, l in seen] == [("stdout", "first"), ("stdout", "second")]
+    assert end - seen[0][0] >= 0.4          # "first" arrived before the sleep ended
+
+
+def test_timeout_kills_the_whole_process_group(tmp_path):
+    pid_file = tmp_path / "child.pid"
+    code = (
+        "import subprocess, sys, time\n"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        f"open({str(pid_file)!r}, 'w').write(str(child.pid))\n"
+        "time.sleep(60)\n"
+    )
+    res = asyncio.run(run_process([sys.executable, "-c", code], timeout=1))
+    assert res.timed_out
+    grandchild = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while _alive(grandchild) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not _alive(grandchild)
+
+
+def test_cancellation_kills_the_process(tmp_path):
+    pid_file = tmp_path / "proc.pid"
+    code = f"import os, time; open({str(pid_file)!r}, 'w').write(str(os.getpid())); time.sleep(60)"
+
+    async def run():
+        task = asyncio.create_task(run_process([sys.executable, "-c", code], timeout=60))
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(run())
+    assert not _alive(int(pid_file.read_text()))
+
+
+def test_long_output_keeps_head_and_tail():
+    code = "for i in range(10000): print(f'line {i}')"
+    res = asyncio.run(run_process([sys.executable, "-c", code], timeout=10,
+                                  head_chars=100, tail_chars=100))
+    assert res.truncated
+    assert res.stdout.startswith("line 0\nline 1\n")
+    assert res.stdout.endswith("line 9998\nline 9999\n")
+    assert "lines /" in res.stdout and len(res.stdout) < 300
+
+
+def test_output_buffer_counts_what_it_drops():
+    buf = OutputBuffer(head_chars=10, tail_chars=10)
+    for line in ["aaaa\n", "bbbb\n", "cccc\n", "dddd\n", "eeee\n"]:
+        buf.append(line)
+    assert buf.truncated
+    assert (buf.dropped_lines, buf.dropped_chars) == (1, 5)
+    assert buf.text() == "aaaa\nbbbb\n\n… [1 lines / 5 chars omitted] …\ndddd\neeee\n"
+
+
+def test_output_buffer_short_output_is_unchanged():
+    buf = OutputBuffer(head_chars=10, tail_chars=10)
+    buf.append("hi\n")
+    assert not buf.truncated and buf.text() == "hi\n"
+
+
+def test_output_buffer_clips_an_oversized_line():
+    buf = OutputBuffer(head_chars=0, tail_chars=5)
+    buf.append("0123456789")
+    assert buf.text().endswith("56789") and buf.dropped_chars == 5
+
+
+def test_sink_batches_lines_into_one_frame(websocket, monkeypatch):
+    monkeypatch.setattr(process_runner, "LINE_FLUSH_SECONDS", 0.05)
+
+    async def run():
+        sink = WebSocketLineSink(websocket, "shell")
+        await sink("stdout", "one")
+        await sink("stderr", "two")
+        await asyncio.sleep(0.15)
+        await sink("stdout", "three")
+        await sink.flush()
+    asyncio.run(run())
+    assert websocket.sent == ["Agent Output (shell):\none\n[stderr] two",
+                              "Agent Output (shell):\nthree"]
+
+
+def test_sink_summarises_a_flood_and_filters_streams(websocket, monkeypatch):
+    monkeypatch.setattr(process_runner, "SINK_MAX_BATCH", 4)
+
+    async def run():
+        sink = WebSocketLineSink(websocket, "code", streams=("stdout",))
+        for i in range(10):
+            await sink("stdout", str(i))
+        await sink("stderr", "hidden")
+        await sink.flush()
+    asyncio.run(run())
+    assert websocket.sent == ["Agent Output (code):\n0\n1\n… (6 lines) …\n8\n9"]
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from app.tools import sandbox_pool
+from app.tools.process_runner import tree_rss_mb
+
+pytestmark = pytest.mark.skipif(not sandbox_pool.SANDBOX_ENABLED, reason="forkserver sandbox unavailable")
+
+
+def _run(code, timeout=20):
+    return asyncio.run(sandbox_pool.run_snippet(code, timeout))
+
+
+def test_snippet_output_and_exit_code():
+    res = _run("import sys\nprint('out')\nprint('err', file=sys.stderr)\nsys.exit(3)")
+    assert (res.returncode, res.stdout.strip(), res.stderr.strip()) == (3, "out", "err")
+    assert res.killed_reason is None
+
+
+def test_exception_traceback_starts_at_the_snippet():
+    res = _run("x = 1\nraise ValueError('boom')")
+    assert res.returncode == 1
+    assert 'File "<snippet>", line 2' in res.stderr and "ValueError: boom" in res.stderr
+    assert "_sandbox_main" not in res.stderr
+
+
+def test_snippets_do_not_share_state():
+    assert _run("import json\njson.SHARED = 1").returncode == 0
+    assert _run("import json\nprint(hasattr(json, 'SHARED'))").stdout.strip() == "False"
+
+
+def test_starting_the_zygote_leaves_the_environment_alone():
+    before = dict(os.environ)
+    asyncio.run(sandbox_pool.prewarm())
+    assert _run("print(1)").returncode == 0
+    assert dict(os.environ) == before
+
+
+def test_wall_clock_timeout_kills_the_snippet():
+    res = _run("import time\ntime.sleep(30)", timeout=1)
+    assert res.timed_out and res.killed_reason == "timeout"
+
+
+def test_cpu_limit_is_labelled(monkeypatch):
+    monkeypatch.setattr(sandbox_pool, "SANDBOX_CPU_SECONDS", 1)
+    res = _run("while True:\n    pass")
+    assert res.returncode != 0 and res.killed_reason == "cpu"
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="RSS is read from /proc")
+def test_memory_limit_kills_the_snippet(monkeypatch):
+    monkeypatch.setattr(sandbox_pool, "SANDBOX_MAX_RSS_MB", 300)
+    res = _run("import time\nblob = b'x' * (600 << 20)\ntime.sleep(10)")
+    assert res.killed_reason == "memory"
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="RSS is read from /proc")
+def test_tree_rss_counts_the_current_process():
+    assert tree_rss_mb(os.getpid()) > 1
+    assert tree_rss_mb(2 ** 22 + 12345) == 0
@@ -0,0 +1,30 @@
+from app.session import REPLAN_MODES, SessionContext
+
+
+def test_message_fields_override_and_missing_ones_keep_previous_choices():
+    first = SessionContext.from_request({"planner_model": "p1", "browser_model": "b1"}, client="c")
+    second = SessionContext.from_request({"planner_model": "p2"}, client="c", previous=first)
+    assert (second.planner_model, second.browser_model) == ("p2", "b1")
+    assert second.session_id == first.session_id
+
+
+def test_each_request_gets_a_fresh_cancellation_state():
+    first = SessionContext.from_request({}, client="c")
+    first.cancel("superseded")
+    second = SessionContext.from_request({}, client="c", previous=first)
+    assert first.is_cancelled and first.cancel_reason == "superseded"
+    assert not second.is_cancelled and second.cancel_reason is None
+
+
+def test_bypass_cache_and_replan_are_per_request():
+    first = SessionContext.from_request({"bypass_cache": True, "replan": "every_step"}, client="c")
+    assert not first.use_cache and first.replan == "every_step"
+    second = SessionContext.from_request({"replan": "sometimes"}, client="c", previous=first)
+    assert second.use_cache
+    assert second.replan == "every_step"          # unknown mode: keep the previous one
+    assert set(REPLAN_MODES) == {"off", "on_failure", "every_step"}
+
+
+def test_unknown_fields_are_ignored():
+    ctx = SessionContext.from_request({"code_model": "deepcoder:latest"}, client="c")
+    assert not hasattr(ctx, "code_model")
@@ -0,0 +1,106 @@
+import asyncio
+
+from app import step_results
+from app.step_results import StepResultStore, compress, estimate_tokens
+
+
+def test_short_output_is_kept_as_is():
+    assert compress("line 1\nline 2", 100) == "line 1\nline 2"
+
+
+def test_blank_runs_and_repeated_lines_are_folded():
+    text = "start\n\n\n\nsame\nsame\nsame\nend\n"
+    assert compress(text, 100) == "start\n\nsame\n  (previous line repeated 2×)\nend"
+
+
+def test_long_output_keeps_head_and_tail_within_budget():
+    text = "\n".join(f"row {i}" for i in range(1000))
+    out = compress(text, 50)
+    assert out.startswith("row 0\n") and out.endswith("row 999")
+    assert "chars omitted" in out
+    assert estimate_tokens(out) <= 50 + 10
+
+
+def test_errors_keep_more_of_the_tail():
+    text = "\n".join(f"frame {i}" for i in range(1000))
+    both, tail = compress(text, 50), compress(text, 50, keep="tail")
+    assert len(tail.split("…")[-1]) > len(both.split("…")[-1])
+
+
+def _store(**kw):
+    store = StepResultStore(**kw)
+    for i, out in enumerate(["a" * 40, "b" * 40, "c" * 40, "d" * 40]):
+        store.record(i, {"tool": "shell_terminal", "description": f"step {i}"}, out, "done")
+    return store
+
+
+def test_context_lists_dependencies_then_recent_steps_in_order():
+    store = _store()
+    context = store.context_for(3, deps={0})
+    assert [line.split(" [")[0] for line in context.split("\n\n")] == ["Step 1", "Step 2", "Step 3"]
+    assert "d" * 40 not in context                     # the step's own result is never included
+
+
+def test_budget_drops_the_oldest_non_dependencies_first():
+    store = _store(context_tokens=40)
+    context = store.context_for(4, deps={0})
+    assert "Step 1 " in context and "Step 4 " in context
+    assert "Step 2 " not in context and "Step 3 " not in context
+    assert estimate_tokens(context) <= 40
+
+
+def test_a_large_dependency_is_shortened_rather_than_dropped():
+    store = StepResultStore(result_tokens=500, context_tokens=80)
+    store.record(0, {"tool": "browser", "description": "fetch"}, "x" * 1600, "done")
+    context = store.context_for(1, deps={0})
+    assert context.startswith("Step 1 [browser, done] fetch:") and "omitted" in context
+    assert estimate_tokens(context) <= 80
+
+
+def test_recorded_results_are_compressed_and_counted():
+    store = StepResultStore(result_tokens=10)
+    store.record(0, {"tool": "code_interpreter"}, "y" * 1000, "error")
+    result = store.results[0]
+    assert result.description == "code_interpreter step" and result.status == "error"
+    assert store.stats() == {"steps": 1, "raw_chars": 1000, "kept_chars": len(result.text)}
+    assert len(result.text) < 100
+
+
+class _Ctx:
+    planner_model = "planner"
+    use_cache = False
+
+
+def test_summaries_replace_the_truncated_form(monkeypatch):
+    calls = []
+
+    async def asimple_prompt(model, prompt, **kwargs):
+        calls.append((model, kwargs["cache"]))
+        return "  Found 3 files: a.txt, b.txt, c.txt  "
+    monkeypatch.setattr(step_results, "asimple_prompt", asimple_prompt)
+
+    async def run():
+        store = StepResultStore(_Ctx(), result_tokens=20, summarize=True)
+        store.record(0, {"tool": "shell_terminal"}, "z" * 1000, "done")
+        store.record(1, {"tool": "shell_terminal"}, "short", "done")
+        store.record(2, {"tool": "shell_terminal"}, "e" * 1000, "error")   # failures are not summarised
+        await asyncio.gather(*store._summaries)
+        return store
+    store = asyncio.run(run())
+    assert calls == [("planner", False)]
+    assert store.results[0].text == "Found 3 files: a.txt, b.txt, c.txt"
+
+
+def test_aclose_cancels_pending_summaries(monkeypatch):
+    async def asimple_prompt(model, prompt, **kwargs):
+        await asyncio.sleep(60)
+    monkeypatch.setattr(step_results, "asimple_prompt", asimple_prompt)
+
+    async def run():
+        store = StepResultStore(_Ctx(), result_tokens=20, summarize=True)
+        store.record(0, {"tool": "shell_terminal"}, "z" * 1000, "done")
+        await asyncio.sleep(0)
+        await asyncio.wait_for(store.aclose(), 1)
+        return store
+    store = asyncio.run(run())
+    assert not store._summaries and "omitted" in store.results[0].text
@@ -0,0 +1,156 @@
+import time
+
+import pytest
+
+from app.cache import SQLiteLRUCache
+from app.tool_cache import ToolResultCache, cache_rule, is_pure_code
+
+
+def _shell(command):
+    return {"tool": "shell_terminal", "command": command}
+
+def _code(code):
+    return {"tool": "code_interpreter", "code": code}
+
+
+@pytest.mark.parametrize("code", [
+    "print(sum(range(10)))",
+    "import math\nprint(math.sqrt(2))",
+    "from collections import Counter\nprint(Counter('abca'))",
+    "import json, re\nprint(json.dumps(re.findall('a', 'banana')))",
+])
+def test_pure_snippets(code):
+    assert is_pure_code(code)
+
+
+@pytest.mark.parametrize("code", [
+    "import random\nprint(random.random())",
+    "import time\nprint(time.time())",
+    "import os\nprint(os.listdir('.'))",
+    "import numpy as np\nprint(np.zeros(3))",
+    "from datetime import datetime\nprint(datetime.now())",
+    "from . import x",
+    "print(open('data.txt').read())",
+    "x = input()",
+    "eval('1 + 1')",
+    "print(hash('a'))",
+    "__import__('os').system('ls')",
+    "df.to_csv('out.csv')",
+    "fig.savefig('plot.png')",
+    "print(",
+])
+def test_impure_snippets(code):
+    assert not is_pure_code(code)
+
+
+def test_shell_rules():
+    assert cache_rule(_shell(["echo", "hi"])).key is not None
+    fs = cache_rule(_shell(["ls", "-la"]))
+    assert fs.key is not None and fs.tag == "fs"
+    assert cache_rule(_shell(["date"])).key is None
+    mkdir = cache_rule(_shell(["mkdir", "x"]))
+    assert mkdir.key is None and mkdir.invalidates_fs
+    assert cache_rule(_shell(["echo 'unterminated"])).key is None
+    assert cache_rule({"tool": "browser", "instructions": "x"}).key is None
+
+
+def test_keys_are_normalised():
+    assert cache_rule(_shell(["echo", "a  b"])).key == cache_rule(_shell(["echo", "a", "b"])).key
+    assert cache_rule(_shell(["echo", "a"])).key != cache_rule(_shell(["echo", "b"])).key
+    crlf = cache_rule(_code("x = 1  \r\nprint(x)\r\n")).key
+    assert crlf == cache_rule(_code("x = 1\nprint(x)")).key
+    assert crlf != cache_rule(_shell(["x = 1\nprint(x)"])).key
+
+
+def test_impure_code_is_never_cached_and_drops_fs_entries():
+    rule = cache_rule(_code("import os\nos.remove('a')"))
+    assert rule.key is None and rule.invalidates_fs
+
+
+@pytest.fixture
+def tool_cache(tmp_path):
+    return ToolResultCache(str(tmp_path), enabled=True)
+
+
+def test_successful_results_are_returned_on_the_next_lookup(tool_cache):
+    task = _code("print(2 ** 10)")
+    rule, hit = tool_cache.lookup(task)
+    assert hit is None
+    tool_cache.record(rule, "Exit Code: 0\nOutput:\n1024")
+    assert tool_cache.lookup(dict(task))[1] == "Exit Code: 0\nOutput:\n1024"
+    assert tool_cache.counters["code_interpreter"] == {"hits": 1, "misses": 1, "uncacheable": 0}
+
+
+def test_failures_and_uncacheable_calls_are_not_stored(tool_cache):
+    rule, _ = tool_cache.lookup(_shell(["cat", "missing.txt"]))
+    tool_cache.record(rule, "Exit Code: 1\nError: no such file")
+    assert tool_cache.lookup(_shell(["cat", "missing.txt"]))[1] is None
+    tool_cache.lookup(_shell(["date"]))
+    assert tool_cache.counters["shell_terminal"]["uncacheable"] == 1
+
+
+def test_mutating_command_invalidates_fs_reads(tool_cache):
+    ls, _ = tool_cache.lookup(_shell(["ls"]))
+    tool_cache.record(ls, "Exit Code: 0\nOutput:\na.txt")
+    echo, _ = tool_cache.lookup(_shell(["echo", "hi"]))
+    tool_cache.record(echo, "Exit Code: 0\nOutput:\nhi")
+    touch, _ = tool_cache.lookup(_shell(["touch", "b.txt"]))
+    tool_cache.record(touch, "Exit Code: 0")
+    assert tool_cache.lookup(_shell(["ls"]))[1] is None
+    assert tool_cache.lookup(_shell(["echo", "hi"]))[1] is not None
+
+
+def test_disabled_cache_never_answers(tmp_path):
+    cache = ToolResultCache(str(tmp_path), enabled=False)
+    rule, _ = cache.lookup(_shell(["echo", "hi"]))
+    cache.record(rule, "Exit Code: 0")
+    assert cache.lookup(_shell(["echo", "hi"]))[1] is None
+    assert cache.stats() == {"enabled": False, "per_tool": {}}
+
+
+# ───────────────────────────────────────────────── SQLiteLRUCache
+def test_entries_expire_after_their_ttl(tmp_path):
+    cache = SQLiteLRUCache(str(tmp_path / "c.sqlite"), default_ttl=0.05)
+    cache.put("a", "1")
+    cache.put("b", "2", ttl=60)
+    assert cache.get("a") == "1"
+    time.sleep(0.1)
+    assert cache.get("a") is None and cache.get("b") == "2"
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = SQLiteLRUCache(str(tmp_path / "c.sqlite"), max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert [cache.get(k) for k in "abc"] == ["1", None, "3"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_size_bound(tmp_path):
+    cache = SQLiteLRUCache(str(tmp_path / "c.sqlite"), max_bytes=10)
+    cache.put("big", "x" * 11)
+    cache.put("a", "12345")
+    cache.put("b", "67890")
+    cache.put("c", "!")
+    stats = cache.stats()
+    assert cache.get("big") is None and cache.get("a") is None
+    assert stats["entries"] == 2 and stats["bytes"] == 6
+
+
+def test_invalidate_tag_and_stats(tmp_path):
+    cache = SQLiteLRUCache(str(tmp_path / "c.sqlite"))
+    cache.put("a", "1", tag="fs")
+    cache.put("b", "2", tag="fs")
+    cache.put("c", "3")
+    assert cache.invalidate_tag("fs") == 2
+    assert cache.get("a") is None and cache.get("c") == "3"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_cache_survives_a_reopen(tmp_path):
+    path = str(tmp_path / "c.sqlite")
+    SQLiteLRUCache(path).put("k", "v")
+    assert SQLiteLRUCache(path).get("k") == "v"